@@ -0,0 +1,83 @@
+"""
+Throughput of RSA signing and decryption in CryptoPool at different count of workers
+
+Operations are submitted at once and results are delivered in the main thread,
+as the reactor does it. 'inline' is the same work in the main thread.
+
+Usage: python3 bench_crypto_pool.py [operations] [batch size]
+"""
+
+import sys
+sys.path.append('../')
+
+import queue
+import time
+
+from twisted.internet import defer
+
+from hodl_net.cryptogr import gen_keys, sign, hybrid_encrypt, hybrid_decrypt, CryptoPool
+
+WORKERS = [1, 2, 4, 8]
+
+
+class Pump:
+
+    def __init__(self):
+        self.calls = queue.Queue()
+
+    def callFromThread(self, f, *args):
+        self.calls.put((f, args))
+
+    def run_until(self, d: defer.Deferred):
+        results = []
+        d.addBoth(results.append)
+        while not results:
+            f, args = self.calls.get()
+            f(*args)
+        return results[0]
+
+
+def bench_pool(workers, batch_size, operations, private_key):
+    clock = Pump()
+    pool = CryptoPool(clock, workers, batch_size)
+    try:
+        clock.run_until(defer.gatherResults([pool.sign('warm up', private_key)
+                                             for _ in range(workers * 2)]))
+        rates = []
+        for name, args in operations:
+            start = time.perf_counter()
+            clock.run_until(defer.gatherResults([pool.submit(name, *arg) for arg in args]))
+            rates.append(len(args) / (time.perf_counter() - start))
+        return rates
+    finally:
+        pool.stop()
+
+
+def main(count=2000, batch_size=32):
+    count, batch_size = int(count), int(batch_size)
+    private_key, public_key = gen_keys()
+    texts = [f'message {i}' * 20 for i in range(count)]
+    ciphertexts = [hybrid_encrypt(text, public_key) for text in texts]
+    operations = [
+        ('sign', [(text, private_key) for text in texts]),
+        ('hybrid_decrypt', [(text, private_key) for text in ciphertexts])
+    ]
+
+    print(f'{count} operations, batch size {batch_size}')
+    print(f'{"workers":<8} {"sign/s":>9} {"decrypt/s":>10}')
+    start = time.perf_counter()
+    for text in texts:
+        sign(text, private_key)
+    sign_rate = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for text in ciphertexts:
+        hybrid_decrypt(text, private_key)
+    decrypt_rate = count / (time.perf_counter() - start)
+    print(f'{"inline":<8} {sign_rate:>9.0f} {decrypt_rate:>10.0f}')
+    for workers in WORKERS:
+        sign_rate, decrypt_rate = bench_pool(workers, batch_size, operations, private_key)
+        print(f'{workers:<8} {sign_rate:>9.0f} {decrypt_rate:>10.0f}')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
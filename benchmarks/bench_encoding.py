@@ -0,0 +1,44 @@
+"""
+Compare 'json' and 'binary' wire encodings of MessageWrapper
+
+Usage: python3 bench_encoding.py [number]
+"""
+
+import sys
+sys.path.append('../')
+
+import timeit
+
+from hodl_net.cryptogr import gen_keys
+from hodl_net.models import Message, MessageWrapper
+
+
+def wrappers(private_key, public_key):
+    message = Message('echo', {'msg': 'test'})
+    yield 'request', MessageWrapper(message, 'request')
+
+    shout = MessageWrapper(message, 'shout', sender='node')
+    shout.create_sign(private_key)
+    yield 'shout', shout
+
+    encrypted = MessageWrapper(Message('data', {'payload': 'x' * 1024}), sender='node',
+                               cipher='rsa-aes-gcm')
+    encrypted.prepare(private_key, public_key)
+    yield 'message 1KB', encrypted
+
+
+def main(number=10000):
+    private_key, public_key = gen_keys()
+    print(f'{"wrapper":<12} {"encoding":<8} {"bytes":>6} {"encode/s":>10} {"decode/s":>10}')
+    for name, wrapper in wrappers(private_key, public_key):
+        for encoding in MessageWrapper.acceptable_encodings:
+            wrapper.encoding = encoding
+            data = wrapper.to_bytes()
+            enc_time = timeit.timeit(wrapper.to_bytes, number=number)
+            dec_time = timeit.timeit(lambda: MessageWrapper.from_bytes(data), number=number)
+            print(f'{name:<12} {encoding:<8} {len(data):>6} {number / enc_time:>10.0f} '
+                  f'{number / dec_time:>10.0f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,46 @@
+"""
+Compare 'rsa' and 'rsa-aes-gcm' encryption modes of MessageWrapper
+
+Usage: python3 bench_encryption.py [repeat]
+"""
+
+import sys
+sys.path.append('../')
+
+import timeit
+
+from hodl_net.cryptogr import gen_keys
+from hodl_net.models import Message, MessageWrapper
+
+SIZES = [1024, 16 * 1024, 64 * 1024]
+CIPHERS = ['rsa', 'rsa-aes-gcm']
+
+
+def bench(cipher, size, private_key, public_key, repeat):
+    message = Message('bench', {'payload': 'x' * size})
+
+    def encrypt():
+        return MessageWrapper(message, cipher=cipher).encrypt(public_key)
+
+    ciphertext = encrypt()
+
+    def decrypt():
+        MessageWrapper(ciphertext, cipher=cipher).decrypt(private_key)
+
+    enc_time = min(timeit.repeat(encrypt, number=1, repeat=repeat))
+    dec_time = min(timeit.repeat(decrypt, number=1, repeat=repeat))
+    return enc_time, dec_time, len(ciphertext)
+
+
+def main(repeat=5):
+    private_key, public_key = gen_keys()
+    print(f'{"cipher":<12} {"payload":>8} {"encrypt ms":>11} {"decrypt ms":>11} {"size":>8}')
+    for size in SIZES:
+        for cipher in CIPHERS:
+            enc_time, dec_time, length = bench(cipher, size, private_key, public_key, repeat)
+            print(f'{cipher:<12} {size // 1024:>6}KB {enc_time * 1000:>11.2f} '
+                  f'{dec_time * 1000:>11.2f} {length:>8}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,117 @@
+"""
+Coverage and message count of flood and gossip propagation on a simulated network
+
+Every node knows `degree` random peers. One shout is started at a random node
+and datagrams are delivered in FIFO order with `loss` probability of drop.
+Anti-entropy rounds run after propagation finished.
+
+Usage: python3 bench_gossip.py [nodes] [degree] [loss]
+"""
+
+import sys
+sys.path.append('../')
+
+from collections import deque
+import random
+import attr
+
+from hodl_net.gossip import Flood, Gossip
+from hodl_net.models import Message, MessageWrapper, Peer, SeenFilter
+from hodl_net.peer_table import PeerTable
+
+
+def address(i: int) -> str:
+    return f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}:8000'
+
+
+class SimProtocol:
+    """
+    Part of `PeerProtocol` used by propagation
+    """
+
+    def __init__(self, network: 'Network', addr: str):
+        self.network = network
+        self.addr = addr
+        self.peer_table = PeerTable(self)
+        self.seen = SeenFilter()
+        self.propagation = None
+
+    def _send(self, wrapper: MessageWrapper, addr: str, *_):
+        self.network.queue.append((attr.evolve(wrapper), self.addr, addr))
+        self.network.datagrams += 1
+
+    def receive(self, wrapper: MessageWrapper, source: str):
+        if wrapper.type == 'request':
+            handler = {
+                'gossip_digest': self.propagation.on_digest,
+                'gossip_want': self.propagation.on_want
+            }[wrapper.message.name]
+            return handler(wrapper.message, self.peer_table.get(source))
+        if self.seen.add(wrapper.id):
+            self.propagation.propagate(wrapper, source)
+
+
+class Network:
+
+    def __init__(self, nodes: int, degree: int, loss: float, mode, **options):
+        self.queue = deque()
+        self.datagrams = 0
+        self.loss = loss
+        self.nodes = {}
+        for i in range(nodes):
+            proto = SimProtocol(self, address(i))
+            proto.propagation = mode(proto, **options)
+            self.nodes[proto.addr] = proto
+        addrs = list(self.nodes)
+        for addr, proto in self.nodes.items():
+            for other in random.sample(addrs, degree + 1):
+                if other != addr:
+                    proto.peer_table.add(Peer(proto, addr=other))
+                    self.nodes[other].peer_table.add(Peer(self.nodes[other], addr=addr))
+
+    def run(self):
+        while self.queue:
+            wrapper, source, target = self.queue.popleft()
+            if random.random() >= self.loss:
+                self.nodes[target].receive(wrapper, source)
+
+    def shout(self, wrapper: MessageWrapper):
+        origin = random.choice(list(self.nodes.values()))
+        origin.seen.add(wrapper.id)
+        origin.propagation.propagate(wrapper)
+        self.run()
+        return self.coverage(wrapper.id)
+
+    def anti_entropy(self):
+        for proto in self.nodes.values():
+            proto.propagation.anti_entropy()
+        self.run()
+
+    def coverage(self, uid: str) -> float:
+        return sum(uid in proto.seen for proto in self.nodes.values()) / len(self.nodes)
+
+
+def main(nodes=1000, degree=16, loss=0.05):
+    nodes, degree, loss = int(nodes), int(degree), float(loss)
+    random.seed(1)
+    modes = [('flood', Flood, {})]
+    for fanout in (2, 3, 4, 6):
+        modes.append((f'gossip f={fanout}', Gossip, {'fanout': fanout, 'ttl': 16,
+                                                     'anti_entropy_interval': 1}))
+    print(f'{nodes} nodes, degree {degree}, loss {loss:.0%}')
+    print(f'{"mode":<12} {"coverage":>9} {"datagrams":>10} {"per node":>9} '
+          f'{"+1 AE round":>12} {"datagrams":>10}')
+    for name, mode, options in modes:
+        network = Network(nodes, degree, loss, mode, **options)
+        wrapper = MessageWrapper(Message('bench'), 'shout', sender='bench')
+        coverage = network.shout(wrapper)
+        datagrams = network.datagrams
+        row = f'{name:<12} {coverage:>9.1%} {datagrams:>10} {datagrams / nodes:>9.1f}'
+        if isinstance(network.nodes[address(0)].propagation, Gossip):
+            network.anti_entropy()
+            row += f' {network.coverage(wrapper.id):>12.1%} {network.datagrams:>10}'
+        print(row)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,240 @@
+"""
+Throughput and latency of N nodes in one process
+
+Nodes are full `Server`s connected by in-memory fabric (`hodl_net.loopback`)
+or by UDP sockets on 127.0.0.1. Workloads:
+
+* request - `Peer.request` with reply, between neighbour nodes
+* shout - `PeerProtocol.shout`, done when all other nodes handled it
+* encrypted - `PeerProtocol.send` to user of neighbour node with reply
+
+Results are printed as one JSON object, so runs of different commits can be
+compared with any JSON tool. CPU time is the time of the whole process,
+including executor threads.
+
+Usage: python3 bench_loopback.py [--nodes 8] [--messages 2000] [--concurrency 32]
+           [--workload request,shout,encrypted] [--transport memory|udp]
+           [--executor inline|default] [--set section.key=value ...] [--output file]
+"""
+
+import sys
+sys.path.append('../')
+
+import argparse
+import platform
+import tempfile
+import subprocess
+import json
+import os
+import time
+
+from twisted.internet import defer, reactor
+
+from hodl_net.server import server, conf_file
+from hodl_net.models import Message, User
+from hodl_net.database import db_worker, create_db
+from hodl_net.loopback import MemoryFabric, create_node, connect
+# Imported only to register the standard handlers.
+from hodl_net import net_protocol  # noqa: F401
+
+WORKLOADS = ['request', 'shout', 'encrypted']
+
+_shouts = {}
+
+
+class ShoutWaiter:
+
+    def __init__(self, count: int):
+        self.remaining = count
+        self.done = defer.Deferred()
+
+    def arrived(self):
+        self.remaining -= 1
+        if not self.remaining:
+            self.done.callback(None)
+
+
+def register_handlers(executor: str):
+
+    @server.handle('bench_echo', 'request', executor=executor)
+    async def bench_echo(message):
+        return Message('bench_echo_resp', message.data)
+
+    @server.handle('bench_shout', 'shout', executor=executor)
+    async def bench_shout(message):
+        waiter = _shouts.get(message.data['id'])
+        if waiter:
+            reactor.callFromThread(waiter.arrived)
+
+    @server.handle('bench_secret', 'message', executor=executor)
+    async def bench_secret(message):
+        return Message('bench_secret_resp', message.data)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0
+
+
+class Harness:
+
+    def __init__(self, count: int, transport: str):
+        self.transport = transport
+        self.fabric = MemoryFabric(reactor)
+        self.addrs = [('127.0.0.1', 20000 + i) for i in range(count)]
+        self.nodes = [self.create(addr) for addr in self.addrs]
+        connect(self.nodes, self.addrs)
+
+        ses = db_worker.get_session()
+        for seq, node in enumerate(self.nodes, 1):
+            ses.add(User(node.udp, name=node.udp.name, public_key=node.udp.public_key, seq=seq))
+        ses.commit()
+        db_worker.close_session(ses)
+
+    def create(self, addr):
+        if self.transport == 'memory':
+            return create_node(addr, self.fabric, r=reactor)
+        node = create_node(addr, r=reactor)
+        reactor.listenUDP(addr[1], node.udp, interface=addr[0])
+        return node
+
+    def pair(self, i: int):
+        source = self.nodes[i % len(self.nodes)]
+        target = self.nodes[(i + 1) % len(self.nodes)]
+        return source, target
+
+    async def request(self, i: int):
+        source, target = self.pair(i)
+        _peer = source.udp.peer_table.get(target.udp.name)
+        await _peer.request(Message('bench_echo', {'i': i}))
+
+    async def shout(self, i: int):
+        source, _ = self.pair(i)
+        uid = f'{id(self)}-{i}-{time.perf_counter()}'
+        waiter = _shouts[uid] = ShoutWaiter(len(self.nodes) - 1)
+        source.udp.shout(Message('bench_shout', {'id': uid}))
+        try:
+            await waiter.done
+        finally:
+            del _shouts[uid]
+
+    async def encrypted(self, i: int):
+        source, target = self.pair(i)
+        await source.udp.send(Message('bench_secret', {'i': i}), target.udp.name)
+
+    async def run(self, workload: str, count: int, concurrency: int) -> dict:
+        send = getattr(self, workload)
+        latencies = []
+
+        async def worker(first: int):
+            for i in range(first, count, concurrency):
+                started = time.perf_counter()
+                await send(i)
+                latencies.append(time.perf_counter() - started)
+
+        datagrams = self.fabric.sent
+        started, cpu_started = time.perf_counter(), time.process_time()
+        await defer.gatherResults([defer.ensureDeferred(worker(first))
+                                   for first in range(min(concurrency, count))],
+                                  consumeErrors=True)
+        seconds, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        return {
+            'workload': workload,
+            'messages': count,
+            'seconds': round(seconds, 4),
+            'messages_per_s': round(count / seconds, 1),
+            'latency_ms': {name: round(percentile(latencies, q) * 1000, 3)
+                           for name, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1))},
+            'cpu_us_per_message': round(cpu / count * 1e6, 1),
+            'datagrams': self.fabric.sent - datagrams if self.transport == 'memory' else None
+        }
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def apply_overrides(overrides):
+    for override in overrides:
+        key, value = override.split('=', 1)
+        section, option = key.rsplit('.', 1)
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        conf = conf_file
+        for part in section.split('.'):
+            conf = conf[part]
+        conf[option] = value
+
+
+async def bench(args) -> dict:
+    harness = Harness(args.nodes, args.transport)
+    results = []
+    for workload in args.workload.split(','):
+        await harness.run(workload, min(args.messages, 50), args.concurrency)  # Warm up
+        results.append(await harness.run(workload, args.messages, args.concurrency))
+    return {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'nodes': args.nodes,
+        'concurrency': args.concurrency,
+        'transport': args.transport,
+        'executor': args.executor,
+        'overrides': args.set,
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--nodes', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workload', default=','.join(WORKLOADS))
+    parser.add_argument('--transport', choices=['memory', 'udp'], default='memory')
+    parser.add_argument('--executor', choices=['inline', 'default'], default='inline')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='Override config value, e.g. pacing.enabled=false')
+    parser.add_argument('--output', help='Write JSON to file instead of stdout')
+    args = parser.parse_args()
+
+    apply_overrides(args.set)
+    register_handlers(args.executor)
+    directory = tempfile.mkdtemp(prefix='hodl_bench_')
+    db_worker.create_connection(os.path.join(directory, 'bench.sqlite'))
+    create_db()
+    for executor in server.executors.values():
+        executor.start()
+
+    report = {}
+
+    def done(result):
+        report.update(result)
+        reactor.stop()
+
+    def failed(failure):
+        print(failure.getTraceback(), file=sys.stderr)
+        reactor.stop()
+
+    reactor.callWhenRunning(lambda: defer.ensureDeferred(bench(args)).addCallbacks(done, failed))
+    reactor.run()
+    for executor in server.executors.values():
+        executor.stop()
+    if not report:
+        sys.exit(1)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Scaling study of N simulated nodes on virtual time
+
+Nodes run in one process on `hodl_net.simulation.Simulation`, with lossy
+datagram fabric and seeded randomness, so results of the same seed are
+repeated. Scenarios:
+
+* discovery - nodes start with `--degree` unsynced peers and discover others
+  by `share`, converged when every node knows `--coverage` of other nodes
+* shout - nodes are linked with `--degree` peers, `--shouts` shouts from
+  random nodes, converged when all other nodes handled the shout
+
+Every scenario runs on new network. Convergence times are virtual seconds,
+load is distribution of datagrams and bytes over nodes. Results are printed
+as one JSON object.
+
+Usage: python3 simulate.py [--nodes 1000] [--degree 8] [--scenario discovery,shout]
+           [--latency 0.05] [--jitter 0.02] [--loss 0] [--seed 0] [--shouts 5]
+           [--coverage 1] [--max-time 600] [--set section.key=value ...] [--output file]
+"""
+
+import sys
+sys.path.append('../')
+
+import argparse
+import platform
+import tempfile
+import json
+import os
+import time
+
+from hodl_net.server import server, conf_file
+from hodl_net.database import db_worker, create_db
+from hodl_net.cryptogr import gen_keys
+from hodl_net.metrics import registry
+from hodl_net.simulation import Simulation, distribution
+# Imported only to register the standard handlers.
+from hodl_net import net_protocol  # noqa: F401
+
+from bench_loopback import apply_overrides, commit
+
+SCENARIOS = ['discovery', 'shout']
+
+
+def dropped() -> dict:
+    return {key: value for key, value in registry.snapshot().items() if key.startswith('dropped')}
+
+
+def discovery(sim: Simulation, args) -> dict:
+    return sim.discover(args.coverage, args.max_time)
+
+
+def shout(sim: Simulation, args) -> dict:
+    traces = [sim.shout(timeout=args.max_time) for _ in range(args.shouts)]
+    others = len(sim.nodes) - 1
+    converged = [max(trace.arrivals.values()) for trace in traces if trace.done]
+    return {
+        'shouts': len(traces),
+        'converged': len(converged),
+        'converged_s': {key: round(value, 3) for key, value in distribution(converged).items()},
+        'coverage': {'min': round(min(len(trace.arrivals) for trace in traces) / others, 4),
+                     'mean': round(sum(len(trace.arrivals) for trace in traces)
+                                   / len(traces) / others, 4)},
+        'arrival_s': {key: round(value, 3) for key, value in distribution(
+            [delay for trace in traces for delay in trace.arrivals.values()]).items()}
+    }
+
+
+def simulate(scenario: str, keys, args) -> dict:
+    started, cpu_started = time.perf_counter(), time.process_time()
+    sim = Simulation(args.nodes, args.degree, args.latency, args.jitter, args.loss,
+                     args.seed, keys)
+    try:
+        if scenario == 'shout':
+            sim.link()
+            sim.run(args.warmup)  # Startup traffic settles
+            sim.fabric.reset()
+        created = time.perf_counter() - started
+        dropped_before = dropped()
+        virtual_started, events = sim.clock.now, sim.clock.events
+        result = {'scenario': scenario}
+        result.update(globals()[scenario](sim, args))
+        result.update({
+            'virtual_s': round(sim.clock.now - virtual_started, 3),
+            'events': sim.clock.events - events,
+            'datagrams': sim.fabric.sent,
+            'lost': sim.fabric.lost_count,
+            'bytes': sim.fabric.bytes,
+            'load': sim.fabric.load_stats(),
+            'dropped': {key: value - dropped_before.get(key, 0)
+                        for key, value in dropped().items()
+                        if value != dropped_before.get(key, 0)},
+            'setup_s': round(created, 3),
+            'wall_s': round(time.perf_counter() - started, 3),
+            'cpu_s': round(time.process_time() - cpu_started, 3)
+        })
+    finally:
+        sim.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--degree', type=int, default=8)
+    parser.add_argument('--scenario', default=','.join(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.05, help='One-way delay, seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Max extra delay, seconds')
+    parser.add_argument('--loss', type=float, default=0., help='Probability of datagram loss')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--shouts', type=int, default=5)
+    parser.add_argument('--coverage', type=float, default=1.,
+                        help='Fraction of other nodes to discover')
+    parser.add_argument('--max-time', type=float, default=600,
+                        help='Virtual seconds to give up after')
+    parser.add_argument('--warmup', type=float, default=5,
+                        help='Virtual seconds before the first shout')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='Override config value, e.g. propagation.mode=gossip')
+    parser.add_argument('--output', help='Write JSON to file instead of stdout')
+    args = parser.parse_args()
+
+    for scenario in args.scenario.split(','):
+        if scenario not in SCENARIOS:
+            parser.error(f'Unknown scenario {scenario}')
+    apply_overrides(args.set)
+    directory = tempfile.mkdtemp(prefix='hodl_sim_')
+    db_worker.create_connection(os.path.join(directory, 'sim.sqlite'))
+    create_db()
+    keys = gen_keys()
+
+    report = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'nodes': args.nodes,
+        'degree': args.degree,
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'loss': args.loss,
+        'seed': args.seed,
+        'propagation': conf_file['propagation']['mode'],
+        'overrides': args.set,
+        'results': [simulate(scenario, keys, args) for scenario in args.scenario.split(',')]
+    }
+    for executor in server.executors.values():
+        executor.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
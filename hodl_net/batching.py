@@ -0,0 +1,119 @@
+"""
+Coalescing of small datagrams.
+
+`OutboundBatcher` collects encoded wrappers per destination address for
+`window` seconds, or until `mtu` bytes are collected, and sends them as one
+batch frame::
+
+    magic (0xB2) | count | (length | wrapper) * count
+
+A single wrapper is sent as is, without frame.
+"""
+
+from typing import Callable, Dict, List, Tuple
+
+from hodl_net.encoding import pack_varint, unpack_varint
+
+import logging
+
+log = logging.getLogger(__name__)
+
+MAGIC = 0xB2
+
+
+def is_batch(datagram: bytes) -> bool:
+    return datagram[:1] == bytes((MAGIC,))
+
+
+def pack_batch(datagrams: List[bytes]) -> bytes:
+    parts = [bytes((MAGIC,)), pack_varint(len(datagrams))]
+    for datagram in datagrams:
+        parts.append(pack_varint(len(datagram)))
+        parts.append(datagram)
+    return b''.join(parts)
+
+
+def unpack_batch(data: bytes) -> List[bytes]:
+    """
+    :raises ValueError: if frame is malformed
+    """
+    if not is_batch(data):
+        raise ValueError('Not a batch')
+    try:
+        count, pos = unpack_varint(data, 1)
+        datagrams = []
+        for _ in range(count):
+            length, pos = unpack_varint(data, pos)
+            datagram = data[pos:pos + length]
+            if len(datagram) != length:
+                raise ValueError('Truncated batch')
+            datagrams.append(datagram)
+            pos += length
+    except IndexError:
+        raise ValueError('Truncated batch')
+    if pos != len(data):
+        raise ValueError('Trailing data')
+    return datagrams
+
+
+class OutboundBatcher:
+    """
+    :param clock: reactor or `twisted.internet.task.Clock`
+    :param write: Called with data and address to write datagram
+    :param float window: Seconds to collect datagrams for one address
+    :param int mtu: Max size of batch frame in bytes
+    """
+
+    overhead = 4  # Max size of length prefix of datagram up to 64 KB in frame
+
+    def __init__(self, clock, write: Callable[[bytes, Tuple], None],
+                 window: float = 0.005, mtu: int = 1200):
+        self.clock = clock
+        self.write = write
+        self.window = window
+        self.mtu = mtu
+
+        self._pending: Dict[Tuple, List[bytes]] = {}
+        self._sizes: Dict[Tuple, int] = {}
+        self._timers = {}
+
+        self.frames = 0
+        self.datagrams = 0
+
+    def send(self, data: bytes, addr: Tuple):
+        self.datagrams += 1
+        size = len(data) + self.overhead
+        if size + 2 > self.mtu:
+            self.flush(addr)
+            return self._write(data, addr)
+        if self._sizes.get(addr, 2) + size > self.mtu:
+            self.flush(addr)
+        if addr not in self._pending:
+            self._pending[addr] = []
+            self._sizes[addr] = 2
+            self._timers[addr] = self.clock.callLater(self.window, self.flush, addr)
+        self._pending[addr].append(data)
+        self._sizes[addr] += size
+
+    def flush(self, addr: Tuple):
+        datagrams = self._pending.pop(addr, None)
+        if not datagrams:
+            return
+        del self._sizes[addr]
+        timer = self._timers.pop(addr)
+        if timer.active():
+            timer.cancel()
+        if len(datagrams) == 1:
+            return self._write(datagrams[0], addr)
+        self._write(pack_batch(datagrams), addr)
+
+    def flush_all(self):
+        for addr in list(self._pending):
+            self.flush(addr)
+
+    def _write(self, data: bytes, addr: Tuple):
+        self.frames += 1
+        try:
+            self.write(data, addr)
+        except Exception:
+            log.exception(f'Cannot write datagram to {addr}')
@@ -0,0 +1,123 @@
+"""
+Registry of requests waiting for response.
+"""
+
+from twisted.internet import defer
+from typing import Callable, Dict, List, Optional
+
+from hodl_net.errors import RequestTimeout
+
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Pending:
+    """
+    Request waiting for response
+    """
+
+    __slots__ = ('waiters', 'timer', 'sent', 'addr')
+
+    def __init__(self, timer, addr: str = None, sent: float = None):
+        self.waiters: List[defer.Deferred] = []
+        self.timer = timer
+        self.sent = time.time() if sent is None else sent
+        self.addr = addr
+
+
+class CallbackRegistry:
+    """
+    Deferreds of requests, keyed by `Message.callback`.
+
+    Entries are created only for sends which expect a reply. Every entry
+    errbacks with `hodl_net.errors.RequestTimeout` after its timeout and
+    is removed when its Deferred is cancelled.
+
+    :param clock: reactor or `twisted.internet.task.Clock`
+    :param float timeout: default timeout of request in seconds
+    """
+
+    def __init__(self, clock, timeout: float = 30):
+        self.clock = clock
+        self.timeout = timeout
+        self._pending: Dict[str, Pending] = {}
+
+        # Called with address of peer and round-trip time of answered request,
+        # and with address of peer which didn't answer
+        self.on_complete: Optional[Callable[[str, float], None]] = None
+        self.on_timeout: Optional[Callable[[str], None]] = None
+
+        self.completed = 0
+        self.timed_out = 0
+        self.cancelled = 0
+
+    def add(self, callback_id: str, timeout: float = None, addr: str = None) -> defer.Deferred:
+        """
+        Register request
+
+        :param str callback_id: `Message.callback` of request
+        :param timeout: timeout in seconds. `CallbackRegistry.timeout` if None
+        :param addr: address of peer, request was sent to
+        :return: Deferred, which fires with response `Message`
+        """
+        entry = self._pending.get(callback_id)
+        if not entry:
+            timer = self.clock.callLater(timeout or self.timeout, self._expire, callback_id)
+            entry = self._pending[callback_id] = Pending(timer, addr, self.clock.seconds())
+        d = defer.Deferred(lambda _d: self._cancel(callback_id, _d))
+        entry.waiters.append(d)
+        return d
+
+    def resolve(self, callback_id: str, message) -> bool:
+        """
+        Fire Deferreds of request with response
+
+        :return: True, if request with this id was waiting for response
+        """
+        entry = self._pending.pop(callback_id, None)
+        if not entry:
+            return False
+        entry.timer.cancel()
+        self.completed += 1
+        if self.on_complete and entry.addr:
+            self.on_complete(entry.addr, self.clock.seconds() - entry.sent)
+        for d in entry.waiters:
+            d.callback(message)
+        return True
+
+    def _expire(self, callback_id: str):
+        entry = self._pending.pop(callback_id, None)
+        if not entry:
+            return
+        self.timed_out += 1
+        log.debug(f'Request {callback_id} timed out')
+        if self.on_timeout and entry.addr:
+            self.on_timeout(entry.addr)
+        for d in entry.waiters:
+            d.errback(RequestTimeout(callback_id))
+
+    def _cancel(self, callback_id: str, d: defer.Deferred):
+        entry = self._pending.get(callback_id)
+        if not entry or d not in entry.waiters:
+            return
+        entry.waiters.remove(d)
+        self.cancelled += 1
+        if not entry.waiters:
+            entry.timer.cancel()
+            del self._pending[callback_id]
+
+    def __contains__(self, callback_id: str):
+        return callback_id in self._pending
+
+    def __len__(self):
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'completed': self.completed,
+            'timed_out': self.timed_out,
+            'cancelled': self.cancelled
+        }
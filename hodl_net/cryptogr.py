@@ -1,9 +1,19 @@
 from Crypto.PublicKey import RSA
 from Crypto.Signature import PKCS1_v1_5
 from Crypto.Hash import SHA256 as SHA
-from Crypto.Cipher import PKCS1_OAEP
+from Crypto.Cipher import PKCS1_OAEP, AES
 from Crypto.Random import get_random_bytes
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, CancelledError, Future
+from twisted.internet import defer
+from typing import Any, List, Set, Tuple
+import threading
+import hashlib
 import base64
+import logging
+import os
+
+log = logging.getLogger(__name__)
 
 
 def hex_hash(s):
@@ -28,25 +38,177 @@ def gen_keys():
     return privatekey.exportKey().decode(), publickey.exportKey().decode()
 
 
+def fingerprint(pem: str) -> str:
+    """
+    Short fingerprint of PEM-encoded key
+    """
+    return hashlib.sha256(pem.encode('utf-8')).hexdigest()
+
+
+class ParsedKey:
+    """
+    RSA key parsed once, with signer and cipher for it
+    """
+
+    def __init__(self, pem: str):
+        self.key = RSA.importKey(pem)
+        self.size = self.key.size_in_bytes()
+        self.signer = PKCS1_v1_5.new(self.key)
+        self.cipher = PKCS1_OAEP.new(self.key)
+
+
+class KeyCache:
+    """
+    Bounded LRU cache of parsed RSA keys, keyed by PEM fingerprint
+
+    :param int max_size: Max count of keys in cache
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._keys = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def get(self, pem: str) -> ParsedKey:
+        fp = fingerprint(pem)
+        with self._lock:
+            parsed = self._pinned.get(fp)
+            if parsed:
+                self.hits += 1
+                return parsed
+            parsed = self._keys.get(fp)
+            if parsed:
+                self._keys.move_to_end(fp)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+        parsed = ParsedKey(pem)
+        with self._lock:
+            self._keys[fp] = parsed
+            if len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+        return parsed
+
+    def pin(self, pem: str) -> ParsedKey:
+        """
+        Keep key in cache regardless of LRU. Used for the node's own keys
+        """
+        fp = fingerprint(pem)
+        with self._lock:
+            parsed = self._pinned.get(fp)
+        if parsed:
+            return parsed
+        parsed = ParsedKey(pem)
+        with self._lock:
+            self._pinned[fp] = parsed
+        return parsed
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._keys),
+            'pinned': len(self._pinned),
+            'max_size': self.max_size
+        }
+
+
+key_cache = KeyCache()
+
+
 def sign(plaintext: str, private_key: str) -> str:
-    priv_key = RSA.importKey(private_key)
+    priv_key = key_cache.get(private_key)
     plaintext = plaintext.encode('utf-8')
     # creation of signature
     myhash = SHA.new(plaintext)
-    signature = PKCS1_v1_5.new(priv_key)
-    signature = signature.sign(myhash)
+    signature = priv_key.signer.sign(myhash)
     return base64.encodebytes(signature).decode()
 
 
+class VerifyCache:
+    """
+    Bounded LRU cache of signature verification results, keyed by sender key
+    fingerprint and digest of message with signature. Copies of one message
+    received from many peers are verified once.
+
+    :param int max_size: Max count of results in cache
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(plaintext: str, s: str, public_key: str) -> tuple:
+        digest = hashlib.sha256(b'\0'.join((plaintext.encode('utf-8'), s.encode()))).digest()
+        return fingerprint(public_key), digest
+
+    def get(self, key: tuple):
+        """
+        :return: cached result or None
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def set(self, key: tuple, result: bool):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._results),
+            'max_size': self.max_size
+        }
+
+
+verify_cache = VerifyCache()
+
+
 def verify(plaintext: str, s: str, public_key: str) -> bool:
-    pub_key = RSA.importKey(public_key)
+    if not s:
+        return False
+    key = verify_cache.key(plaintext, s, public_key)
+    result = verify_cache.get(key)
+    if result is None:
+        result = verify_uncached(plaintext, s, public_key)
+        verify_cache.set(key, result)
+    return result
+
+
+def verify_uncached(plaintext: str, s: str, public_key: str) -> bool:
+    pub_key = key_cache.get(public_key)
     plaintext = plaintext.encode('utf-8')
     # decryption signature
     myhash = SHA.new(plaintext)
-    signature = PKCS1_v1_5.new(pub_key)
     try:
-        signature.verify(myhash, base64.decodebytes(s.encode()))
-        return True
+        return bool(pub_key.signer.verify(myhash, base64.decodebytes(s.encode())))
     except ValueError:
         return False
 
@@ -55,15 +217,15 @@ def encrypt(plaintext: str, pub_key: str) -> str:
     """
     Encrypt text with RSA
     """
-    key = RSA.importKey(pub_key)
-    encrypter = PKCS1_OAEP.new(key)
+    key = key_cache.get(pub_key)
+    encrypter = key.cipher
 
     plaintext = plaintext.encode()
-    size = key.size_in_bytes()
-    ciphertext = b''
-    for i in range(0, len(plaintext) // (size - 42) + 1):
-        block = plaintext[i * (size - 42):(i + 1) * (size - 42)]
-        ciphertext += encrypter.encrypt(block)
+    block_size = key.size - 42
+    ciphertext = b''.join(
+        encrypter.encrypt(plaintext[i:i + block_size])
+        for i in range(0, len(plaintext) + 1, block_size)
+    )
     return base64.encodebytes(ciphertext).decode()
 
 
@@ -71,18 +233,217 @@ def decrypt(text: str, priv_key: str) -> str:
     """
     Decrypt ciphertext with RSA
     """
-    key = RSA.importKey(priv_key)
+    key = key_cache.get(priv_key)
     text = base64.decodebytes(text.encode())
-    decrypter = PKCS1_OAEP.new(key)
-    size = key.size_in_bytes()
+    decrypter = key.cipher
+    size = key.size
 
-    plaintext = b''
-    for i in range(0, len(text) // size):
-        block = text[i * size: (i + 1) * size]
-        plaintext += decrypter.decrypt(block)
+    plaintext = b''.join(
+        decrypter.decrypt(text[i:i + size])
+        for i in range(0, len(text) - size + 1, size)
+    )
     return plaintext.decode()
 
 
+AES_KEY_SIZE = 32
+GCM_NONCE_SIZE = 12
+GCM_TAG_SIZE = 16
+
+
+def aes_encrypt(plaintext: bytes, key: bytes, header: bytes = b'') -> bytes:
+    """
+    Encrypt bytes with AES-GCM
+
+    :return: nonce + tag + ciphertext
+    """
+    nonce = get_random_bytes(GCM_NONCE_SIZE)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(header)
+    ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+    return b''.join((nonce, tag, ciphertext))
+
+
+def aes_decrypt(data: bytes, key: bytes, header: bytes = b'') -> bytes:
+    """
+    Decrypt bytes made by `aes_encrypt`
+
+    :raises ValueError: if ciphertext or header was modified
+    """
+    nonce = data[:GCM_NONCE_SIZE]
+    tag = data[GCM_NONCE_SIZE:GCM_NONCE_SIZE + GCM_TAG_SIZE]
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(header)
+    return cipher.decrypt_and_verify(data[GCM_NONCE_SIZE + GCM_TAG_SIZE:], tag)
+
+
+def hybrid_encrypt(plaintext: str, pub_key: str) -> str:
+    """
+    Encrypt text with fresh AES-GCM key, wrapped with RSA once
+
+    :return: base64 of wrapped key + nonce + tag + ciphertext
+    """
+    key = key_cache.get(pub_key)
+    session_key = get_random_bytes(AES_KEY_SIZE)
+    wrapped_key = key.cipher.encrypt(session_key)
+    ciphertext = aes_encrypt(plaintext.encode(), session_key)
+    return base64.encodebytes(wrapped_key + ciphertext).decode()
+
+
+def hybrid_decrypt(text: str, priv_key: str) -> str:
+    """
+    Decrypt ciphertext made by `hybrid_encrypt`
+    """
+    key = key_cache.get(priv_key)
+    text = base64.decodebytes(text.encode())
+    session_key = key.cipher.decrypt(text[:key.size])
+    return aes_decrypt(text[key.size:], session_key).decode()
+
+
+operations = {
+    func.__name__: func
+    for func in (sign, verify, verify_uncached, encrypt, decrypt, hybrid_encrypt, hybrid_decrypt)
+}
+
+
+def run_batch(batch: List[Tuple[str, tuple]]) -> List[Tuple[bool, Any]]:
+    """
+    Run operations in worker process
+
+    :return: (True, result) or (False, exception) for every operation
+    """
+    results = []
+    for name, args in batch:
+        try:
+            results.append((True, operations[name](*args)))
+        except Exception as ex:
+            results.append((False, ex))
+    return results
+
+
+class CryptoPool:
+    """
+    Process pool for RSA operations.
+
+    While less than `workers` batches are in progress, operations are sent to
+    workers at once. Otherwise they are queued and sent in batches of up to
+    `batch_size` operations per worker round-trip, as soon as a worker is free.
+    Every worker has its own `key_cache`.
+
+    :param clock: reactor. Results are delivered in its thread
+    :param int workers: Count of processes. Count of CPUs if None
+    :param int batch_size: Max count of operations in one round-trip
+    """
+
+    def __init__(self, clock, workers: int = None, batch_size: int = 32):
+        self.clock = clock
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+
+        self._executor = None
+        self._queue: List[Tuple[str, tuple, defer.Deferred]] = []
+        self._in_flight = 0
+        self._futures: Set[Future] = set()
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.batches = 0
+
+    def submit(self, operation: str, *args) -> defer.Deferred:
+        """
+        Run operation from `operations` in worker process. Thread-safe
+
+        :return: Deferred, which fires with result of operation
+        """
+        d = defer.Deferred()
+        with self._lock:
+            self.submitted += 1
+            self._queue.append((operation, args, d))
+            self._dispatch()
+        return d
+
+    def sign(self, plaintext: str, private_key: str) -> defer.Deferred:
+        return self.submit('sign', plaintext, private_key)
+
+    def verify(self, plaintext: str, s: str, public_key: str) -> defer.Deferred:
+        """
+        Result is taken from and saved to `verify_cache` of this process
+        """
+        if not s:
+            return defer.succeed(False)
+        key = verify_cache.key(plaintext, s, public_key)
+        result = verify_cache.get(key)
+        if result is not None:
+            return defer.succeed(result)
+        d = self.submit('verify_uncached', plaintext, s, public_key)
+        d.addCallback(self._verified, key)
+        return d
+
+    @staticmethod
+    def _verified(result: bool, key: tuple) -> bool:
+        verify_cache.set(key, result)
+        return result
+
+    def encrypt(self, plaintext: str, pub_key: str) -> defer.Deferred:
+        return self.submit('encrypt', plaintext, pub_key)
+
+    def decrypt(self, text: str, priv_key: str) -> defer.Deferred:
+        return self.submit('decrypt', text, priv_key)
+
+    def _dispatch(self):
+        if not self._executor:
+            self._executor = ProcessPoolExecutor(self.workers)
+        while self._queue and self._in_flight < self.workers:
+            batch = self._queue[:self.batch_size]
+            del self._queue[:self.batch_size]
+            self._in_flight += 1
+            self.batches += 1
+            future = self._executor.submit(run_batch, [(name, args) for name, args, _ in batch])
+            self._futures.add(future)
+            waiters = [d for _, _, d in batch]
+            future.add_done_callback(
+                lambda f, waiters=waiters: self.clock.callFromThread(self._complete, f, waiters))
+
+    def _complete(self, future, waiters: List[defer.Deferred]):
+        with self._lock:
+            self._in_flight -= 1
+            self.completed += len(waiters)
+            self._futures.discard(future)
+            if self._executor:
+                self._dispatch()
+        try:
+            results = future.result()
+        except CancelledError:  # Pool is stopped
+            results = [(False, defer.CancelledError())] * len(waiters)
+        except Exception as ex:  # Worker died
+            log.exception('Crypto worker failed')
+            results = [(False, ex)] * len(waiters)
+        for d, (ok, value) in zip(waiters, results):
+            if ok:
+                d.callback(value)
+            else:
+                d.errback(value)
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            futures, self._futures = self._futures, set()
+        if executor:
+            for future in futures:  # `cancel_futures` of `shutdown` requires Python 3.9
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'queued': len(self._queue),
+            'in_flight': self._in_flight,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'batches': self.batches
+        }
+
+
 if __name__ == '__main__':
     priv, pub = gen_keys()
     print(decrypt(encrypt('test', pub), priv))
@@ -1,10 +1,13 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import SingletonThreadPool
 from sqlalchemy.ext.declarative import declarative_base
 from hodl_net.globals import local, session
+import logging
 import os
 
+log = logging.getLogger(__name__)
+
 Base = declarative_base()
 
 
@@ -49,6 +52,30 @@ def create_db(with_drop=False):
         drop_db()
     Base.metadata.create_all(db_worker.engine)
     session.commit()
+    migrate()
+
+
+def migrate():
+    """
+    Add columns, which appeared after tables were created. Rows existing
+    before `seq` column get seqs in order of insertion
+    """
+    tables = set(inspect(db_worker.engine).get_table_names())
+    with db_worker.engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                log.info(f'Adding column {column.name} to {table.name}')
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                                  f'{column.type.compile(conn.dialect)}'))
+                if column.name == 'seq':
+                    conn.execute(text(f'UPDATE {table.name} SET seq = rowid'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
 
 
 def drop_db():
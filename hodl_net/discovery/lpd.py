@@ -67,9 +67,8 @@ class LPD(DatagramProtocol):
     def datagramReceived(self, datagram, address):
         dtgrm = json.loads(datagram.decode())
         addr = "{}:{}".format(address[0], dtgrm['dt']['prt'])
-        _peer = Peer(self, addr=addr)
-        if _peer not in self.core.udp.peers:
-            self.core.udp.add_peer(_peer, "LPD")
+        if addr not in self.core.udp.peer_table:
+            self.core.udp.add_peer(Peer(self.core.udp, addr=addr), "LPD")
 
 
 if __name__ == '__main__':
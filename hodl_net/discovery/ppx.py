@@ -1,31 +1,115 @@
-import time
+"""
+Public Peer Exchange: bootstrap from well-known public nodes.
+
+Host names of bootstrap nodes are resolved asynchronously and in parallel.
+Every node is pinged as soon as its address is resolved. Failed resolutions
+are retried with exponential backoff, resolved addresses are cached for `ttl`
+seconds.
+"""
+
 import logging
 
+from twisted.internet import defer, reactor, task
+from twisted.python import failure
+from typing import Dict, List, Tuple
+
 from hodl_net.models import Peer, Message
-from socket import gethostbyname
 
 log = logging.getLogger(__name__)
 
 
 class PublicPeerExchange:
-    def __init__(self, core, bootstrap_servers=None):
+    """
+    :param core: `Server`
+    :param bootstrap_servers: "host:port" of bootstrap nodes
+    :param clock: reactor used to resolve names and schedule retries
+    :param float ttl: Seconds to cache resolved addresses
+    :param int retries: Max count of retries of failed resolution
+    :param float backoff: Seconds before the first retry, doubled for every next one
+    :param float max_backoff: Max seconds between retries
+    :param float timeout: Seconds to wait for resolution
+    """
+
+    def __init__(self, core, bootstrap_servers: List[str] = None, clock=reactor,
+                 ttl: float = 300, retries: int = 5, backoff: float = 1,
+                 max_backoff: float = 60, timeout: float = 10):
 
         if bootstrap_servers is None:
             bootstrap_servers = ["startnode.hodleum.org:8000"]
 
         self.core = core
+        self.bootstrap_servers = bootstrap_servers
+        self.clock = clock
+        self.ttl = ttl
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
 
+        self._cache: Dict[str, Tuple[str, float]] = {}
+        self._resolving: Dict[str, List[defer.Deferred]] = {}
+
+    def start(self) -> defer.Deferred:
+        """
+        Resolve and ping all bootstrap nodes
+
+        :return: Deferred, which fires when all nodes are pinged or given up
+        """
         log.info("Starting Public Peer Exchange mechanism")
+        return defer.DeferredList([self.connect(node) for node in self.bootstrap_servers])
+
+    def connect(self, node: str) -> defer.Deferred:
+        host, port = node.rsplit(':', 1)
+        d = self.resolve(host)
+        d.addCallback(self._ping, port, node)
+        d.addErrback(self._failed, node)
+        return d
+
+    def resolve(self, host: str) -> defer.Deferred:
+        """
+        Resolve host name. Cached address and resolution in progress are reused
 
-        for i in bootstrap_servers:
-            _addr = i.split(":")
-            addr = gethostbyname(_addr[0])
-            d_port = _addr[1]
+        :return: Deferred, which fires with IP address
+        """
+        cached = self._cache.get(host)
+        if cached and cached[1] > self.clock.seconds():
+            return defer.succeed(cached[0])
+        d = defer.Deferred()
+        if host in self._resolving:
+            self._resolving[host].append(d)
+            return d
+        self._resolving[host] = [d]
+        defer.ensureDeferred(self._resolve(host)).addBoth(self._notify, host)
+        return d
 
-            peer = Peer(self.core.udp)
-            peer.addr = f"{addr}:{d_port}"
+    async def _resolve(self, host: str) -> str:
+        attempt = 0
+        while True:
+            try:
+                addr = await self.clock.resolve(host, (self.timeout,))
+            except Exception as ex:
+                if attempt >= self.retries:
+                    raise
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                attempt += 1
+                log.debug(f'Cannot resolve {host}: {ex!r}. Retry in {delay}s')
+                await task.deferLater(self.clock, delay, lambda: None)
+            else:
+                self._cache[host] = (addr, self.clock.seconds() + self.ttl)
+                return addr
 
-            logging.info(f"Connecting to peer {i}")
+    def _notify(self, result, host: str):
+        for d in self._resolving.pop(host):
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
 
-            peer.request(Message("ping", data={'msg': "av_check"}))
+    def _ping(self, addr: str, port: str, node: str):
+        log.info(f"Connecting to peer {node}")
+        peer = Peer(self.core.udp, addr=f"{addr}:{port}")
+        peer.request(Message("ping", data={'msg': "av_check"}), expect_reply=False)
 
+    @staticmethod
+    def _failed(reason, node: str):
+        log.warning(f'Cannot resolve bootstrap node {node}: {reason.getErrorMessage()}')
@@ -0,0 +1,200 @@
+"""
+Compact binary encoding of `MessageWrapper`.
+
+Layout (version 1)::
+
+    magic (0xB1) | version | type | cipher | flags | id
+    [sender] [sign] [tunnel_id] [session_id] [hops] message
+
+Text fields are stored as a kind byte followed by value. UUIDs are stored as
+16 raw bytes, base64 and hex strings as raw bytes, so `pack` and `unpack`
+round-trip every string exactly and signatures stay valid.
+Plain message is stored as name, salt, callback and JSON of `Message.data`;
+encrypted message as raw ciphertext.
+"""
+
+from typing import Tuple
+
+import binascii
+import json
+
+MAGIC = 0xB1
+VERSION = 1
+
+TYPES = ['message', 'request', 'shout']
+CIPHERS = ['rsa', 'rsa-aes-gcm', 'session']
+
+HAS_SENDER = 1
+HAS_SIGN = 2
+HAS_TUNNEL = 4
+HAS_SESSION = 8
+ENCRYPTED = 16
+HAS_HOPS = 32
+
+KIND_UTF8 = 0
+KIND_UUID = 1
+KIND_UUID_HEX = 2
+KIND_BASE64 = 3
+KIND_HEX = 4
+
+
+def pack_varint(value: int) -> bytes:
+    """
+    :raises ValueError: if value is negative
+    """
+    if value < 0:
+        raise ValueError('Negative varint')
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def unpack_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _pack_blob(kind: int, raw: bytes) -> bytes:
+    return bytes((kind,)) + pack_varint(len(raw)) + raw
+
+
+def _encodebytes(raw: bytes) -> str:
+    # Same as `base64.encodebytes`, which is used for signatures and ciphertexts
+    return ''.join(binascii.b2a_base64(raw[i:i + 57]).decode()
+                   for i in range(0, len(raw), 57))
+
+
+def pack_text(value: str) -> bytes:
+    """
+    Pack string to the shortest form from which it can be restored exactly
+    """
+    try:
+        if len(value) == 36 and value[8] == value[13] == value[18] == value[23] == '-':
+            raw = bytes.fromhex(value.replace('-', ''))
+            if len(raw) == 16 and _uuid_str(raw) == value:
+                return bytes((KIND_UUID,)) + raw
+        elif len(value) % 2 == 0:
+            raw = bytes.fromhex(value)
+            if raw.hex() == value:
+                if len(raw) == 16:
+                    return bytes((KIND_UUID_HEX,)) + raw
+                return _pack_blob(KIND_HEX, raw)
+    except ValueError:
+        pass
+    if value.endswith('\n'):
+        try:
+            raw = binascii.a2b_base64(value)
+            if raw and _encodebytes(raw) == value:
+                return _pack_blob(KIND_BASE64, raw)
+        except binascii.Error:
+            pass
+    return _pack_blob(KIND_UTF8, value.encode('utf-8'))
+
+
+def _uuid_str(raw: bytes) -> str:
+    h = raw.hex()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+def unpack_text(data: bytes, pos: int) -> Tuple[str, int]:
+    kind = data[pos]
+    pos += 1
+    if kind in (KIND_UUID, KIND_UUID_HEX):
+        raw = data[pos:pos + 16]
+        if len(raw) != 16:
+            raise ValueError('Truncated id')
+        return _uuid_str(raw) if kind == KIND_UUID else raw.hex(), pos + 16
+    length, pos = unpack_varint(data, pos)
+    raw = data[pos:pos + length]
+    if len(raw) != length:
+        raise ValueError('Truncated field')
+    pos += length
+    if kind == KIND_UTF8:
+        return raw.decode('utf-8'), pos
+    if kind == KIND_HEX:
+        return raw.hex(), pos
+    if kind == KIND_BASE64:
+        return _encodebytes(raw), pos
+    raise ValueError('Unknown field kind')
+
+
+def pack(wrapper: dict) -> bytes:
+    """
+    Pack wrapper, dumped with `attr.asdict`, to bytes
+    """
+    message = wrapper['message']
+    flags = 0
+    fields = []
+    for flag, key in ((HAS_SENDER, 'sender'), (HAS_SIGN, 'sign'),
+                      (HAS_TUNNEL, 'tunnel_id'), (HAS_SESSION, 'session_id')):
+        if wrapper.get(key):
+            flags |= flag
+            fields.append(pack_text(wrapper[key]))
+    if wrapper.get('hops') is not None:
+        flags |= HAS_HOPS
+        fields.append(pack_varint(wrapper['hops']))
+    if isinstance(message, str):
+        flags |= ENCRYPTED
+        fields.append(pack_text(message))
+    else:
+        fields.append(pack_text(message['name']))
+        fields.append(pack_text(message['salt']))
+        fields.append(pack_text(message['callback']))
+        fields.append(_pack_blob(KIND_UTF8, json.dumps(message['data'],
+                                                       separators=(',', ':')).encode('utf-8')))
+    header = bytes((
+        MAGIC, VERSION,
+        TYPES.index(wrapper['type']),
+        CIPHERS.index(wrapper.get('cipher') or 'rsa'),
+        flags
+    ))
+    return b''.join((header, pack_text(wrapper['id']), *fields))
+
+
+def unpack(data: bytes) -> dict:
+    """
+    Unpack bytes made by `pack` to dict with the same fields as JSON of wrapper
+
+    :raises ValueError: if data is malformed
+    """
+    try:
+        magic, version, type_code, cipher_code, flags = data[:5]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Unsupported binary encoding')
+        wrapper = {
+            'type': TYPES[type_code],
+            'cipher': CIPHERS[cipher_code],
+            'encoding': 'binary'
+        }
+        wrapper['id'], pos = unpack_text(data, 5)
+        for flag, key in ((HAS_SENDER, 'sender'), (HAS_SIGN, 'sign'),
+                          (HAS_TUNNEL, 'tunnel_id'), (HAS_SESSION, 'session_id')):
+            if flags & flag:
+                wrapper[key], pos = unpack_text(data, pos)
+        if flags & HAS_HOPS:
+            wrapper['hops'], pos = unpack_varint(data, pos)
+        if flags & ENCRYPTED:
+            wrapper['message'], pos = unpack_text(data, pos)
+        else:
+            message = {}
+            for key in ('name', 'salt', 'callback', 'data'):
+                message[key], pos = unpack_text(data, pos)
+            message['data'] = json.loads(message['data'])
+            wrapper['message'] = message
+    except (IndexError, UnicodeDecodeError) as e:
+        raise ValueError(e)
+    if pos != len(data):
+        raise ValueError('Trailing data')
+    return wrapper
@@ -20,6 +20,11 @@ class UnhandledRequest(BaseError):
     code = '002'
 
 
+class RequestTimeout(BaseError):
+    message = 'Request timed out'
+    code = '003'
+
+
 class CryptogrError(BaseError):
     message = 'Error in cryptography'
     code = '100'
@@ -0,0 +1,234 @@
+"""
+Executors of handlers.
+
+* `InlineExecutor` - handler coroutine runs on the reactor thread. For cheap
+  handlers, which never block.
+* `ThreadExecutor` - named bounded thread pool. For handlers, which block on
+  DB or sleep.
+* `ProcessExecutor` - process pool for CPU-heavy handlers. Handler must be a
+  module level function, it gets only `Message` and can't use `peer`, `user`
+  or `session` locals.
+
+If handler returns `Message`, it is sent as response to the sender of request.
+Every executor counts queued, running, completed, failed and dropped handlers,
+see `Executor.stats`.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from twisted.internet import defer
+from twisted.python.threadpool import ThreadPool
+from typing import Callable
+
+from hodl_net.globals import local
+from hodl_net.models import Message
+
+import asyncio
+import inspect
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def call_handler(func: Callable, message: Message, _peer=None, _user=None) -> defer.Deferred:
+    # noinspection PyUnresolvedReferences,PyDunderSlots
+    local.peer = _peer
+    local.user = _user
+    return defer.ensureDeferred(func(message))
+
+
+def run_in_process(func: Callable, message: Message):
+    result = func(message)
+    if inspect.iscoroutine(result):
+        result = asyncio.run(result)
+    return result
+
+
+class Executor:
+    """
+    Base executor
+
+    :param name: Name of executor, used in `Server.handle`
+    :param int max_queue: Max count of handlers waiting for execution. 0 for unlimited
+    """
+
+    type = None
+
+    def __init__(self, name: str, max_queue: int = 0):
+        self.name = name
+        self.max_queue = max_queue
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def submit(self, func: Callable, message: Message, _peer=None, _user=None) -> defer.Deferred:
+        """
+        Run handler
+
+        :return: Deferred, which fires with result of handler, or None if it was dropped
+        """
+        if self.max_queue and self.queued >= self.max_queue:
+            self.dropped += 1
+            log.warning(f'Executor {self.name} is full, {message.name} is dropped')
+            return defer.succeed(None)
+        self.queued += 1
+        d = self._submit(func, message, _peer, _user)
+        d.addCallbacks(self._done, self._failed, errbackArgs=(func,))
+        d.addCallback(self._reply, message, _peer, _user)
+        return d
+
+    def _submit(self, func: Callable, message: Message, _peer, _user) -> defer.Deferred:
+        raise NotImplementedError
+
+    def _started(self):
+        self.queued -= 1
+        self.running += 1
+
+    def _done(self, result):
+        self.running -= 1
+        self.completed += 1
+        return result
+
+    def _failed(self, failure, func: Callable):
+        self.running -= 1
+        self.failed += 1
+        log.error(f'Handler {func.__name__} failed: {failure.getTraceback()}')
+
+    @staticmethod
+    def _reply(result, message: Message, _peer, _user):
+        if not isinstance(result, Message):
+            return result
+        if _user:
+            _user.response(message, result)
+        elif _peer:
+            _peer.response(message, result)
+        return result
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            'type': self.type,
+            'queued': self.queued,
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'dropped': self.dropped
+        }
+
+
+class InlineExecutor(Executor):
+    type = 'inline'
+
+    def _submit(self, func: Callable, message: Message, _peer, _user) -> defer.Deferred:
+        self._started()
+        return call_handler(func, message, _peer, _user)
+
+
+class ThreadExecutor(Executor):
+    """
+    :param clock: reactor
+    :param int size: Max count of threads
+    """
+
+    type = 'thread'
+
+    def __init__(self, name: str, clock, size: int = 10, max_queue: int = 0):
+        super().__init__(name, max_queue)
+        self.clock = clock
+        self.size = size
+        self.pool = ThreadPool(0, size, name=f'handlers-{name}')
+
+    def _submit(self, func: Callable, message: Message, _peer, _user) -> defer.Deferred:
+        d = defer.Deferred()
+
+        def run():
+            self.clock.callFromThread(self._started)
+            try:
+                result = call_handler(func, message, _peer, _user)
+            except BaseException:
+                return self.clock.callFromThread(d.errback, defer.Failure())
+            result.addBoth(lambda value: self.clock.callFromThread(d.callback, value))
+
+        self.pool.callInThread(run)
+        return d
+
+    def start(self):
+        if not self.pool.started:
+            self.pool.start()
+
+    def stop(self):
+        if self.pool.started:
+            self.pool.stop()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['size'] = self.size
+        return stats
+
+
+class ProcessExecutor(Executor):
+    """
+    :param clock: reactor
+    :param int size: Count of processes
+    """
+
+    type = 'process'
+
+    def __init__(self, name: str, clock, size: int = 2, max_queue: int = 0):
+        super().__init__(name, max_queue)
+        self.clock = clock
+        self.size = size
+        self.pool = None
+
+    def _submit(self, func: Callable, message: Message, _peer, _user) -> defer.Deferred:
+        self.start()
+        d = defer.Deferred()
+        future = self.pool.submit(run_in_process, func, message)
+        future.add_done_callback(lambda f: self.clock.callFromThread(self._resolve, f, d))
+        return d
+
+    def _resolve(self, future, d: defer.Deferred):
+        self._started()  # Start in process isn't reported, so queued includes running ones
+        try:
+            d.callback(future.result())
+        except BaseException:
+            d.errback(defer.Failure())
+
+    def start(self):
+        if not self.pool:
+            self.pool = ProcessPoolExecutor(self.size)
+
+    def stop(self):
+        if self.pool:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['size'] = self.size
+        return stats
+
+
+types = {
+    InlineExecutor.type: InlineExecutor,
+    ThreadExecutor.type: ThreadExecutor,
+    ProcessExecutor.type: ProcessExecutor
+}
+
+
+def create(name: str, clock, conf: dict) -> Executor:
+    """
+    Executor from config section
+    """
+    options = dict(conf)
+    executor_type = options.pop('type', ThreadExecutor.type)
+    if executor_type == InlineExecutor.type:
+        return InlineExecutor(name, **options)
+    return types[executor_type](name, clock, **options)
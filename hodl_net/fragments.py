@@ -0,0 +1,272 @@
+"""
+Fragmentation of datagrams larger than MTU.
+
+Fragment frame::
+
+    magic (0xB3) | message id (8 bytes) | index | total | payload
+
+If some fragments of a message are still missing `nack_delay` seconds after
+the last received one, the receiver asks for them with a NACK frame::
+
+    magic (0xB4) | message id (8 bytes) | count | index * count
+
+The sender keeps fragments for `retention` seconds to answer NACKs. One NACK
+carries at most as many indexes as fit in MTU, the rest are asked for by the
+next ones.
+
+Frames are unauthenticated, so the receiver accepts only fragments, which can
+belong to a message of at most `max_bytes`: with non-empty payload not larger
+than MTU allows and with `total` up to `max_bytes` divided by that payload.
+"""
+
+from Crypto.Random import get_random_bytes
+from typing import Callable, Dict, List, Tuple
+from itertools import islice
+
+from hodl_net.encoding import pack_varint, unpack_varint
+from hodl_net.models import TempDict
+
+import logging
+
+log = logging.getLogger(__name__)
+
+FRAGMENT_MAGIC = 0xB3
+NACK_MAGIC = 0xB4
+ID_SIZE = 8
+MAX_HEADER = 1 + ID_SIZE + 3 + 3
+MAX_INDEX_SIZE = 3  # Varint of index below 2 ** 21
+
+
+def is_fragment(datagram: bytes) -> bool:
+    return datagram[:1] == bytes((FRAGMENT_MAGIC,))
+
+
+def is_nack(datagram: bytes) -> bool:
+    return datagram[:1] == bytes((NACK_MAGIC,))
+
+
+def pack_fragment(msg_id: bytes, index: int, total: int, payload: bytes) -> bytes:
+    return b''.join((bytes((FRAGMENT_MAGIC,)), msg_id, pack_varint(index),
+                     pack_varint(total), payload))
+
+
+def unpack_fragment(data: bytes) -> Tuple[bytes, int, int, bytes]:
+    """
+    :return: message id, index, total count of fragments, payload
+    :raises ValueError: if frame is malformed
+    """
+    try:
+        msg_id = data[1:1 + ID_SIZE]
+        index, pos = unpack_varint(data, 1 + ID_SIZE)
+        total, pos = unpack_varint(data, pos)
+    except IndexError:
+        raise ValueError('Truncated fragment')
+    if len(msg_id) != ID_SIZE or not index < total:
+        raise ValueError('Bad fragment')
+    return msg_id, index, total, data[pos:]
+
+
+def pack_nack(msg_id: bytes, indexes: List[int]) -> bytes:
+    return b''.join((bytes((NACK_MAGIC,)), msg_id, pack_varint(len(indexes)),
+                     *map(pack_varint, indexes)))
+
+
+def unpack_nack(data: bytes) -> Tuple[bytes, List[int]]:
+    try:
+        msg_id = data[1:1 + ID_SIZE]
+        count, pos = unpack_varint(data, 1 + ID_SIZE)
+        indexes = []
+        for _ in range(count):
+            index, pos = unpack_varint(data, pos)
+            indexes.append(index)
+    except IndexError:
+        raise ValueError('Truncated NACK')
+    if len(msg_id) != ID_SIZE:
+        raise ValueError('Bad NACK')
+    return msg_id, indexes
+
+
+class Fragmenter:
+    """
+    Sender side
+
+    :param write: Called with data and address to write datagram
+    :param int mtu: Max size of datagram in bytes
+    :param float retention: Seconds to keep fragments for retransmission
+    :param int max_retained: Max count of messages kept for retransmission
+    """
+
+    def __init__(self, write: Callable[[bytes, Tuple], None], mtu: int = 1200,
+                 retention: float = 10, max_retained: int = 256):
+        self.write = write
+        self.mtu = mtu
+        self._sent = TempDict(factory=None, expire=retention, max_size=max_retained)
+
+        self.fragmented = 0
+        self.retransmitted = 0
+
+    def send(self, data: bytes, addr: Tuple) -> bool:
+        """
+        Write data in fragments, if it is larger than MTU
+
+        :return: False, if data fits in one datagram and wasn't written
+        """
+        if len(data) <= self.mtu:
+            return False
+        size = self.mtu - MAX_HEADER
+        total = (len(data) + size - 1) // size
+        msg_id = get_random_bytes(ID_SIZE)
+        fragments = [pack_fragment(msg_id, i, total, data[i * size:(i + 1) * size])
+                     for i in range(total)]
+        self._sent[msg_id] = (addr, fragments)
+        self.fragmented += 1
+        for fragment in fragments:
+            self.write(fragment, addr)
+        return True
+
+    def on_nack(self, data: bytes, addr: Tuple):
+        msg_id, indexes = unpack_nack(data)
+        sent = self._sent.get(msg_id)
+        if not sent or sent[0] != addr:
+            return
+        fragments = sent[1]
+        for index in indexes:
+            if index < len(fragments):
+                self.retransmitted += 1
+                self.write(fragments[index], addr)
+
+    def start(self, clock=None):
+        self._sent.start(clock)
+
+    def stop(self):
+        self._sent.stop()
+
+
+class Partial:
+    """
+    Partially received message
+    """
+
+    __slots__ = ('total', 'fragments', 'size', 'created', 'timer', 'nacks')
+
+    def __init__(self, total: int, created: float):
+        self.total = total
+        self.fragments: Dict[int, bytes] = {}
+        self.size = 0
+        self.created = created
+        self.timer = None
+        self.nacks = 0
+
+
+class Reassembler:
+    """
+    Receiver side. Memory is bounded by `max_messages` and `max_bytes`:
+    the oldest partial message is dropped when they are exceeded.
+
+    :param clock: reactor or `twisted.internet.task.Clock`
+    :param deliver: Called with data and address of every reassembled message
+    :param write: Called with data and address to write NACK
+    :param float timeout: Seconds to wait for all fragments of a message
+    :param float nack_delay: Seconds since the last fragment before asking for missing ones
+    :param int max_nacks: Max count of NACKs for one message
+    :param int max_messages: Max count of partial messages
+    :param int max_bytes: Max size of all partial messages
+    :param int mtu: Max size of datagram in bytes
+    """
+
+    def __init__(self, clock, deliver: Callable[[bytes, Tuple], None],
+                 write: Callable[[bytes, Tuple], None], timeout: float = 5,
+                 nack_delay: float = 0.5, max_nacks: int = 3,
+                 max_messages: int = 256, max_bytes: int = 4 * 1024 * 1024,
+                 mtu: int = 1200):
+        self.clock = clock
+        self.deliver = deliver
+        self.write = write
+        self.timeout = timeout
+        self.nack_delay = nack_delay
+        self.max_nacks = max_nacks
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_payload = mtu - MAX_HEADER
+        self.max_total = max(max_bytes // self.max_payload, 1)
+        self.max_nack_indexes = (mtu - MAX_HEADER) // MAX_INDEX_SIZE
+
+        self._partials: Dict[Tuple, Partial] = {}
+        self._done = TempDict(factory=None, expire=timeout, max_size=max_messages)
+        self.size = 0
+
+        self.completed = 0
+        self.dropped = 0
+
+    def on_fragment(self, data: bytes, addr: Tuple):
+        msg_id, index, total, payload = unpack_fragment(data)
+        if not payload or len(payload) > self.max_payload or total > self.max_total:
+            self.dropped += 1
+            return log.warning(f'Bad fragment from {addr}')
+        key = (addr, msg_id)
+        if key in self._done:
+            return
+        partial = self._partials.get(key)
+        if not partial:
+            if total * len(payload) > self.max_bytes:
+                self.dropped += 1
+                return log.warning(f'Too large message from {addr}')
+            partial = self._partials[key] = Partial(total, self.clock.seconds())
+        elif partial.total != total:
+            return
+        if index in partial.fragments:
+            return
+        partial.fragments[index] = payload
+        partial.size += len(payload)
+        self.size += len(payload)
+
+        if len(partial.fragments) == partial.total:
+            self._remove(key)
+            self._done[key] = True
+            self.completed += 1
+            return self.deliver(b''.join(partial.fragments[i] for i in range(total)), addr)
+
+        self._schedule(key, partial)
+        self._shrink()
+
+    def _schedule(self, key: Tuple, partial: Partial):
+        if partial.timer and partial.timer.active():
+            partial.timer.reset(self.nack_delay)
+        else:
+            partial.timer = self.clock.callLater(self.nack_delay, self._check, key)
+
+    def _check(self, key: Tuple):
+        partial = self._partials.get(key)
+        if not partial:
+            return
+        if self.clock.seconds() - partial.created >= self.timeout or \
+                partial.nacks >= self.max_nacks:
+            self.dropped += 1
+            log.debug(f'Message from {key[0]} is not reassembled')
+            return self._remove(key)
+        partial.nacks += 1
+        missing = list(islice((i for i in range(partial.total) if i not in partial.fragments),
+                              self.max_nack_indexes))
+        self.write(pack_nack(key[1], missing), key[0])
+        partial.timer = self.clock.callLater(self.nack_delay * 2 ** partial.nacks,
+                                             self._check, key)
+
+    def _shrink(self):
+        while self._partials and (len(self._partials) > self.max_messages or
+                                  self.size > self.max_bytes):
+            self.dropped += 1
+            self._remove(next(iter(self._partials)))
+
+    def _remove(self, key: Tuple):
+        partial = self._partials.pop(key)
+        self.size -= partial.size
+        if partial.timer and partial.timer.active():
+            partial.timer.cancel()
+
+    def start(self, clock=None):
+        self._done.start(clock)
+
+    def stop(self):
+        self._done.stop()
+        for key in list(self._partials):
+            self._remove(key)
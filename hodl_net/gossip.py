@@ -0,0 +1,171 @@
+"""
+Propagation of shouts and messages through the network.
+
+* `Flood` - every node re-sends new wrapper to all known peers.
+* `Gossip` - every node re-sends new wrapper to `fanout` random peers until
+  wrapper made `ttl` hops. Optional push-pull anti-entropy repairs messages
+  missed by gossip: nodes periodically exchange ids of recent wrappers with
+  a random peer and send each other the missing ones. Wrappers are kept
+  encoded, as they were received: node decrypts received wrapper in place
+  after propagation, and its plaintext must not be sent to other peers.
+"""
+
+from twisted.internet import task
+from typing import List, Optional
+
+from hodl_net.models import Message, MessageWrapper, TempDict, Peer
+from hodl_net.pacing import PRIORITY_LOW
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Propagation:
+    """
+    Base propagation mode
+
+    :param proto: `PeerProtocol` of node
+    """
+
+    name = None
+
+    def __init__(self, proto):
+        self.proto = proto
+        self.sent = 0
+
+    def propagate(self, wrapper: MessageWrapper, source: Optional[str] = None):
+        """
+        Re-send new wrapper
+
+        :param source: address of peer wrapper was received from
+        """
+        raise NotImplementedError
+
+    def on_digest(self, message: Message, _peer: Peer):
+        pass
+
+    def on_want(self, message: Message, _peer: Peer):
+        pass
+
+    def start(self, clock=None):
+        pass
+
+    def stop(self):
+        pass
+
+
+class Flood(Propagation):
+    name = 'flood'
+
+    def propagate(self, wrapper: MessageWrapper, source: Optional[str] = None):
+        for _peer in self.proto.peer_table.all():
+            if _peer.addr != source:
+                _peer.send(wrapper)
+                self.sent += 1
+
+
+class Gossip(Propagation):
+    """
+    :param int fanout: Count of peers each node re-sends wrapper to
+    :param int ttl: Max count of hops
+    :param float anti_entropy_interval: Seconds between anti-entropy rounds. 0 to disable
+    :param int history: Count of recent wrappers kept for anti-entropy
+    :param int digest_size: Max count of ids in one digest
+    """
+
+    name = 'gossip'
+
+    def __init__(self, proto, fanout: int = 4, ttl: int = 8,
+                 anti_entropy_interval: float = 0, history: int = 1000,
+                 digest_size: int = 100):
+        super().__init__(proto)
+        self.fanout = fanout
+        self.ttl = ttl
+        self.anti_entropy_interval = anti_entropy_interval
+        self.digest_size = digest_size
+
+        self.recent = TempDict(factory=None, max_size=history)
+        self.repaired = 0
+        self._loop = None
+
+    def propagate(self, wrapper: MessageWrapper, source: Optional[str] = None):
+        hops = wrapper.hops or 0
+        if hops < self.ttl:
+            wrapper.hops = hops + 1
+        if self.anti_entropy_interval:
+            wrapper.encoding = self.proto.encoding
+            self.recent[wrapper.id] = wrapper.to_bytes()
+        if hops >= self.ttl:
+            return
+        targets = [_peer for _peer in self.proto.peer_table.sample(self.fanout + 1)
+                   if _peer.addr != source]
+        for _peer in targets[:self.fanout]:
+            _peer.send(wrapper)
+            self.sent += 1
+
+    def anti_entropy(self):
+        """
+        Send digest of recent wrappers to random peer
+        """
+        _peer = self.proto.peer_table.random()
+        if not _peer:
+            return
+        ids = list(self.recent)[-self.digest_size:]
+        _peer.request(Message('gossip_digest', {'ids': ids}), expect_reply=False)
+        self.sent += 1
+
+    def on_digest(self, message: Message, _peer: Peer):
+        """
+        Push wrappers missing in peer's digest, pull wrappers missing here
+        """
+        ids = self._ids(message)
+        known = set(ids)
+        for uid in list(self.recent)[-self.digest_size:]:
+            if uid not in known:
+                self._repair(uid, _peer)
+        want = [uid for uid in ids if uid not in self.proto.seen]
+        if want:
+            _peer.request(Message('gossip_want', {'ids': want}), expect_reply=False)
+            self.sent += 1
+
+    def on_want(self, message: Message, _peer: Peer):
+        for uid in self._ids(message):
+            self._repair(uid, _peer)
+
+    def _ids(self, message: Message) -> List[str]:
+        """
+        Ids from digest or want of peer. Malformed ones are ignored
+        """
+        data = message.data or {}
+        ids = data.get('ids', []) if isinstance(data, dict) else []
+        if not isinstance(ids, list):
+            return []
+        return [uid for uid in ids[:self.digest_size] if isinstance(uid, str)]
+
+    def _repair(self, uid: str, _peer: Peer):
+        data = self.recent.get(uid)
+        if data:
+            self.proto._transmit(data, _peer.addr, PRIORITY_LOW)
+            self.sent += 1
+            self.repaired += 1
+
+    def start(self, clock=None):
+        if not self.anti_entropy_interval:
+            return
+        self.recent.start(clock)
+        self._loop = task.LoopingCall(self.anti_entropy)
+        if clock:
+            self._loop.clock = clock
+        self._loop.start(self.anti_entropy_interval, now=False)
+
+    def stop(self):
+        self.recent.stop()
+        if self._loop and self._loop.running:
+            self._loop.stop()
+
+
+modes = {
+    Flood.name: Flood,
+    Gossip.name: Gossip
+}
@@ -0,0 +1,150 @@
+"""
+In-memory datagram network for running many nodes in one process.
+
+`MemoryFabric` passes datagrams written to `MemoryTransport` of one node to
+`datagramReceived` of another node by `clock.callLater`, so the whole network
+runs on one reactor without sockets and sleeps. Subclasses may delay or lose
+datagrams by overriding `MemoryFabric.latency` and `MemoryFabric.lost`.
+
+`create_node` builds `Server` attached to fabric, `connect` makes full mesh
+of peers. Handlers are registered on `Server` class, so all nodes share them.
+Every node has its own `PeerProtocol`, so handlers must use `peer.proto` or
+`user.proto` instead of the global `protocol`.
+"""
+
+from twisted.internet.protocol import DatagramProtocol
+from typing import Dict, List, Tuple
+
+from hodl_net.cryptogr import gen_keys, key_cache
+from hodl_net.models import Peer
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class MemoryTransport:
+    """
+    Transport of one node in `MemoryFabric`
+    """
+
+    def __init__(self, fabric: 'MemoryFabric', addr: Tuple[str, int]):
+        self.fabric = fabric
+        self.addr = addr
+
+    def write(self, data: bytes, addr: Tuple[str, int]):
+        self.fabric.send(data, self.addr, tuple(addr))
+
+    def getHost(self):
+        return self.addr
+
+    def stopListening(self):
+        self.fabric.detach(self.addr)
+
+
+class MemoryFabric:
+    """
+    :param clock: reactor or `twisted.internet.task.Clock`
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self._nodes: Dict[Tuple[str, int], DatagramProtocol] = {}
+
+        self.sent = 0
+        self.delivered = 0
+        self.lost_count = 0
+        self.bytes = 0
+
+    def attach(self, proto: DatagramProtocol, addr: Tuple[str, int]) -> MemoryTransport:
+        """
+        Connect protocol to fabric at `addr` and start it
+        """
+        transport = MemoryTransport(self, addr)
+        self._nodes[addr] = proto
+        proto.makeConnection(transport)
+        return transport
+
+    def detach(self, addr: Tuple[str, int]):
+        proto = self._nodes.pop(addr, None)
+        if proto:
+            proto.doStop()
+
+    def latency(self, source: Tuple[str, int], target: Tuple[str, int]) -> float:
+        """
+        Delay of datagram, seconds
+        """
+        return 0
+
+    def lost(self, source: Tuple[str, int], target: Tuple[str, int]) -> bool:
+        """
+        True, if datagram must be lost
+        """
+        return False
+
+    def send(self, data: bytes, source: Tuple[str, int], target: Tuple[str, int]):
+        self.sent += 1
+        self.bytes += len(data)
+        if target not in self._nodes or self.lost(source, target):
+            self.lost_count += 1
+            return
+        self.clock.callLater(self.latency(source, target), self._deliver, data, source, target)
+
+    def _deliver(self, data: bytes, source: Tuple[str, int], target: Tuple[str, int]):
+        proto = self._nodes.get(target)
+        if not proto:
+            self.lost_count += 1
+            return
+        self.delivered += 1
+        proto.datagramReceived(data, source)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def stats(self) -> dict:
+        return {
+            'nodes': len(self._nodes),
+            'sent': self.sent,
+            'delivered': self.delivered,
+            'lost': self.lost_count,
+            'bytes': self.bytes
+        }
+
+
+def create_node(addr: Tuple[str, int], fabric: MemoryFabric = None, name: str = None,
+                keys: Tuple[str, str] = None, r=None, **kwargs):
+    """
+    `Server` with keys in memory. Its name is its address
+
+    :param fabric: Fabric to attach node to. None to listen by caller
+    :param keys: private and public RSA keys. Generated if None
+    :param r: reactor of server. `fabric.clock` if None
+    :param kwargs: other arguments of `Server`
+    """
+    from hodl_net.server import Server
+
+    node = Server(port=addr[1], r=r if r is not None else fabric.clock, **kwargs)
+    node.udp.name = name or f'{addr[0]}:{addr[1]}'
+    node.udp.private_key, node.udp.public_key = keys or gen_keys()
+    key_cache.pin(node.udp.private_key)
+    key_cache.pin(node.udp.public_key)
+    if fabric is not None:
+        fabric.attach(node.udp, addr)
+    return node
+
+
+def connect(nodes: List, addrs: List[Tuple[str, int]]):
+    """
+    Add all nodes to peer tables of each other. Peers are marked as synced,
+    so nodes don't exchange peer lists
+
+    :param addrs: addresses of nodes in the same order
+    """
+    for node, own in zip(nodes, addrs):
+        for addr in addrs:
+            str_addr = f'{addr[0]}:{addr[1]}'
+            if addr == own or node.udp.peer_table.get(str_addr):
+                continue
+            _peer = Peer(node.udp, addr=str_addr)
+            _peer.synced = True
+            node.udp.peer_table.add(_peer, notify=False)
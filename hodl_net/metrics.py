@@ -0,0 +1,224 @@
+"""
+Metrics of the net stack.
+
+`Registry` keeps counters, gauges and histograms with fixed buckets. Every
+metric is identified by name and labels and is created on first use, so hot
+paths keep references to their metrics and pay only for an addition or a
+bisect.
+
+Metrics are rendered in Prometheus text format by `Registry.render`. Server
+serves them on a local HTTP port or writes them to log periodically, see
+[metrics] section of config.
+"""
+
+from twisted.internet import task
+from twisted.web import resource, server as web_server
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import bisect
+import logging
+
+log = logging.getLogger(__name__)
+
+# Seconds, from 50 microseconds to 10 seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    type = 'counter'
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: Union[int, float] = 1):
+        self.value += amount
+
+    def samples(self, name: str) -> List[Tuple[str, Labels, float]]:
+        return [(f'{name}_total', (), self.value)]
+
+
+class Gauge:
+    """
+    Value, which is set directly or read from `func` on render
+    """
+
+    type = 'gauge'
+
+    __slots__ = ('value', 'func')
+
+    def __init__(self):
+        self.value = 0
+        self.func: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, func: Callable[[], float]):
+        self.func = func
+
+    def get(self) -> float:
+        return self.func() if self.func else self.value
+
+    def samples(self, name: str) -> List[Tuple[str, Labels, float]]:
+        return [(name, (), self.get())]
+
+
+class Histogram:
+    """
+    :param buckets: Sorted upper bounds of buckets
+    """
+
+    type = 'histogram'
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of bucket containing `q` quantile
+        """
+        if not self.count:
+            return 0.
+        rank, total = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self, name: str) -> List[Tuple[str, Labels, float]]:
+        samples, total = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            samples.append((f'{name}_bucket', (('le', _format(bound)),), total))
+        samples.append((f'{name}_sum', (), self.sum))
+        samples.append((f'{name}_count', (), self.count))
+        return samples
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+def _format(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    :param str prefix: Prefix of names of all metrics in `render`
+    """
+
+    def __init__(self, prefix: str = 'hodl_'):
+        self.prefix = prefix
+        self._metrics: Dict[str, Dict[Labels, Metric]] = {}
+        self._types: Dict[str, type] = {}
+
+    def _get(self, cls: type, name: str, labels: Dict[str, str], **kwargs) -> Metric:
+        known = self._types.setdefault(name, cls)
+        if known is not cls:
+            raise ValueError(f'Metric {name} is {known.type}, not {cls.type}')
+        key = tuple(sorted((label, str(value)) for label, value in labels.items()))
+        family = self._metrics.setdefault(name, {})
+        metric = family.get(key)
+        if not metric:
+            metric = family[key] = cls(**kwargs)
+        return metric
+
+    def counter(self, name: str, **labels) -> Counter:
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name: str, **labels) -> Gauge:
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                  **labels) -> Histogram:
+        return self._get(Histogram, name, labels, buckets=buckets)
+
+    def clear(self):
+        self._metrics.clear()
+        self._types.clear()
+
+    def render(self) -> str:
+        """
+        All metrics in Prometheus text format
+        """
+        lines = []
+        for name in sorted(self._metrics):
+            full_name = self.prefix + name
+            lines.append(f'# TYPE {full_name} {self._types[name].type}')
+            for labels, metric in sorted(self._metrics[name].items()):
+                for sample_name, extra, value in metric.samples(full_name):
+                    pairs = ','.join(f'{label}="{value_}"' for label, value_ in labels + extra)
+                    lines.append(f'{sample_name}{{{pairs}}} {_format(value)}' if pairs
+                                 else f'{sample_name} {_format(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, dict]:
+        """
+        Values of counters and gauges, counts and sums of histograms
+        """
+        result = {}
+        for name, family in self._metrics.items():
+            for labels, metric in family.items():
+                key = name + ''.join(f'[{label}={value}]' for label, value in labels)
+                if isinstance(metric, Histogram):
+                    result[key] = {'count': metric.count, 'sum': metric.sum}
+                elif isinstance(metric, Gauge):
+                    result[key] = metric.get()
+                else:
+                    result[key] = metric.value
+        return result
+
+
+registry = Registry()
+
+
+class MetricsResource(resource.Resource):
+    """
+    HTTP endpoint with rendered metrics
+    """
+
+    isLeaf = True
+
+    def __init__(self, _registry: Registry = registry):
+        super().__init__()
+        self.registry = _registry
+
+    def render_GET(self, request):
+        request.setHeader(b'content-type', b'text/plain; version=0.0.4')
+        return self.registry.render().encode()
+
+
+def listen(reactor, port: int, interface: str = '127.0.0.1', _registry: Registry = registry):
+    """
+    Serve metrics over HTTP
+    """
+    return reactor.listenTCP(port, web_server.Site(MetricsResource(_registry)),
+                             interface=interface)
+
+
+def start_dump(clock, interval: float, _registry: Registry = registry) -> task.LoopingCall:
+    """
+    Write metrics to log every `interval` seconds
+    """
+    loop = task.LoopingCall(lambda: log.info(f'Metrics:\n{_registry.render()}'))
+    loop.clock = clock
+    loop.start(interval, now=False)
+    return loop
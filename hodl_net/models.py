@@ -2,15 +2,23 @@
 Models, required for net full-functioning
 """
 
-from sqlalchemy import Column, String, Boolean
-from typing import TypeVar, List, Any, Dict
-
-from hodl_net.cryptogr import get_random, verify, sign, encrypt, decrypt
-from hodl_net.errors import BadRequest, VerificationFailed, CryptogrError
+from sqlalchemy import Column, String, Boolean, Integer, func, select
+from twisted.internet import task
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import TypeVar, List, Any, Dict, Callable
+
+from hodl_net.cryptogr import (
+    get_random, verify, sign, encrypt, decrypt, hybrid_encrypt, hybrid_decrypt
+)
+from hodl_net.errors import BadRequest, VerificationFailed, CryptogrError, DecryptionFailed
 from hodl_net.database import Base
 from hodl_net.utils.localchecker import check_ip
+from hodl_net import encoding as binary_encoding
 
+import itertools
 import logging
+import heapq
 import uuid
 import attr
 import time
@@ -30,33 +38,181 @@ class TempStructure:
         self.last_check = time.time()
 
 
-class TempDict(dict, TempStructure):
-    def __init__(self, *args, factory=list):
-        dict.__init__(self, *args)
+class TempDict(MutableMapping, TempStructure):
+    """
+    Dictionary with expiring keys.
+
+    Deadlines of keys are kept in a min-heap, so expiry costs amortized
+    O(log n) per inserted key and reads never scan the dictionary.
+    Expired keys are removed by `TempDict.check`, which is called by reactor
+    `LoopingCall` every `update_time` seconds after `TempDict.start`.
+    A read of an expired key, which was not removed yet, acts as a miss.
+
+    :param factory: Creates value for missing key in `__getitem__`.
+        None to raise `KeyError` instead
+    :param float expire: Lifetime of key in seconds. Class `expire` by default
+    :param int max_size: Max count of keys. Least recently used key is evicted
+        when it is exceeded. None for no limit
+    :param on_evict: Called with key and value of every expired or evicted key
+    """
+
+    def __init__(self, *args, factory=list, expire: float = None,
+                 max_size: int = None, on_evict: Callable[[T, Any], Any] = None):
         TempStructure.__init__(self)
         self.factory = factory
+        if expire:
+            self.expire = expire
+        self.max_size = max_size
+        self.on_evict = on_evict
+
+        self._data = OrderedDict()
+        self._deadlines = []
+        self._counter = itertools.count()
+        self._expirer = None
+        self.update(*args)
 
     def __setitem__(self, key: T, value: Any):
-        self.check()
-        super().__setitem__(key, {
-            'time': time.time(),
-            'value': value
-        })
+        deadline = time.time() + self.expire
+        self._data[key] = (deadline, value)
+        self._data.move_to_end(key)
+        heapq.heappush(self._deadlines, (deadline, next(self._counter), key))
+        if self.max_size and len(self._data) > self.max_size:
+            self._evict(*self._data.popitem(last=False))
+        if len(self._deadlines) > 2 * len(self._data) + 64:
+            self._compact()
 
     def __getitem__(self, key: T):
-        self.check()
-        if key not in self and self.factory:
-            value = self.factory()
-            self[key] = value
-            return value
-        return super().__getitem__(key)['value']
+        entry = self._data.get(key)
+        if entry:
+            if entry[0] > time.time():
+                self._data.move_to_end(key)
+                return entry[1]
+            self._evict(key, self._data.pop(key))
+        if not self.factory:
+            raise KeyError(key)
+        value = self.factory()
+        self[key] = value
+        return value
+
+    def get(self, key: T, default: Any = None):
+        entry = self._data.get(key)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        return default
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return bool(entry) and entry[0] > time.time()
+
+    def __delitem__(self, key: T):
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self.items())})'
+
+    def _evict(self, key: T, entry: tuple):
+        if self.on_evict:
+            self.on_evict(key, entry[1])
+
+    def _compact(self):
+        self._deadlines = [(deadline, next(self._counter), key)
+                           for key, (deadline, _) in self._data.items()]
+        heapq.heapify(self._deadlines)
 
     def check(self):
-        if time.time() - self.last_check < self.update_time:
+        """
+        Remove expired keys
+        """
+        now = self.last_check = time.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._deadlines)
+            entry = self._data.get(key)
+            if entry and entry[0] == deadline:
+                self._evict(key, self._data.pop(key))
+
+    def start(self, clock=None):
+        """
+        Start periodic expiry
+
+        :param clock: reactor or `twisted.internet.task.Clock`. Global reactor by default
+        """
+        if self._expirer and self._expirer.running:
             return
-        for key, value in self.copy().items():
-            if time.time() - value['time'] >= self.expire:
-                del self[key]
+        self._expirer = task.LoopingCall(self.check)
+        if clock:
+            self._expirer.clock = clock
+        self._expirer.start(self.update_time, now=False)
+
+    def stop(self):
+        if self._expirer and self._expirer.running:
+            self._expirer.stop()
+
+
+class SeenFilter(TempStructure):
+    """
+    Filter of already seen message ids.
+
+    Stores only 64-bit digests of ids (`hash` of id string, salted per process)
+    in two time buckets. The current bucket is rotated into the previous one every
+    `expire` seconds or when it holds `max_size // 2` digests, so an id is
+    remembered for at least `expire` seconds unless more than `max_size // 2`
+    ids arrive during that time. Memory never exceeds `max_size` digests
+    and no message payloads are kept.
+
+    False positive rate (new id considered seen) is about n / 2 ** 64
+    for n stored digests, i.e. below 1e-13 for default `max_size`.
+
+    :param int max_size: Max count of stored digests
+    :param float expire: Lifetime of bucket in seconds
+    :param clock: reactor or `twisted.internet.task.Clock` to take time from.
+        Wall time by default
+    """
+
+    def __init__(self, max_size: int = 200000, expire: float = None, clock=None):
+        super().__init__()
+        self.max_size = max_size
+        if expire:
+            self.expire = expire
+        self._time = clock.seconds if clock else time.time
+        self.last_check = self._time()
+        self._current = set()
+        self._previous = set()
+        self.rotations = 0
+
+    def _rotate(self, now: float):
+        self._previous = self._current
+        self._current = set()
+        self.last_check = now
+        self.rotations += 1
+
+    def add(self, uid: str) -> bool:
+        """
+        Remember id
+
+        :return: True, if id was not seen before
+        """
+        digest = hash(uid)
+        if digest in self._current or digest in self._previous:
+            return False
+        now = self._time()
+        if now - self.last_check >= self.expire or \
+                len(self._current) >= self.max_size // 2:
+            self._rotate(now)
+        self._current.add(digest)
+        return True
+
+    def __contains__(self, uid: str):
+        digest = hash(uid)
+        return digest in self._current or digest in self._previous
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
 
 
 @attr.s
@@ -134,7 +290,11 @@ class MessageWrapper:
     :param sender: Nickname of sender.
     :type sender: str or None
 
-    :param str encoding: Encoding type of class Message. JSON default.
+    :param str encoding: Wire encoding of wrapper. Possible encodings:
+
+        * 'json' - default, readable by all nodes.
+        * 'binary' - compact length-prefixed format, see `hodl_net.encoding`.
+          Starts with magic byte, so `MessageWrapper.from_bytes` accepts both.
 
     :param str id: Message id. Generated automatically.
         If we receive two messages with the same id, one of them will be rejected.
@@ -146,6 +306,21 @@ class MessageWrapper:
         message already left a tunnel.
     :type tunnel_id: str or None
 
+    :param str cipher: Encryption mode of message. Possible modes:
+
+        * 'rsa' - message is split into blocks, each block is encrypted with RSA.
+          Default for wrappers from nodes which don't send this field.
+        * 'rsa-aes-gcm' - message is encrypted with fresh AES-GCM key,
+          which is encrypted with RSA.
+        * 'session' - message is encrypted with key of session between sender and
+          addressee. `sign` is HMAC made with session key instead of RSA signature.
+
+    :param session_id: ID of session. None, if `MessageWrapper.cipher != 'session'`
+    :type session_id: str or None
+
+    :param hops: Count of hops message made. Set by gossip propagation only.
+    :type hops: int or None
+
 
     .. UFO Alert!:: If message type is 'request', leave the field 'sender' empty.
         Otherwise you could be deanonymized.
@@ -158,9 +333,17 @@ class MessageWrapper:
     id = attr.ib(type=str)
     sign = attr.ib(type=str, default=None)
     tunnel_id = attr.ib(type=str, default=None)
+    cipher = attr.ib(type=str, default='rsa')
+    session_id = attr.ib(type=str, default=None)
+    hops = attr.ib(type=int, default=None)
 
     acceptable_types = ['message', 'request', 'shout']
-    acceptable_encodings = ['json']
+    acceptable_encodings = ['json', 'binary']
+    ciphers = {
+        'rsa': (encrypt, decrypt),
+        'rsa-aes-gcm': (hybrid_encrypt, hybrid_decrypt)
+    }
+    acceptable_ciphers = [*ciphers, 'session']
 
     @id.default
     def _id_gen(self):
@@ -176,9 +359,14 @@ class MessageWrapper:
         :raises hodl_net.errors.BadRequest: if fields in message have wrong type
         """
         try:
-            wrapper = json.loads(wrapper.decode('utf-8'))
+            if wrapper[:1] == bytes((binary_encoding.MAGIC,)):
+                wrapper = binary_encoding.unpack(wrapper)
+            else:
+                wrapper = json.loads(wrapper.decode('utf-8'))
         except (ValueError, UnicodeDecodeError):
             raise BadRequest
+        if not isinstance(wrapper, dict):
+            raise BadRequest
         message_type = wrapper.get('type')
         if not message_type or message_type not in cls.acceptable_types:
             raise BadRequest('Wrong message type')
@@ -205,6 +393,16 @@ class MessageWrapper:
         tunnel_id = wrapper.get('tunnel_id')
         if tunnel_id and not isinstance(tunnel_id, str):
             raise BadRequest('Wrong metadata')
+        cipher = wrapper.get('cipher', 'rsa')
+        if cipher not in cls.acceptable_ciphers:
+            raise BadRequest('Unknown cipher')
+        session_id = wrapper.get('session_id')
+        if cipher == 'session' and (not session_id or
+                                    not isinstance(session_id, str)):
+            raise BadRequest('Session id required')
+        hops = wrapper.get('hops')
+        if hops is not None and (not isinstance(hops, int) or hops < 0):
+            raise BadRequest('Wrong hops')
 
         wrapper = cls(
             message,
@@ -213,7 +411,10 @@ class MessageWrapper:
             encoding,
             uid,
             signature,
-            tunnel_id
+            tunnel_id,
+            cipher,
+            session_id,
+            hops
         )
         return wrapper
 
@@ -227,17 +428,35 @@ class MessageWrapper:
         """
         if isinstance(self.message, str):
             return self.message
-        return encrypt(self.message.to_json(), public_key)
+        _encrypt, _ = self.ciphers[self.cipher]
+        return _encrypt(self.message.to_json(), public_key)
 
-    def decrypt(self, private_key: str):
+    def decrypt(self, private_key: str, sessions=None):
         """
         Decrypt `Message` from string (`self.message type must be `str`)
 
         :param str private_key: RSA private key
+        :param sessions: Sessions of this node. Required for `'session'` cipher
+        :type sessions: hodl_net.sessions.SessionStore or None
+
+        :raises hodl_net.errors.DecryptionFailed: if session is unknown
+        :raises hodl_net.errors.VerificationFailed: if session MAC is wrong
         """
-        if isinstance(self.message, dict):
+        if isinstance(self.message, Message):
             return
-        self.message = json.loads(decrypt(self.message, private_key))
+        if self.cipher == 'session':
+            session = sessions.get(self.session_id) if sessions else None
+            if not session or session.user != self.sender:
+                raise DecryptionFailed('Unknown session')
+            if not session.check_mac(self._mac_data(), self.sign):
+                raise VerificationFailed('Bad MAC')
+            self.message = Message(**json.loads(session.decrypt(self.message)))
+            return
+        _, _decrypt = self.ciphers[self.cipher]
+        self.message = Message(**json.loads(_decrypt(self.message, private_key)))
+
+    def _mac_data(self) -> str:
+        return f'{self.sender}:{self.id}:{self.session_id}:{self.message}'
 
     def create_sign(self, private_key: str):
         self.sign = sign(self.message.to_json(), private_key)
@@ -249,14 +468,13 @@ class MessageWrapper:
         :param str public_key: RSA public_key key of sender
         :raises hodl_net.errors.VerificationFailed: if message has bad sign
         """
-        if self.type == 'request':
-            return
+        if self.type == 'request' or self.cipher == 'session':
+            return  # MAC of session is checked in `MessageWrapper.decrypt`
         if not verify(self.message.to_json(), self.sign, public_key):
             raise VerificationFailed('Bad signature')
 
-
-
-    def prepare(self, private_key: str = None, public_key: str = None):
+    def prepare(self, private_key: str = None, public_key: str = None,
+                session=None):
         """
         Prepare wrapper for send
 
@@ -265,17 +483,61 @@ class MessageWrapper:
         :type public_key: str or None
 
         :param private_key: our RSA private key.
-            None if `MessageWrapper.type` == `'request'` or `'shout'`
+            None if `MessageWrapper.type` == `'request'`
         :type private_key: str or None
 
+        :param session: Session with addressee. If set, RSA is not used.
+        :type session: hodl_net.sessions.Session or None
+
         """
         assert self.type != 'request' or not self.sender
         if self.type == 'request':
             return
-        if not private_key and self.type != 'shout':
+        if session:
+            self.cipher = 'session'
+            self.session_id = session.id
+            self.message = session.encrypt(self.message.to_json())
+            self.sign = session.mac(self._mac_data())
+            return
+        if not private_key:
             raise CryptogrError('Private key is None')
         self.sign = sign(self.message.to_json(), private_key)
-        self.message: Message = self.encrypt(public_key)
+        if self.type != 'shout':  # Shouts are signed, but not encrypted
+            self.message: Message = self.encrypt(public_key)
+
+    async def prepare_async(self, pool, private_key: str = None, public_key: str = None):
+        """
+        `MessageWrapper.prepare` with RSA operations in `hodl_net.cryptogr.CryptoPool`
+        """
+        if self.type == 'request':
+            return
+        if not private_key:
+            raise CryptogrError('Private key is None')
+        plaintext = self.message.to_json()
+        if self.type == 'shout':
+            self.sign = await pool.sign(plaintext, private_key)
+            return
+        _encrypt, _ = self.ciphers[self.cipher]
+        signed = pool.sign(plaintext, private_key)
+        encrypted = pool.submit(_encrypt.__name__, plaintext, public_key)
+        self.sign = await signed
+        self.message = await encrypted
+
+    async def open_async(self, pool, private_key: str, public_key: str, sessions=None):
+        """
+        `MessageWrapper.decrypt` and `MessageWrapper.verify` with RSA operations
+        in `hodl_net.cryptogr.CryptoPool`
+        """
+        if self.cipher == 'session':
+            return self.decrypt(private_key, sessions)  # MAC is checked with decryption
+        if not isinstance(self.message, Message):  # Shouts are signed only
+            _, _decrypt = self.ciphers[self.cipher]
+            plaintext = await pool.submit(_decrypt.__name__, self.message, private_key)
+            self.message = Message(**json.loads(plaintext))
+        if self.type == 'request':
+            return
+        if not await pool.verify(self.message.to_json(), self.sign, public_key):
+            raise VerificationFailed('Bad signature')
 
     def to_json(self):
         """
@@ -286,12 +548,24 @@ class MessageWrapper:
         """
         return json.dumps(attr.asdict(self))
 
+    def to_bytes(self) -> bytes:
+        """
+        MessageWrapper to bytes in `MessageWrapper.encoding`
+        """
+        if self.encoding == 'binary':
+            return binary_encoding.pack(attr.asdict(self))
+        return self.to_json().encode('utf-8')
+
 
 class Peer(Base):
     __tablename__ = 'peers'
 
     _addr = Column(String, primary_key=True)
     local = Column(Boolean, default=False)
+    seq = Column(Integer)  # Position in change sequence of `PeerTable`
+    peers_cursor = Column(Integer, default=0)  # Last peer's seqs pulled by `share`
+    users_cursor = Column(Integer, default=0)
+    synced = False  # `share` was sent to peer since start
     addr = property()
 
     def __init__(self, proto, *args, **kwargs):
@@ -305,7 +579,7 @@ class Peer(Base):
     @addr.setter
     def addr(self, val):
         self._addr = val
-        self.local = check_ip(val.split(":")[0])
+        self.local = check_ip(val.rsplit(':', 1)[0])
 
     def copy(self):
         return self
@@ -328,20 +602,24 @@ class Peer(Base):
             return self.request(wrapper)
         return self.proto._send(wrapper, self.addr)
 
-    def request(self, message: Message):
+    def request(self, message: Message, timeout: float = None, expect_reply: bool = True):
         """
         Send request to Peer.
 
+        :param timeout: seconds to wait for response. Default from config if None
+        :param bool expect_reply: if False, nothing is waiting for response
+        :return: Deferred, which fires with response, or None if `expect_reply` is False
+
         .. warning:: Requests are unsafe.
             Don't try to send private information via `Peer.request`
         """
         log.debug(f'{self}: Send request {message}')
         wrapper = MessageWrapper(message, 'request')
-        return self.proto._send(wrapper, self.addr)
+        return self.proto._send(wrapper, self.addr, expect_reply, timeout)
 
     def response(self, to: Message, message: Message):
         message.callback = to.callback
-        return self.request(message)
+        return self.request(message, expect_reply=False)
 
     def dump(self) -> Dict[str, str]:
         return {
@@ -357,43 +635,40 @@ class User(Base):
 
     public_key = Column(String)
     name = Column(String, primary_key=True)
+    seq = Column(Integer, index=True)  # Position in change sequence of users
+
+    @staticmethod
+    def last_seq(ses) -> int:
+        """
+        Last value of users change sequence
+        """
+        return ses.query(func.max(User.seq)).scalar() or 0
+
+    @staticmethod
+    def next_seq():
+        """
+        SQL expression of the next value of users change sequence. It is
+        evaluated by INSERT, so concurrent writers don't get the same value
+        """
+        return select(func.coalesce(func.max(User.seq), 0) + 1).scalar_subquery()
 
     def __init__(self, proto, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.proto = proto
 
-    def send(self, message: Message):
+    def send(self, message: Message, timeout: float = None, expect_reply: bool = True):
         log.debug(f'{self}: Send {message}')
-        return self.proto.send(message, self.name)
+        return self.proto.send(message, self.name, timeout, expect_reply)
 
     def set_proto(self, proto):
         self.proto = proto
 
     def response(self, to: Message, message: Message):
         message.callback = to.callback
-        return self.send(message)
+        return self.send(message, expect_reply=False)
 
     def dump(self) -> Dict[str, str]:
         return {
             'key': self.public_key,
             'name': self.name
         }
-
-
-class Tunnels(TempDict):
-    """
-    Tunnel class
-    """
-
-    expire = 6000
-
-    def add(self, tunnel_id: str, backward_peer: Peer, forward_peer: Peer):
-        # TODO: docstring
-        self[tunnel_id] = [backward_peer, forward_peer]
-
-    def send(self, message: MessageWrapper):
-        # TODO: docstring
-        peers = self.get(message.tunnel_id)
-        if not peers:
-            return
-        peers[1]._send(message)
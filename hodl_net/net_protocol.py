@@ -1,33 +1,57 @@
 from hodl_net.models import *
-from hodl_net.server import peer, protocol, server, session, call_from_thread
+from hodl_net.server import peer, user, protocol, server, session
 from hodl_net.database import db_worker
-import sqlalchemy.exc
 
 
 @server.handle('share', 'request')
 @db_worker.with_session
-async def share_peers(_):
-    peers = [_peer.dump() for _peer in session.query(Peer).all() if not _peer.local]
-    users = [_user.dump() for _user in session.query(User).all()]
+async def share_peers(message):
+    """
+    Send peers and users added after `since` cursor, up to `limit` of each
+    """
+    data = message.data or {}
+    since = data.get('since') or {}
+    limit = max(1, min(int(data.get('limit', peer.proto.share_page_size)),
+                       peer.proto.share_max_page_size))
+    last = {'peers': peer.proto.peer_table.seq, 'users': User.last_seq(session)}
+    # Cursor from the future means that this node lost its DB. Start from scratch
+    since = {key: since.get(key, 0) if since.get(key, 0) <= last[key] else 0 for key in last}
+
+    peers, peers_cursor = peer.proto.peer_table.changes_since(since['peers'], limit, local=False)
+    users = session.query(User).filter(User.seq > since['users']) \
+        .order_by(User.seq).limit(limit).all()
+    users_cursor = users[-1].seq if len(users) == limit else last['users']
     peer.request(Message(
         name='share_info',
         data={
-            'users': users,
-            'peers': peers
+            'users': [_user.dump() for _user in users],
+            'peers': [_peer.dump() for _peer in peers],
+            'cursor': {'peers': peers_cursor, 'users': users_cursor},
+            'more': peers_cursor < last['peers'] or users_cursor < last['users']
         }
-    ))
+    ), expect_reply=False)
+
+
+def add_users(users: List[Dict[str, str]]) -> List[User]:
+    """
+    Save unknown users with next values of users change sequence
+
+    :return: new users
+    """
+    users = {data['name']: data for data in users}
+    known = {name for name, in session.query(User.name).filter(User.name.in_(list(users)))}
+    new_users = [User(peer.proto, public_key=data['key'], name=name, seq=User.next_seq())
+                 for name, data in users.items() if name not in known]
+    session.add_all(new_users)
+    session.commit()
+    return new_users
 
 
 @server.handle('new_user', 'shout')
 @db_worker.with_session
 async def record_new_user(message):
-    data = message.data
-    new_user = session.query(User).filter_by(name=name).first()
-    if not new_user:
-        new_user = User(protocol, public_key=data['key'], name=data['name'])
-        session.add(new_user)
-        session.commit()
-        protocol.send_all(Message(
+    for new_user in add_users([message.data]):
+        peer.proto.send_all(Message(
             name='new_user',
             data=new_user.dump()
         ))
@@ -36,28 +60,61 @@ async def record_new_user(message):
 @server.handle('share_info', 'request')
 @db_worker.with_session
 async def record_peers(message):
+    proto = peer.proto
     for data in message.data['peers']:
-        if not session.query(Peer).filter_by(addr=data['address']).first():
-            try:
-                new_peer = Peer(protocol, addr=data['address'])
-                session.add(new_peer)  # TODO: test new peers
-            except sqlalchemy.exc.IntegrityError as e:
-                log.warning("Fail on peer adding. Probably already exists. More info:")
-                log.debug(e)
-
-    for data in message.data['users']:
-        if not session.query(User).filter_by(name=data['name']):
-            new_user = Peer(protocol, public_key=data['key'], name=data['name'])
-            session.add(new_user)
-    call_from_thread(session.commit)
-
-
-@server.handle('ping', 'request')
+        if data['address'] not in proto.peer_table:  # Most of shared peers are known
+            proto.add_peer(Peer(proto, addr=data['address']), 'share')
+    if message.data['users']:
+        add_users(message.data['users'])
+
+    if 'cursor' in message.data:  # Nodes without delta sync send everything at once
+        proto.peer_table.set_cursor(peer.addr, message.data['cursor'])
+        if message.data.get('more'):
+            proto.reactor.callFromThread(proto.sync, proto.peer_table.get(peer.addr))
+
+
+@server.handle('session_init', 'message')
+async def accept_session(message):
+    if peer.proto.sessions is None:
+        return
+    peer.proto.sessions.accept(user.name, message.data)
+    user.response(message, Message('session_ack'))
+
+
+@server.handle('gossip_digest', 'request', executor='inline')
+async def gossip_digest(message):
+    peer.proto.propagation.on_digest(message, peer)
+
+
+@server.handle('gossip_want', 'request', executor='inline')
+async def gossip_want(message):
+    peer.proto.propagation.on_want(message, peer)
+
+
+@server.handle('tunnel_setup', 'request', executor='inline')
+async def tunnel_setup(message):
+    if peer.proto.tunnels:
+        peer.proto.tunnels.on_setup(message, peer)
+
+
+@server.handle('tunnel_ready', 'request', executor='inline')
+async def tunnel_ready(message):
+    if peer.proto.tunnels:
+        peer.proto.tunnels.on_ready(message, peer)
+
+
+@server.handle('tunnel_teardown', 'request', executor='inline')
+async def tunnel_teardown(message):
+    if peer.proto.tunnels:
+        peer.proto.tunnels.on_teardown(message, peer)
+
+
+@server.handle('ping', 'request', executor='inline')
 async def ping(_):
     pass
 
 
-@server.handle('echo', 'request')
+@server.handle('echo', 'request', executor='inline')
 async def echo(message):
     peer.response(message, Message('echo_resp', {
         'msg': message.data['msg']
@@ -0,0 +1,242 @@
+"""
+Per-peer rate limiting of datagrams.
+
+Every peer has inbound and outbound token buckets, which are refilled with
+`rate` bytes per second up to `burst` bytes. Datagram larger than `burst` is
+let through when the bucket is full, so it can't stall the queue forever.
+
+Inbound datagrams over the budget are dropped before decoding. Outbound ones
+wait in a bounded queue of the peer, which is drained by reactor as soon as
+the bucket has enough tokens. When queue is full, datagram is dropped by
+`policy`:
+
+* `drop_oldest` - the oldest queued datagram.
+* `drop_lowest` - the oldest of queued datagrams with the lowest priority,
+  or the new one, if its priority is lower than priority of all queued ones.
+
+Replies and tunnel frames have `PRIORITY_HIGH`, propagated shouts and
+messages have `PRIORITY_LOW`.
+"""
+
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+import logging
+
+log = logging.getLogger(__name__)
+
+PRIORITY_LOW = 0
+PRIORITY_HIGH = 1
+
+DROP_OLDEST = 'drop_oldest'
+DROP_LOWEST = 'drop_lowest'
+
+
+class TokenBucket:
+    """
+    :param float rate: Tokens added per second
+    :param float burst: Max count of tokens
+    :param float now: Current time
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, size: float, now: float) -> bool:
+        """
+        Take `size` tokens, if there are enough of them
+        """
+        self._refill(now)
+        if self.tokens < min(size, self.burst):
+            return False
+        self.tokens -= size
+        return True
+
+    def delay(self, size: float, now: float) -> float:
+        """
+        Seconds until `size` tokens can be taken
+        """
+        self._refill(now)
+        return max(min(size, self.burst) - self.tokens, 0) / self.rate
+
+
+class PeerBudget:
+    """
+    Buckets, queue and counters of one peer
+    """
+
+    __slots__ = ('inbound', 'outbound', 'queue', 'timer', 'sent', 'received',
+                 'dropped_in', 'dropped_out')
+
+    def __init__(self, inbound: Optional[TokenBucket], outbound: Optional[TokenBucket]):
+        self.inbound = inbound
+        self.outbound = outbound
+        self.queue: Deque[Tuple[int, bytes]] = deque()
+        self.timer = None
+        self.sent = 0
+        self.received = 0
+        self.dropped_in = 0
+        self.dropped_out = 0
+
+    def stats(self) -> dict:
+        return {
+            'queued': len(self.queue),
+            'sent': self.sent,
+            'received': self.received,
+            'dropped_in': self.dropped_in,
+            'dropped_out': self.dropped_out
+        }
+
+
+class Pacer:
+    """
+    :param clock: reactor or `twisted.internet.task.Clock`
+    :param write: Called with data and address to write datagram
+    :param float rate: Outbound bytes per second to one peer. 0 for no limit
+    :param float burst: Outbound bytes, which can be sent to one peer at once
+    :param float inbound_rate: Inbound bytes per second from one peer. 0 for no limit
+    :param float inbound_burst: Inbound bytes, which can be received from one peer at once
+    :param int queue_size: Max count of datagrams waiting for one peer
+    :param str policy: `DROP_OLDEST` or `DROP_LOWEST`
+    :param int max_peers: Max count of peers with budget. Budgets of idle peers
+        over this count are forgotten, the least recently used first
+    """
+
+    def __init__(self, clock, write: Callable[[bytes, Tuple], None],
+                 rate: float = 0, burst: float = 65536,
+                 inbound_rate: float = 0, inbound_burst: float = 65536,
+                 queue_size: int = 256, policy: str = DROP_OLDEST, max_peers: int = 10000):
+        if policy not in (DROP_OLDEST, DROP_LOWEST):
+            raise ValueError(f'Unknown drop policy {policy}')
+        self.clock = clock
+        self.write = write
+        self.rate = rate
+        self.burst = burst
+        self.inbound_rate = inbound_rate
+        self.inbound_burst = inbound_burst
+        self.queue_size = queue_size
+        self.policy = policy
+        self.max_peers = max_peers
+
+        self._peers: Dict[Tuple, PeerBudget] = OrderedDict()
+
+        self.dropped_in = 0
+        self.dropped_out = 0
+
+    def _budget(self, addr: Tuple) -> PeerBudget:
+        budget = self._peers.get(addr)
+        if budget:
+            self._peers.move_to_end(addr)
+            return budget
+        now = self.clock.seconds()
+        budget = self._peers[addr] = PeerBudget(
+            TokenBucket(self.inbound_rate, self.inbound_burst, now) if self.inbound_rate else None,
+            TokenBucket(self.rate, self.burst, now) if self.rate else None)
+        if len(self._peers) > self.max_peers:
+            for old_addr, old_budget in self._peers.items():
+                if not old_budget.queue and old_addr != addr:
+                    del self._peers[old_addr]
+                    break
+        return budget
+
+    def allow(self, addr: Tuple, size: int) -> bool:
+        """
+        Check inbound datagram
+
+        :return: False, if peer is over its budget and datagram must be dropped
+        """
+        if not self.inbound_rate:
+            return True
+        budget = self._budget(addr)
+        if not budget.inbound.consume(size, self.clock.seconds()):
+            budget.dropped_in += 1
+            self.dropped_in += 1
+            return False
+        budget.received += 1
+        return True
+
+    def send(self, data: bytes, addr: Tuple, priority: int = PRIORITY_HIGH):
+        """
+        Write datagram now, if budget allows it, or queue it
+        """
+        if not self.rate:
+            return self.write(data, addr)
+        budget = self._budget(addr)
+        if not budget.queue and budget.outbound.consume(len(data), self.clock.seconds()):
+            budget.sent += 1
+            return self.write(data, addr)
+        if len(budget.queue) >= self.queue_size and not self._make_room(budget, priority):
+            return self._dropped(budget, addr)
+        budget.queue.append((priority, data))
+        self._schedule(budget, addr)
+
+    def _make_room(self, budget: PeerBudget, priority: int) -> bool:
+        """
+        Drop queued datagram by policy
+
+        :return: False, if the new datagram must be dropped instead
+        """
+        if self.policy == DROP_OLDEST:
+            victim = 0
+        else:
+            victim = min(range(len(budget.queue)), key=lambda i: budget.queue[i][0])
+            if budget.queue[victim][0] > priority:
+                return False
+        del budget.queue[victim]
+        budget.dropped_out += 1
+        self.dropped_out += 1
+        return True
+
+    def _dropped(self, budget: PeerBudget, addr: Tuple):
+        budget.dropped_out += 1
+        self.dropped_out += 1
+        log.debug(f'Queue of {addr} is full, datagram is dropped')
+
+    def _schedule(self, budget: PeerBudget, addr: Tuple):
+        if budget.timer or not budget.queue:
+            return
+        delay = budget.outbound.delay(len(budget.queue[0][1]), self.clock.seconds())
+        budget.timer = self.clock.callLater(delay, self._drain, addr)
+
+    def _drain(self, addr: Tuple):
+        budget = self._peers.get(addr)
+        if not budget:
+            return
+        budget.timer = None
+        now = self.clock.seconds()
+        while budget.queue and budget.outbound.consume(len(budget.queue[0][1]), now):
+            _, data = budget.queue.popleft()
+            budget.sent += 1
+            self.write(data, addr)
+        self._schedule(budget, addr)
+
+    def stop(self):
+        """
+        Cancel draining. Queued datagrams are discarded
+        """
+        for budget in self._peers.values():
+            if budget.timer and budget.timer.active():
+                budget.timer.cancel()
+            budget.timer = None
+            budget.queue.clear()
+
+    def peer_stats(self, addr: Tuple) -> Optional[dict]:
+        budget = self._peers.get(addr)
+        return budget.stats() if budget else None
+
+    def stats(self) -> dict:
+        return {
+            'peers': len(self._peers),
+            'queued': sum(len(budget.queue) for budget in self._peers.values()),
+            'dropped_in': self.dropped_in,
+            'dropped_out': self.dropped_out
+        }
@@ -0,0 +1,329 @@
+"""
+In-memory peer table.
+
+`PeerTable` is the live source of truth for known peers. `models.Peer` rows in
+SQLite are only a persistence layer: the table is loaded from the DB on start
+and changes are written back in batches from a background thread.
+
+Every added peer gets the next value of a monotonic change sequence, so other
+nodes can pull only peers added since their last `share` (see
+`PeerTable.changes_since`).
+"""
+
+from twisted.internet import task, threads
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from hodl_net.database import db_worker
+from hodl_net.models import Peer
+
+import sqlalchemy.exc
+
+import threading
+import logging
+import random
+import bisect
+
+log = logging.getLogger(__name__)
+
+
+class IndexedSet:
+    """
+    Set with O(1) add, discard and random choice. Not thread-safe,
+    `PeerTable` uses it under its lock.
+    """
+
+    def __init__(self):
+        self._items: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def add(self, key: str):
+        if key in self._index:
+            return
+        self._index[key] = len(self._items)
+        self._items.append(key)
+
+    def discard(self, key: str):
+        pos = self._index.pop(key, None)
+        if pos is None:
+            return
+        last = self._items.pop()
+        if pos < len(self._items):
+            self._items[pos] = last
+            self._index[last] = pos
+
+    def choice(self) -> Optional[str]:
+        if not self._items:
+            return None
+        return random.choice(self._items)
+
+    def sample(self, k: int) -> List[str]:
+        return random.sample(self._items, min(k, len(self._items)))
+
+    def __getitem__(self, pos: int) -> str:
+        return self._items[pos]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+
+class PeerTable:
+    """
+    Peers indexed by address and by `Peer.local` flag.
+
+    :param proto: `PeerProtocol`, assigned to every peer in the table
+    """
+
+    flush_interval = 5
+    batch_size = 500
+    on_add: Callable[[Peer], None] = None  # Called with every new peer
+
+    def __init__(self, proto):
+        self.proto = proto
+
+        self._peers: Dict[str, Peer] = {}
+        self._by_local = {
+            True: IndexedSet(),
+            False: IndexedSet()
+        }
+        self._dirty: Set[str] = set()
+        self._removed: Set[str] = set()
+        self.seq = 0
+        self._seqs: List[int] = []  # Sorted, may contain seqs of removed peers
+        self._by_seq: Dict[int, str] = {}
+        self._lock = threading.RLock()
+        self._flusher = task.LoopingCall(self.flush)
+        self._flushing = None
+
+    def get(self, addr: str) -> Optional[Peer]:
+        with self._lock:
+            return self._peers.get(addr)
+
+    def add(self, _peer: Peer, notify: bool = True) -> bool:
+        """
+        Add peer to table
+
+        :param notify: call `PeerTable.on_add` if peer is new
+        :return: True, if peer is new
+        """
+        with self._lock:
+            if _peer.addr in self._peers:
+                return False
+            _peer.proto = self.proto
+            self.seq += 1
+            _peer.seq = self.seq
+            self._insert(_peer)
+            self._removed.discard(_peer.addr)
+            self._dirty.add(_peer.addr)
+        if notify and self.on_add:
+            self.on_add(_peer)
+        return True
+
+    def remove(self, addr: str):
+        with self._lock:
+            _peer = self._peers.pop(addr, None)
+            if not _peer:
+                return
+            self._by_local[bool(_peer.local)].discard(addr)
+            self._by_seq.pop(_peer.seq, None)
+            self._dirty.discard(addr)
+            self._removed.add(addr)
+
+    def _insert(self, _peer: Peer):
+        self._peers[_peer.addr] = _peer
+        self._by_local[bool(_peer.local)].add(_peer.addr)
+        if _peer.seq:
+            self._by_seq[_peer.seq] = _peer.addr
+            self._seqs.append(_peer.seq)
+
+    def all(self, local: bool = None) -> List[Peer]:
+        """
+        :param local: filter by `Peer.local`. None for all peers
+        """
+        with self._lock:
+            if local is None:
+                return list(self._peers.values())
+            return [self._peers[addr] for addr in self._by_local[local]
+                    if addr in self._peers]
+
+    def random(self, local: bool = None) -> Optional[Peer]:
+        """
+        Random peer from table. None, if table is empty
+        """
+        with self._lock:
+            if local is None:
+                local_count = len(self._by_local[True])
+                total = local_count + len(self._by_local[False])
+                if not total:
+                    return None
+                local = random.randrange(total) < local_count
+            return self._peers.get(self._by_local[local].choice())
+
+    def sample(self, k: int, local: bool = None) -> List[Peer]:
+        """
+        Up to `k` distinct random peers
+        """
+        with self._lock:
+            if local is None:
+                local_peers, other_peers = self._by_local[True], self._by_local[False]
+                total = len(local_peers) + len(other_peers)
+                addrs = [local_peers[i] if i < len(local_peers)
+                         else other_peers[i - len(local_peers)]
+                         for i in random.sample(range(total), min(k, total))]
+            else:
+                addrs = self._by_local[local].sample(k)
+            return [self._peers[addr] for addr in addrs if addr in self._peers]
+
+    def changes_since(self, cursor: int, limit: int,
+                      local: bool = None) -> Tuple[List[Peer], int]:
+        """
+        Peers added after `cursor` in order of change sequence
+
+        :param cursor: last change sequence seen by requester
+        :param limit: max count of peers
+        :param local: filter by `Peer.local`. None for all peers
+        :return: peers and cursor to request the next page with
+        """
+        with self._lock:
+            if len(self._seqs) > 2 * len(self._by_seq) + 64:
+                self._seqs = [seq for seq in self._seqs if seq in self._by_seq]
+            peers = []
+            pos = bisect.bisect_right(self._seqs, cursor)
+            while pos < len(self._seqs) and len(peers) < limit:
+                seq = self._seqs[pos]
+                pos += 1
+                addr = self._by_seq.get(seq)
+                if addr is None:
+                    continue
+                cursor = seq
+                _peer = self._peers[addr]
+                if local is None or bool(_peer.local) == local:
+                    peers.append(_peer)
+            if pos >= len(self._seqs):
+                cursor = max(cursor, self.seq)
+            return peers, cursor
+
+    def get_cursor(self, addr: str) -> Dict[str, int]:
+        """
+        Position of this node in peer's change sequences
+        """
+        _peer = self.get(addr)
+        if not _peer:
+            return {'peers': 0, 'users': 0}
+        return {'peers': _peer.peers_cursor or 0, 'users': _peer.users_cursor or 0}
+
+    def set_cursor(self, addr: str, cursor: Dict[str, int]):
+        with self._lock:
+            _peer = self._peers.get(addr)
+            if not _peer:
+                return
+            _peer.peers_cursor = cursor.get('peers', 0)
+            _peer.users_cursor = cursor.get('users', 0)
+            self._dirty.add(addr)
+
+    def __contains__(self, addr: str):
+        return addr in self._peers
+
+    def __iter__(self) -> Iterator[Peer]:
+        return iter(self.all())
+
+    def __len__(self):
+        return len(self._peers)
+
+    def load(self):
+        """
+        Load peers stored in DB
+        """
+        ses = db_worker.get_session()
+        try:
+            rows = ses.query(Peer._addr, Peer.seq, Peer.peers_cursor,
+                             Peer.users_cursor).order_by(Peer.seq).all()
+        except sqlalchemy.exc.OperationalError:
+            log.debug('Peers table does not exist yet')
+            return
+        finally:
+            db_worker.close_session(ses)
+        with self._lock:
+            for addr, seq, peers_cursor, users_cursor in rows:
+                if addr not in self._peers:
+                    self._insert(Peer(self.proto, addr=addr, seq=seq,
+                                      peers_cursor=peers_cursor,
+                                      users_cursor=users_cursor))
+                    self.seq = max(self.seq, seq or 0)
+            self._seqs.sort()
+        log.info(f'{len(rows)} peers loaded from DB')
+
+    def start(self):
+        self.load()
+        self._flusher.start(self.flush_interval, now=False)
+
+    def stop(self):
+        if self._flusher.running:
+            self._flusher.stop()
+        try:
+            self._write(*self._take_changes())
+        except sqlalchemy.exc.SQLAlchemyError:
+            log.exception('Cannot save peers on stop')
+
+    def _take_changes(self):
+        with self._lock:
+            saved = [self._row(self._peers[addr]) for addr in self._dirty]
+            removed = list(self._removed)
+            self._dirty.clear()
+            self._removed.clear()
+        return saved, removed
+
+    @staticmethod
+    def _row(_peer: Peer) -> dict:
+        return {
+            '_addr': _peer.addr,
+            'local': bool(_peer.local),
+            'seq': _peer.seq,
+            'peers_cursor': _peer.peers_cursor or 0,
+            'users_cursor': _peer.users_cursor or 0
+        }
+
+    def flush(self):
+        """
+        Write changed peers to DB in background thread
+        """
+        if self._flushing or not (self._dirty or self._removed):
+            return
+        saved, removed = self._take_changes()
+        self._flushing = threads.deferToThread(self._write, saved, removed)
+        self._flushing.addErrback(self._flush_failed, saved, removed)
+        self._flushing.addBoth(self._flush_done)
+
+    def _flush_done(self, _):
+        self._flushing = None
+
+    def _flush_failed(self, failure, saved, removed):
+        log.warning(f'Cannot save peers: {failure.getErrorMessage()}')
+        with self._lock:
+            for row in saved:
+                if row['_addr'] in self._peers:
+                    self._dirty.add(row['_addr'])
+            self._removed.update(addr for addr in removed if addr not in self._peers)
+
+    def _write(self, saved, removed):
+        if not (saved or removed):
+            return
+        table = Peer.__table__
+        ses = db_worker.get_session()
+        try:
+            for i in range(0, len(saved), self.batch_size):
+                ses.execute(table.insert().prefix_with('OR REPLACE'),
+                            saved[i:i + self.batch_size])
+            for i in range(0, len(removed), self.batch_size):
+                ses.execute(table.delete().where(
+                    table.c._addr.in_(removed[i:i + self.batch_size])
+                ))
+            ses.commit()
+            log.debug(f'{len(saved)} peers saved, {len(removed)} removed')
+        finally:
+            db_worker.close_session(ses)
@@ -0,0 +1,191 @@
+"""
+Profiling of handlers.
+
+When profiling is enabled, `Server.handle` wraps every handler with
+`HandlerProfiler.wrap`. For every handler it counts calls and wall and CPU
+time, and remembers `top` slowest invocations with name and size of message.
+
+CPU time is time of the thread, which started the handler. It is counted
+only if handler finishes in the same thread, so time of handlers, which
+await replies, is their wall time only.
+
+`HandlerProfiler.profile` switches on cProfile for one handler at runtime.
+Its statistics are merged from all invocations and are included in
+`HandlerProfiler.summary`, which server writes to log on shutdown. Profile of
+inline handler, which awaits, includes code run by reactor meanwhile.
+
+Handlers of process executors are not wrapped, they must stay picklable.
+"""
+
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from hodl_net.models import Message
+
+import threading
+import cProfile
+import logging
+import pstats
+import heapq
+import json
+import time
+import io
+
+log = logging.getLogger(__name__)
+
+
+class HandlerStats:
+    __slots__ = ('calls', 'failed', 'wall', 'cpu', 'max_wall')
+
+    def __init__(self):
+        self.calls = 0
+        self.failed = 0
+        self.wall = 0.
+        self.cpu = 0.
+        self.max_wall = 0.
+
+    def dump(self) -> dict:
+        return {
+            'calls': self.calls,
+            'failed': self.failed,
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'max_wall': self.max_wall,
+            'avg_wall': self.wall / self.calls if self.calls else 0.
+        }
+
+
+def message_size(message: Message) -> int:
+    try:
+        return len(json.dumps(message.data))
+    except (TypeError, ValueError):
+        return -1
+
+
+class HandlerProfiler:
+    """
+    :param int top: Count of the slowest invocations to remember
+    :param float slow_threshold: Invocations longer than this are logged, seconds. 0 to disable
+    :param int profile_lines: Count of functions from cProfile statistics in summary
+    """
+
+    def __init__(self, top: int = 20, slow_threshold: float = 0, profile_lines: int = 20):
+        self.top = top
+        self.slow_threshold = slow_threshold
+        self.profile_lines = profile_lines
+
+        self._handlers: Dict[str, HandlerStats] = {}
+        self._slowest: List[Tuple[float, int, str, str, int]] = []  # Min-heap by wall time
+        self._counter = 0
+        self._profiled: Set[str] = set()
+        self._profiles: Dict[str, pstats.Stats] = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, func: Callable, name: str = None) -> Callable:
+        """
+        Handler coroutine, which records its timing
+
+        :param name: Name of handler in statistics. Qualified name of `func` by default
+        """
+        name = name or func.__qualname__
+
+        async def profiled(message: Message):
+            profile = self._start_profile(name)
+            thread = threading.get_ident()
+            started, cpu_started = time.perf_counter(), time.thread_time()
+            failed = True
+            try:
+                result = await func(message)
+                failed = False
+                return result
+            finally:
+                wall = time.perf_counter() - started
+                cpu = time.thread_time() - cpu_started if threading.get_ident() == thread else 0.
+                if profile:
+                    profile.disable()
+                self._record(name, message, wall, cpu, failed, profile)
+
+        profiled.__name__ = func.__name__
+        profiled.__qualname__ = func.__qualname__
+        return profiled
+
+    def profile(self, name: str, enabled: bool = True):
+        """
+        Switch on or off cProfile for handler. Collected statistics are kept
+        """
+        if enabled:
+            self._profiled.add(name)
+        else:
+            self._profiled.discard(name)
+
+    def _start_profile(self, name: str) -> Optional[cProfile.Profile]:
+        if name not in self._profiled:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Other profiler is active in this thread
+            return None
+        return profile
+
+    def _record(self, name: str, message: Message, wall: float, cpu: float, failed: bool,
+                profile: Optional[cProfile.Profile]):
+        size = message_size(message)
+        with self._lock:
+            stats = self._handlers.get(name)
+            if not stats:
+                stats = self._handlers[name] = HandlerStats()
+            stats.calls += 1
+            stats.failed += failed
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.max_wall = max(stats.max_wall, wall)
+
+            self._counter += 1
+            entry = (wall, self._counter, name, message.name, size)
+            if len(self._slowest) < self.top:
+                heapq.heappush(self._slowest, entry)
+            elif wall > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+            if profile:
+                if name in self._profiles:
+                    self._profiles[name].add(profile)
+                else:
+                    self._profiles[name] = pstats.Stats(profile)
+        if self.slow_threshold and wall >= self.slow_threshold:
+            log.warning(f'Slow handler {name}: {wall:.3f}s wall, {cpu:.3f}s CPU, '
+                        f'message {message.name} of {size} bytes')
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: stats.dump() for name, stats in self._handlers.items()}
+
+    def slowest(self) -> List[dict]:
+        """
+        The slowest invocations, the slowest first
+        """
+        with self._lock:
+            entries = sorted(self._slowest, reverse=True)
+        return [{'handler': name, 'message': message_name, 'size': size, 'wall': wall}
+                for wall, _, name, message_name, size in entries]
+
+    def summary(self) -> str:
+        lines = ['Handlers by total wall time:',
+                 f'{"handler":<40} {"calls":>8} {"failed":>6} {"wall, s":>10} '
+                 f'{"cpu, s":>10} {"avg, ms":>10} {"max, ms":>10}']
+        for name, stats in sorted(self.stats().items(), key=lambda item: -item[1]['wall']):
+            lines.append(f'{name:<40} {stats["calls"]:>8} {stats["failed"]:>6} '
+                         f'{stats["wall"]:>10.3f} {stats["cpu"]:>10.3f} '
+                         f'{stats["avg_wall"] * 1000:>10.2f} {stats["max_wall"] * 1000:>10.2f}')
+        lines.append(f'{len(self._slowest)} slowest invocations:')
+        for entry in self.slowest():
+            lines.append(f'{entry["wall"] * 1000:>10.2f} ms  {entry["handler"]} '
+                         f'({entry["message"]}, {entry["size"]} bytes)')
+        with self._lock:
+            for name, collected in self._profiles.items():
+                out = io.StringIO()
+                collected.stream = out
+                collected.sort_stats('cumulative').print_stats(self.profile_lines)
+                lines.append(f'cProfile of {name}:')
+                lines.append(out.getvalue())
+        return '\n'.join(lines)
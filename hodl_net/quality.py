@@ -0,0 +1,164 @@
+"""
+Peer quality and selection of peers for `PeerProtocol.random_send`.
+
+`PeerQuality` keeps exponentially weighted moving averages of round-trip time
+and loss of every peer. Samples come from `CallbackRegistry`: answered request
+gives round-trip time, timed out one gives loss. Expected cost of sending to
+peer is `rtt / (1 - loss)`, peers without samples get `default_rtt`, so new
+peers are tried too.
+
+Selection modes:
+
+* `RandomSelection` - uniformly random peer, quality is ignored.
+* `PowerOfTwoSelection` - the cheaper of two random peers. Every peer may be
+  chosen, except the worst one, so the choice stays hard to predict.
+* `WeightedSelection` - one of `candidates` random peers, with probability
+  inversely proportional to its cost, or uniformly random one with
+  probability `exploration`.
+"""
+
+from typing import Dict, Optional
+
+from hodl_net.models import Peer
+
+import random
+
+
+class PeerStats:
+    __slots__ = ('rtt', 'loss', 'samples')
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.loss = 0.
+        self.samples = 0
+
+
+class PeerQuality:
+    """
+    :param float alpha: Weight of new sample in averages
+    :param float default_rtt: Assumed round-trip time of peers without samples, seconds
+    :param float max_loss: Loss used in cost is cut to this, so dead peers have finite cost
+    :param int max_peers: Max count of tracked peers, the oldest ones are forgotten
+    """
+
+    def __init__(self, alpha: float = 0.2, default_rtt: float = 0.5,
+                 max_loss: float = 0.95, max_peers: int = 10000):
+        self.alpha = alpha
+        self.default_rtt = default_rtt
+        self.max_loss = max_loss
+        self.max_peers = max_peers
+
+        self._peers: Dict[str, PeerStats] = {}
+
+    def _stats(self, addr: str) -> PeerStats:
+        stats = self._peers.get(addr)
+        if not stats:
+            if len(self._peers) >= self.max_peers:
+                del self._peers[next(iter(self._peers))]
+            stats = self._peers[addr] = PeerStats(self.default_rtt)
+        return stats
+
+    def success(self, addr: str, rtt: float):
+        """
+        Peer answered request in `rtt` seconds
+        """
+        stats = self._stats(addr)
+        stats.rtt = rtt if not stats.samples else stats.rtt + self.alpha * (rtt - stats.rtt)
+        stats.loss -= self.alpha * stats.loss
+        stats.samples += 1
+
+    def failure(self, addr: str):
+        """
+        Peer didn't answer request
+        """
+        stats = self._stats(addr)
+        stats.loss += self.alpha * (1 - stats.loss)
+        stats.samples += 1
+
+    def get(self, addr: str) -> Optional[PeerStats]:
+        return self._peers.get(addr)
+
+    def cost(self, addr: str) -> float:
+        """
+        Expected seconds to deliver request to peer
+        """
+        stats = self._peers.get(addr)
+        if not stats:
+            return self.default_rtt
+        return stats.rtt / (1 - min(stats.loss, self.max_loss))
+
+    def forget(self, addr: str):
+        self._peers.pop(addr, None)
+
+    def stats(self) -> Dict[str, dict]:
+        return {addr: {'rtt': stats.rtt, 'loss': stats.loss, 'samples': stats.samples}
+                for addr, stats in self._peers.items()}
+
+
+class Selection:
+    """
+    Base selection mode
+
+    :param proto: `PeerProtocol` of node
+    :param quality: `PeerQuality` of peers
+    """
+
+    name = None
+
+    def __init__(self, proto, quality: PeerQuality):
+        self.proto = proto
+        self.quality = quality
+
+    def select(self) -> Optional[Peer]:
+        """
+        Peer to send message to. None, if there are no peers
+        """
+        raise NotImplementedError
+
+
+class RandomSelection(Selection):
+    name = 'random'
+
+    def select(self) -> Optional[Peer]:
+        return self.proto.peer_table.random()
+
+
+class PowerOfTwoSelection(Selection):
+    name = 'power_of_two'
+
+    def select(self) -> Optional[Peer]:
+        candidates = self.proto.peer_table.sample(2)
+        if not candidates:
+            return None
+        return min(candidates, key=lambda _peer: self.quality.cost(_peer.addr))
+
+
+class WeightedSelection(Selection):
+    """
+    :param int candidates: Count of random peers to choose from
+    :param float exploration: Probability to ignore quality
+    """
+
+    name = 'weighted'
+
+    def __init__(self, proto, quality: PeerQuality, candidates: int = 8,
+                 exploration: float = 0.1):
+        super().__init__(proto, quality)
+        self.candidates = candidates
+        self.exploration = exploration
+
+    def select(self) -> Optional[Peer]:
+        candidates = self.proto.peer_table.sample(self.candidates)
+        if not candidates:
+            return None
+        if random.random() < self.exploration:
+            return random.choice(candidates)
+        weights = [1 / max(self.quality.cost(_peer.addr), 1e-6) for _peer in candidates]
+        return random.choices(candidates, weights)[0]
+
+
+modes = {
+    RandomSelection.name: RandomSelection,
+    PowerOfTwoSelection.name: PowerOfTwoSelection,
+    WeightedSelection.name: WeightedSelection
+}
@@ -1,24 +1,36 @@
 from twisted.internet.protocol import DatagramProtocol
 from twisted.internet import reactor, defer
 from collections import defaultdict
-from typing import Callable, List
+from typing import Callable, Dict, List
 from hodl_net.models import (
-    TempDict, Peer, User, Message, MessageWrapper, S
+    SeenFilter, Peer, User, Message, MessageWrapper, S
 )
-from hodl_net.errors import UnhandledRequest
-from hodl_net.database import db_worker
-from hodl_net.cryptogr import gen_keys
+from hodl_net.errors import UnhandledRequest, CryptogrError
+from hodl_net.database import db_worker, migrate
+from hodl_net.peer_table import PeerTable
+from hodl_net.sessions import SessionStore
+from hodl_net.callbacks import CallbackRegistry
+from hodl_net.batching import OutboundBatcher, is_batch, unpack_batch
+from hodl_net.fragments import Fragmenter, Reassembler, is_fragment, is_nack
+from hodl_net.executors import Executor, InlineExecutor, ProcessExecutor
+from hodl_net.profiling import HandlerProfiler
+from hodl_net.workers import WorkerChannel, listen_reuseport, run_workers
+from hodl_net.tunnels import TunnelTable, is_tunnel_frame
+from hodl_net.quality import PeerQuality, Selection
+from hodl_net.pacing import Pacer, PRIORITY_HIGH, PRIORITY_LOW
+from hodl_net import gossip, executors, quality, metrics
+from hodl_net.cryptogr import gen_keys, key_cache, verify_cache, CryptoPool
 from hodl_net.globals import *
 from hodl_net.discovery import LPD, PublicPeerExchange
 from hodl_net.utils import NatWorker
+from hodl_net.utils.localchecker import classifier as local_networks
 from hodl_net.config_loader import load_conf
 
-import sqlalchemy.exc
-
+import threading
 import logging
 import random
 import json
-import uuid
+import time
 
 log = logging.getLogger(__name__)
 
@@ -26,13 +38,9 @@ peer: Peer
 user: User
 
 conf_file = load_conf()  # TODO: Remove hard-coded configuration loading
-
-
-def to_thread(f):
-    def wrapper(*args, **kwargs):
-        return reactor.callInThread(f, *args, **kwargs)
-
-    return wrapper
+key_cache.max_size = conf_file['crypto']['key_cache_size']
+verify_cache.max_size = conf_file['crypto']['verify_cache_size']
+local_networks.refresh_interval = conf_file['main']['local_networks_refresh']
 
 
 def call_from_thread(f, *args, **kwargs):
@@ -49,10 +57,73 @@ class PeerProtocol(DatagramProtocol):
     def __init__(self, _server: 'Server', r: reactor):
         self.reactor = r
         self.server = _server
-
-        self.temp = TempDict(factory=None)
-        self.tunnels = TempDict(factory=None)
+        # Timers and transport may be used only in thread of reactor
+        self._reactor_thread = threading.get_ident()
+
+        self.seen = SeenFilter(conf_file['dedup']['max_ids'], conf_file['dedup']['expire'])
+        self.tunnels = None
+        if conf_file['tunnels']['enabled']:
+            self.tunnels = TunnelTable(self, **{key: value for key, value in
+                                                conf_file['tunnels'].items() if key != 'enabled'})
+        self.peer_table = PeerTable(self)
+        conf = conf_file['selection']
+        self.quality = PeerQuality(conf['alpha'], conf['default_rtt'],
+                                   conf['max_loss'], conf['max_peers'])
+        self.selection: Selection = quality.modes[conf['mode']](
+            self, self.quality, **conf.get(conf['mode'], {}))
+        self.propagation: gossip.Propagation = gossip.Flood(self)
+        self.pacer = None
+        if conf_file['pacing']['enabled']:
+            self.pacer = Pacer(r, self._transmit_now, **{key: value for key, value in
+                                                         conf_file['pacing'].items()
+                                                         if key != 'enabled'})
+        self.batcher = None
+        if conf_file['batching']['enabled']:
+            self.batcher = OutboundBatcher(r, self._write,
+                                           conf_file['batching']['window'],
+                                           conf_file['batching']['mtu'])
+        self.fragmenter, self.reassembler = None, None
+        if conf_file['fragmentation']['enabled']:
+            conf = conf_file['fragmentation']
+            self.fragmenter = Fragmenter(self._write, conf['mtu'], conf['retention'])
+            self.reassembler = Reassembler(r, self._handle, self._write, conf['timeout'],
+                                           conf['nack_delay'], conf['max_nacks'],
+                                           conf['max_messages'], conf['max_bytes'],
+                                           conf['mtu'])
         self.public_key, self.private_key = None, None
+        self.cipher = conf_file['crypto']['cipher']
+        self.encoding = conf_file['main']['encoding']
+        self.share_page_size = conf_file['share']['page_size']
+        self.share_max_page_size = conf_file['share']['max_page_size']
+        self.workers: WorkerChannel = None
+        self.crypto_pool = None
+        if conf_file['crypto']['pool_workers']:
+            workers = conf_file['crypto']['pool_workers']
+            self.crypto_pool = CryptoPool(r, workers if workers > 0 else None,
+                                          conf_file['crypto']['pool_batch_size'])
+        self.sessions = None
+        if conf_file['sessions']['enabled']:
+            self.sessions = SessionStore(conf_file['sessions']['ttl'],
+                                         conf_file['sessions']['rekey_after'],
+                                         conf_file['sessions']['max_messages'])
+
+        registry = metrics.registry
+        self._datagrams_in = registry.counter('datagrams_in')
+        self._bytes_in = registry.counter('bytes_in')
+        self._datagrams_out = registry.counter('datagrams_out')
+        self._bytes_out = registry.counter('bytes_out')
+        self._stages = {stage: registry.histogram('stage_seconds', stage=stage)
+                        for stage in ('decode', 'propagate', 'lookup', 'decrypt', 'dispatch')}
+        registry.gauge('peers').set_function(lambda: len(self.peer_table))
+        if self.pacer:
+            registry.gauge('pacer_queued').set_function(lambda: self.pacer.stats()['queued'])
+        if self.crypto_pool:
+            registry.gauge('crypto_pool_queued').set_function(
+                lambda: self.crypto_pool.stats()['queued'])
+
+    @staticmethod
+    def _drop(reason: str):
+        metrics.registry.counter('dropped', reason=reason).inc()
 
     def prepare_keys(self):
         try:
@@ -60,6 +131,8 @@ class PeerProtocol(DatagramProtocol):
                 self.public_key, self.private_key = json.loads(f.read())
         except FileNotFoundError:
             self._gen_keys()
+        key_cache.pin(self.private_key)
+        key_cache.pin(self.public_key)
 
     def _gen_keys(self):
         self.private_key, self.public_key = gen_keys()
@@ -67,111 +140,317 @@ class PeerProtocol(DatagramProtocol):
             log.info(f'keys generated {self.name}')
             f.write(json.dumps([self.public_key, self.private_key]))
 
+    def startProtocol(self):
+        self._reactor_thread = threading.get_ident()
+        if self.tunnels:
+            self.tunnels.start(self.reactor)
+        if self.fragmenter:
+            self.fragmenter.start(self.reactor)
+            self.reassembler.start(self.reactor)
+
+    def stopProtocol(self):
+        if self.pacer:
+            self.pacer.stop()
+        if self.tunnels:
+            self.tunnels.stop()
+        if self.crypto_pool:
+            self.crypto_pool.stop()
+        if self.batcher:
+            self.batcher.flush_all()
+        if self.fragmenter:
+            self.fragmenter.stop()
+            self.reassembler.stop()
+
     def copy(self) -> 'PeerProtocol':
         return self
 
     # noinspection PyUnresolvedReferences,PyDunderSlots
     def datagramReceived(self, datagram: bytes, addr: tuple):
+        self._datagrams_in.inc()
+        self._bytes_in.inc(len(datagram))
+        if self.pacer and not self.pacer.allow(addr, len(datagram)):
+            return self._drop('rate')
         try:
-            return self.handle_datagram(datagram, addr)
+            if is_fragment(datagram):
+                if self.reassembler:
+                    self.reassembler.on_fragment(datagram, addr)
+                return
+            if is_nack(datagram):
+                if self.fragmenter:
+                    self.fragmenter.on_nack(datagram, addr)
+                return
+            if is_batch(datagram):
+                for _datagram in unpack_batch(datagram):
+                    self._handle(_datagram, addr)
+                return
+        except ValueError:
+            self._drop('bad_frame')
+            return log.warning(f'Bad frame from {addr}')
+        self._handle(datagram, addr)
+
+    def _handle(self, datagram: bytes, addr: tuple):
+        try:
+            self.handle_datagram(datagram, addr)
         except Exception as _:
             log.exception('Exception during handling message.')
 
-    def handle_datagram(self, datagram: bytes, addr: tuple):
-        ses = db_worker.get_session()
-        addr = ':'.join(map(str, addr))
+    def handle_datagram(self, datagram: bytes, addr: tuple, forwarded: bool = False):
+        """
+        :param bool forwarded: datagram was passed by other worker, it is counted
+            and propagated already
+        """
+        str_addr = ':'.join(map(str, addr))
+        tunnelled = is_tunnel_frame(datagram)
+        if tunnelled:
+            if not self.tunnels:
+                return
+            datagram = self.tunnels.on_frame(datagram, str_addr)
+            if not datagram:
+                return  # Forwarded to the next hop
+        addr = str_addr
         log.debug(f'Datagram received {datagram}')
+        started = time.perf_counter()
         wrapper = MessageWrapper.from_bytes(datagram)
+        self._stages['decode'].observe(time.perf_counter() - started)
 
-        if wrapper.type != 'request':
+        if wrapper.type != 'request' and not forwarded:
             if wrapper.tunnel_id:
-                if random.randint(0, 3) != random.randint(0, 3):  # TODO: safe random func
-                    return self.forward(wrapper)
-                wrapper.type = 'message'
+                # Random walk of nodes without tunnel table, it goes on with probability 3/4
+                if not tunnelled and random.random() < 0.75:
+                    return self.random_send(wrapper)
                 wrapper.tunnel_id = None
 
-            if wrapper.id in self.temp:
-                return
-            else:
-                self.temp[wrapper.id] = wrapper
-                self._send_all(wrapper)
+            if not self.seen.add(wrapper.id):
+                return self._drop('duplicate')
+            if self.workers:
+                self.workers.publish_seen(wrapper.id)
+            started = time.perf_counter()
+            self.propagation.propagate(wrapper, addr)
+            self._stages['propagate'].observe(time.perf_counter() - started)
+
+        if self.workers and wrapper.cipher == 'session' and self.sessions is not None \
+                and not self.sessions.get(wrapper.session_id):
+            if not forwarded:  # Session may belong to other worker
+                self.workers.forward_datagram(datagram, addr)
+            return
 
         # Decryption message, preparing to process
 
-        _peer = ses.query(Peer).filter_by(addr=addr).first()
+        started = time.perf_counter()
+        _peer = self.peer_table.get(addr)
         if not _peer:
             _peer = Peer(self, addr=addr)
-            ses.add(_peer)
-            try:
-                ses.commit()
+            if self.peer_table.add(_peer):
                 log.debug(f'New peer {addr}')
-                _peer.request(Message('share'))
-            except sqlalchemy.exc.IntegrityError:
-                log.warning(f"Cannot add peer {addr}, because it is already exists")
-        _peer.proto = self
+        if not _peer.synced:
+            self.sync(_peer)
 
         _user = None
         if wrapper.sender:
-            _user = ses.query(User).filter_by(name=wrapper.sender).first()
-            if not local.user:
-                return db_worker.close_session(ses)
+            if wrapper.type != 'request' and not wrapper.sign:
+                return self._drop('unsigned')
+            _user = self.get_user(wrapper.sender)
+            if not _user:
+                return self._drop('unknown_user')
+            self._stages['lookup'].observe(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            if self.crypto_pool and wrapper.cipher in MessageWrapper.ciphers:
+                d = defer.ensureDeferred(wrapper.open_async(
+                    self.crypto_pool, self.private_key, _user.public_key, self.sessions))
+                d.addCallbacks(self._opened, self._not_opened, (wrapper, _peer, _user, started))
+                d.addErrback(lambda failure: log.error(
+                    f'Exception during handling message: {failure.getTraceback()}'))
+                return
 
             try:
-                wrapper.decrypt(self.private)
-            except ValueError:
-                return db_worker.close_session(ses)
-
-        callbacks = self.server._callbacks[wrapper.message.callback]
-        if callbacks:
-            for i in range(len(callbacks)):
-                call = callbacks.pop()
-                if call:
-                    call.callback(wrapper.message)
-            return db_worker.close_session(ses)
-        session.commit()
-        session.close()
-        for func in self.server._handlers[wrapper.type][wrapper.message.name]:
-            if func:
-                func(wrapper.message, _peer, _user)
-        if not self.server._handlers[wrapper.type][wrapper.message.name]:
-            raise UnhandledRequest
+                wrapper.decrypt(self.private_key, self.sessions)
+                wrapper.verify(_user.public_key)
+            except (ValueError, CryptogrError):
+                return self._drop('decrypt')
+            self._stages['decrypt'].observe(time.perf_counter() - started)
+        else:
+            self._stages['lookup'].observe(time.perf_counter() - started)
+
+        self.dispatch(wrapper, _peer, _user)
+
+    def _opened(self, _, wrapper: MessageWrapper, _peer: Peer, _user: User, started: float):
+        self._stages['decrypt'].observe(time.perf_counter() - started)  # Includes wait in pool
+        self.dispatch(wrapper, _peer, _user)
+
+    def _not_opened(self, failure):
+        failure.trap(ValueError, CryptogrError)
+        self._drop('decrypt')
+
+    def dispatch(self, wrapper: MessageWrapper, _peer: Peer, _user: User = None,
+                 forwarded: bool = False):
+        """
+        Pass decrypted message to waiting request or to handlers
+        """
+        started = time.perf_counter()
+        try:
+            if self.server._callbacks.resolve(wrapper.message.callback, wrapper.message):
+                return
+            owner = self.workers.owner(wrapper.message.callback) \
+                if self.workers and not forwarded else None
+            if owner is not None:  # Reply to request of other worker
+                return self.workers.forward_message(owner, wrapper, _peer, _user)
+            for func in self.server._handlers[wrapper.type][wrapper.message.name]:
+                if func:
+                    func(wrapper.message, _peer, _user)
+            if not self.server._handlers[wrapper.type][wrapper.message.name]:
+                self._drop('unhandled')
+                raise UnhandledRequest
+        finally:
+            self._stages['dispatch'].observe(time.perf_counter() - started)
 
     def forward(self, wrapper: MessageWrapper):
-        return self.random_send(wrapper)  # TODO: Check exists tunnels
+        """
+        Send wrapper through own tunnel, or to random peer if there is no ready tunnel
+        """
+        if self.tunnels:
+            wrapper.encoding = self.encoding
+            if self.tunnels.send(wrapper.to_bytes()):
+                return
+        return self.random_send(wrapper)
 
-    def _send(self, wrapper: MessageWrapper, addr):
+    def _send(self, wrapper: MessageWrapper, addr, expect_reply: bool = False,
+              timeout: float = None):
         """
         Low level send.
 
         :param MessageWrapper wrapper: wrapper to send
         :param addr: address
         :type addr: tuple or str
+        :param bool expect_reply: register callback for response.
+            `wrapper.message` must be not encrypted
+        :param timeout: seconds to wait for response
+        :return: Deferred, which fires with response, if `expect_reply` is True
 
         """
         if not wrapper:
             return
         if isinstance(addr, str):
-            addr: list = addr.split(':')
-            addr[1] = int(addr[1])
-            addr = tuple(addr)
-        self.transport.write(wrapper.to_json().encode('utf-8'), addr)
+            addr = self._parse_addr(addr)
+        d = None
+        if expect_reply:
+            d = self._expect(wrapper.message, timeout, ':'.join(map(str, addr)))
+        wrapper.encoding = self.encoding
+        self._transmit(wrapper.to_bytes(), addr,
+                       PRIORITY_HIGH if wrapper.type == 'request' else PRIORITY_LOW)
+        return d
+
+    def _expect(self, message: Message, timeout: float = None, addr: str = None):
+        """
+        Register callback for response to `message`. Handler threads register
+        it through reactor, before the request is transmitted
+        """
+        if self.workers:  # Reply may come to other worker
+            message.callback = self.workers.tag_callback(message.callback)
+        if self._in_reactor_thread():
+            return self.server._callbacks.add(message.callback, timeout, addr)
         d = defer.Deferred()
-        self.server._callbacks[wrapper.message.callback].append(d)
+        self.reactor.callFromThread(lambda: self.server._callbacks.add(
+            message.callback, timeout, addr).chainDeferred(d))
         return d
 
-    def send(self, message: Message, name: str):
+    def _in_reactor_thread(self) -> bool:
+        return threading.get_ident() == self._reactor_thread
+
+    def _transmit(self, data: bytes, addr, priority: int = PRIORITY_HIGH):
         """
-        High level send
+        Write encoded datagram, when budget of peer allows it. Datagrams of
+        handler threads are passed to reactor
+        """
+        if not self._in_reactor_thread():
+            return self.reactor.callFromThread(self._transmit, data, addr, priority)
+        if isinstance(addr, str):
+            addr = self._parse_addr(addr)
+        if self.pacer:
+            return self.pacer.send(data, addr, priority)
+        self._transmit_now(data, addr)
+
+    def _transmit_now(self, data: bytes, addr: tuple):
+        """
+        Write encoded datagram, in fragments or batch if they are enabled
+        """
+        if self.fragmenter and self.fragmenter.send(data, addr):
+            return
+        if self.batcher:
+            self.batcher.send(data, addr)
+        else:
+            self._write(data, addr)
+
+    @staticmethod
+    def _parse_addr(addr: str) -> tuple:
+        host, port = addr.rsplit(':', 1)
+        return host, int(port)
+
+    def _write(self, data: bytes, addr: tuple):
+        self._datagrams_out.inc()
+        self._bytes_out.inc(len(data))
+        self.transport.write(data, addr)
+
+    def send(self, message: Message, name: str, timeout: float = None,
+             expect_reply: bool = True):
+        """
+        High level send.
+
+        Message is encrypted with key of session with addressee, if there is one.
+        Otherwise RSA is used and new session is negotiated.
+
+        :return: Deferred, which fires with response, if `expect_reply` is True
         """
-        addressee: User = self.session.query(User).filter_by(name=name).first()
         wrapper = MessageWrapper(
             message,
             type='message',
             sender=self.name,
-            tunnel_id=str(uuid.uuid4()),  # TODO: check exists tunnels
+            cipher=self.cipher
         )
-        wrapper.prepare(self.private_key, addressee.public_key)
-        return self.random_send(wrapper)
+        d = None
+        if expect_reply:
+            d = self._expect(message, timeout)
+
+        session = self.sessions.for_user(name) if self.sessions is not None else None
+        if session:
+            wrapper.prepare(session=session)
+            self.forward(wrapper)
+            return d
+
+        addressee = self.get_user(name)
+        if self.crypto_pool:
+            prepared = defer.ensureDeferred(wrapper.prepare_async(
+                self.crypto_pool, self.private_key, addressee.public_key))
+            prepared.addCallbacks(lambda _: self.forward(wrapper), lambda failure: log.error(
+                f'Cannot prepare message to {name}: {failure.getErrorMessage()}'))
+        else:
+            wrapper.prepare(self.private_key, addressee.public_key)
+            self.forward(wrapper)
+        if self.sessions is not None:
+            self._start_session(name)
+        return d
+
+    def _start_session(self, name: str):
+        session = self.sessions.create(name)
+        if not session:
+            return
+        d = self.send(Message('session_init', session.dump()), name)
+        d.addCallbacks(session.confirm, lambda failure: log.debug(
+            f'Session with {name} is not confirmed: {failure.getErrorMessage()}'))
+
+    def get_user(self, name: str) -> User:
+        """
+        User from DB, detached from session
+
+        :rtype: User or None
+        """
+        ses = db_worker.get_session()
+        _user = ses.query(User).filter_by(name=name).first()
+        if _user:
+            ses.expunge(_user)
+            _user.proto = self
+        db_worker.close_session(ses)
+        return _user
 
     def shout(self, message: Message):
         """
@@ -180,36 +459,36 @@ class PeerProtocol(DatagramProtocol):
         wrapper = MessageWrapper(
             message,
             type='shout',
-            sender=self.name,
-            tunnel_id=str(uuid.uuid4())
+            sender=self.name
         )
-        return self.random_send(wrapper)  # TODO: await generator
+        wrapper.prepare(self.private_key)
+        return self.forward(wrapper)
 
     @property
-    @db_worker.with_session
     def peers(self) -> List[Peer]:
         """
-        All peers in DB
+        All known peers
         """
-        peers = []
-        for _peer in session.query(Peer).all():
-            _peer.proto = self
-            peers.append(_peer)
-        return peers  # TODO: generator mb
+        return self.peer_table.all()
 
-    def add_peer(self, _peer: Peer, method=None):
-        ses = db_worker.get_session()
-        ses.add(_peer)
+    def sync(self, _peer: Peer):
+        """
+        Pull peers and users added since the last sync with peer.
+        Next pages are requested by `share_info` handler
+        """
+        _peer.synced = True
+        _peer.request(Message('share', {
+            'since': self.peer_table.get_cursor(_peer.addr),
+            'limit': self.share_page_size
+        }), expect_reply=False)
 
-        try:
-            ses.commit()
-            if method:
-                log.info("Peer {} discovered by {}".format(_peer.addr, method))
-            else:
-                log.info("Peer {} discovered".format(_peer.addr))
-        except sqlalchemy.exc.IntegrityError:
-            pass
-        db_worker.close_session(ses)
+    def add_peer(self, _peer: Peer, method=None):
+        if not self.peer_table.add(_peer):
+            return
+        if method:
+            log.info("Peer {} discovered by {}".format(_peer.addr, method))
+        else:
+            log.info("Peer {} discovered".format(_peer.addr))
 
     def send_all(self, message: Message):
         """
@@ -219,7 +498,7 @@ class PeerProtocol(DatagramProtocol):
         :return:
         """
         for _peer in self.peers:
-            _peer.request(message)
+            _peer.request(message, expect_reply=False)
 
     def _send_all(self, wrapper: MessageWrapper):
         for _peer in self.peers:
@@ -227,11 +506,15 @@ class PeerProtocol(DatagramProtocol):
 
     def random_send(self, wrapper: MessageWrapper):
         """
-        Send MessageWrapper to random peer
+        Send MessageWrapper to random peer, chosen by `PeerProtocol.selection`
         :param wrapper: MessageWrapper Instance
         :return:
         """
-        return random.choice(self.peers).send(wrapper)
+        _peer = self.selection.select()
+        if not _peer:
+            log.warning('No peers to send message')
+            return
+        return _peer.send(wrapper)
 
 
 class Server:
@@ -239,7 +522,6 @@ class Server:
     Main Server Class
     """
     _handlers = defaultdict(lambda: defaultdict(lambda: []))
-    _callbacks = TempDict()
     _on_close_func = None
     _on_open_func = None
     ext_addr = (None, None)
@@ -249,13 +531,19 @@ class Server:
                  white: bool = True,
                  lpd_port: int = conf_file['lpd']['port'],
                  lpd_ip: str = conf_file['lpd']['multicast_ip'],
-                 lpd_interval: int = conf_file['lpd']['send_interval']):
+                 lpd_interval: int = conf_file['lpd']['send_interval'],
+                 propagation: str = conf_file['propagation']['mode'],
+                 r: reactor = None):
         """
 
         :param port: port to start server
         :param white: is ip white
+        :param propagation: propagation mode of shouts and messages: 'flood' or 'gossip'.
+            See `hodl_net.gossip`
+        :param r: reactor. Global reactor if None
         """
-        from twisted.internet import reactor
+        if r is None:
+            from twisted.internet import reactor as r
 
         self.port = port
         self.lpd_port = lpd_port
@@ -263,8 +551,23 @@ class Server:
         self.lpd_interval = lpd_interval
         self.white = white
 
-        self.reactor = reactor
-        self.udp = PeerProtocol(self, reactor)
+        self.reactor = r
+        self._callbacks = CallbackRegistry(r, conf_file['main']['request_timeout'])
+        self.profiler = None
+        if conf_file['profiling']['enabled']:
+            self.profiler = HandlerProfiler(conf_file['profiling']['top'],
+                                            conf_file['profiling']['slow_threshold'],
+                                            conf_file['profiling']['profile_lines'])
+        self.executors: Dict[str, Executor] = {}
+        self.add_executor(InlineExecutor('inline'))
+        for name, conf in conf_file['executors'].items():
+            self.add_executor(executors.create(name, r, conf))
+        metrics.registry.gauge('requests_pending').set_function(lambda: len(self._callbacks))
+        self.udp = PeerProtocol(self, r)
+        self._callbacks.on_complete = self.udp.quality.success
+        self._callbacks.on_timeout = self.udp.quality.failure
+        self.udp.propagation = gossip.modes[propagation](
+            self.udp, **conf_file['propagation'].get(propagation, {}))
 
         if conf_file['lpd']['enabled']:
 
@@ -276,7 +579,8 @@ class Server:
 
         self.prepared = False
 
-    def handle(self, event: S, _type: str = 'message', in_thread: bool = True) -> Callable:
+    def handle(self, event: S, _type: str = 'message', in_thread: bool = True,
+               executor: str = None) -> Callable:
         """
 
         @server.handle('echo')
@@ -288,29 +592,50 @@ class Server:
         async def echo_request(message):
             peer.request(Message('echo_response', message.data)
 
+        @server.handle('ping', 'request', executor='inline')
+        async def ping(message):
+            return Message('pong')
 
+        :param in_thread: run handler in 'default' executor, otherwise 'inline'
+        :param executor: name of executor from `Server.executors`.
+            See `hodl_net.executors`
         """
 
         if isinstance(event, str):
             event = [event]
+        executor = executor or ('default' if in_thread else 'inline')
 
         def decorator(func: Callable):
+            handler = func
+            if self.profiler and not isinstance(self.executors.get(executor), ProcessExecutor):
+                handler = self.profiler.wrap(func)
 
-            # noinspection PyUnresolvedReferences,PyDunderSlots
             def wrapper(message: Message, _peer: Peer = None, _user: User = None):
-                local.peer = _peer
-                local.user = _user
-                d = func(message)
-                return defer.ensureDeferred(d)
+                histogram = metrics.registry.histogram('handler_seconds', message=message.name)
+                started = time.perf_counter()
+                d = self.executors[executor].submit(handler, message, _peer, _user)
+                d.addBoth(self._observe_handler, histogram, started)
+                return d
 
-            if in_thread:
-                wrapper = to_thread(wrapper)
             for e in event:
                 self._handlers[_type][e].append(wrapper)
             return func
 
         return decorator
 
+    @staticmethod
+    def _observe_handler(result, histogram: metrics.Histogram, started: float):
+        histogram.observe(time.perf_counter() - started)  # Includes wait in executor queue
+        return result
+
+    def add_executor(self, executor: Executor):
+        self.executors[executor.name] = executor
+        metrics.registry.gauge('executor_queued', executor=executor.name).set_function(
+            lambda: executor.queued)
+
+    def executor_stats(self) -> Dict[str, dict]:
+        return {name: executor.stats() for name, executor in self.executors.items()}
+
     def prepare(self, port: int = None, name: str = None):
         """
         Server preparing function.
@@ -327,26 +652,56 @@ class Server:
         self.udp.prepare_keys()
 
         db_worker.create_connection(f'{self.udp.name}_db.sqlite')
+        migrate()  # DB of older version
+        self.reactor.callWhenRunning(self.udp.peer_table.start)
+        self.reactor.callWhenRunning(local_networks.start, self.reactor)
+        self.reactor.callWhenRunning(self.udp.propagation.start, self.reactor)
+        self.reactor.addSystemEventTrigger('before', 'shutdown', self.udp.peer_table.stop)
+        if self.profiler:
+            self.reactor.addSystemEventTrigger('before', 'shutdown', lambda: log.info(
+                f'Handler profile:\n{self.profiler.summary()}'))
+        for executor in self.executors.values():
+            self.reactor.callWhenRunning(executor.start)
+            self.reactor.addSystemEventTrigger('during', 'shutdown', executor.stop)
 
         logging.basicConfig(level=logging.DEBUG,
                             format=f'%(name)s.%(funcName)-20s [LINE:%(lineno)-3s]# [{self.port}]'
                             f' %(levelname)-8s [%(asctime)s]  %(message)s')
 # print(conf_file)
-        self.reactor.listenUDP(self.port, self.udp)
-
-        if conf_file['lpd']['enabled']:
+        primary = True
+        if self.udp.workers:
+            listen_reuseport(self.reactor, self.port, self.udp)
+            self.udp.peer_table.on_add = self.udp.workers.publish_peer
+            self.reactor.callWhenRunning(self.udp.workers.start, self.reactor)
+            self.reactor.addSystemEventTrigger('before', 'shutdown', self.udp.workers.stop)
+            primary = self.udp.workers.index == 0  # Discovery runs in one worker
+        else:
+            self.reactor.listenUDP(self.port, self.udp)
+
+        conf = conf_file['metrics']
+        if conf['port']:
+            port = conf['port'] + (self.udp.workers.index if self.udp.workers else 0)
+            metrics.listen(self.reactor, port, conf['interface'])
+        if conf['dump_interval']:
+            self.reactor.callWhenRunning(metrics.start_dump, self.reactor, conf['dump_interval'])
+
+        if conf_file['lpd']['enabled'] and primary:
             self.reactor.listenMulticast(self.lpd_port, self.lpd, listenMultiple=True)
 
         log.info(f'Core started at {self.port}')
 
-        if conf_file['upnp']['enabled']:
+        if conf_file['upnp']['enabled'] and primary:
             nat_worker = NatWorker()
 
             if nat_worker:
                 self.ext_addr = nat_worker.get_addrs()
 
-        if conf_file['ppx']['enabled']:
-            ppx = PublicPeerExchange(self, bootstrap_servers=conf_file['ppx']['nodes'])
+        if conf_file['ppx']['enabled'] and primary:
+            conf = conf_file['ppx']
+            self.ppx = PublicPeerExchange(self, conf['nodes'], self.reactor, conf['ttl'],
+                                          conf['retries'], conf['backoff'],
+                                          conf['max_backoff'], conf['timeout'])
+            self.reactor.callWhenRunning(self.ppx.start)
 
         log.info("Plugin loading finished.")
 
@@ -357,6 +712,19 @@ class Server:
             self.prepare(*args, **kwargs)
         self.reactor.run()
 
+    def run_workers(self, count: int = None, port: int = None, name: str = None):
+        """
+        Run node in `count` processes sharing one UDP port. See `hodl_net.workers`
+
+        :param count: count of processes. From config if None
+        """
+        count = count or conf_file['workers']['count']
+        port = port or self.port
+        name = name or self.udp.name
+        self.udp.name = name
+        self.udp.prepare_keys()  # Keys are generated once for all workers
+        run_workers(count, port, name)
+
     @property
     def name(self):
         return self.udp.name
@@ -0,0 +1,165 @@
+"""
+Symmetric session keys between users.
+
+The first message to a user goes through RSA as usual, together with a
+`session_init` message carrying a fresh secret. Once the addressee answers
+with `session_ack`, both sides derive the same encryption and MAC keys and
+further messages need only AES-GCM and HMAC.
+"""
+
+from Crypto.Protocol.KDF import HKDF
+from Crypto.Hash import SHA256
+from Crypto.Random import get_random_bytes
+from typing import Dict, Optional
+
+from hodl_net.cryptogr import aes_encrypt, aes_decrypt, AES_KEY_SIZE
+
+import threading
+import logging
+import base64
+import hashlib
+import hmac
+import time
+import uuid
+
+log = logging.getLogger(__name__)
+
+
+class Session:
+    """
+    Session with one correspondent
+
+    :param str user: Name of correspondent
+    :param bytes secret: Shared secret. Encryption and MAC keys are derived from it
+    :param str session_id: Session id, sent in every wrapper of the session
+    :param float ttl: Session lifetime in seconds
+    """
+
+    def __init__(self, user: str, secret: bytes, session_id: str = None, ttl: float = 3600):
+        self.user = user
+        self.secret = secret
+        self.id = session_id or uuid.uuid4().hex
+        self.created = time.time()
+        self.expires = self.created + ttl
+        self.messages = 0
+        self.confirmed = False
+        self.enc_key, self.mac_key = HKDF(secret, AES_KEY_SIZE, self.id.encode(),
+                                          SHA256, num_keys=2)
+
+    def expired(self, now: float = None) -> bool:
+        return (now or time.time()) >= self.expires
+
+    def confirm(self, *_):
+        self.confirmed = True
+
+    def encrypt(self, plaintext: str) -> str:
+        self.messages += 1
+        return base64.encodebytes(aes_encrypt(plaintext.encode(), self.enc_key)).decode()
+
+    def decrypt(self, text: str) -> str:
+        """
+        :raises ValueError: if ciphertext was modified
+        """
+        return aes_decrypt(base64.decodebytes(text.encode()), self.enc_key).decode()
+
+    def mac(self, data: str) -> str:
+        return hmac.new(self.mac_key, data.encode(), hashlib.sha256).hexdigest()
+
+    def check_mac(self, data: str, mac: str) -> bool:
+        return hmac.compare_digest(self.mac(data), mac)
+
+    def dump(self) -> dict:
+        return {
+            'id': self.id,
+            'secret': base64.encodebytes(self.secret).decode(),
+            'ttl': self.expires - time.time()
+        }
+
+
+class SessionStore:
+    """
+    Sessions by id and by correspondent
+
+    :param float ttl: Session lifetime in seconds
+    :param float rekey_after: Age after which new session is negotiated
+    :param int max_messages: Count of sent messages after which new session is negotiated
+    """
+
+    handshake_timeout = 30
+
+    def __init__(self, ttl: float = 3600, rekey_after: float = 600, max_messages: int = 10000):
+        self.ttl = ttl
+        self.rekey_after = rekey_after
+        self.max_messages = max_messages
+
+        self._by_id: Dict[str, Session] = {}
+        self._by_user: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """
+        Session by id, including not confirmed sessions
+        """
+        session = self._by_id.get(session_id)
+        if session and not session.expired():
+            return session
+
+    def for_user(self, user: str) -> Optional[Session]:
+        """
+        Session which may be used for sending to `user`.
+        None if there is no session or it should be rekeyed
+        """
+        session = self._by_user.get(user)
+        if not session or not session.confirmed:
+            return
+        now = time.time()
+        if session.expired(now) or now - session.created >= self.rekey_after or \
+                session.messages >= self.max_messages:
+            return
+        return session
+
+    def create(self, user: str) -> Optional[Session]:
+        """
+        New session for handshake with `user`.
+        None if handshake with `user` is already in progress
+        """
+        with self._lock:
+            current = self._by_user.get(user)
+            if current and not current.confirmed and \
+                    time.time() - current.created < self.handshake_timeout:
+                return
+            session = Session(user, get_random_bytes(AES_KEY_SIZE), ttl=self.ttl)
+            self._add(session)
+        log.debug(f'Session {session.id} with {user} created')
+        return session
+
+    def accept(self, user: str, data: dict) -> Session:
+        """
+        Session offered by `user` in `session_init` message
+        """
+        ttl = min(float(data.get('ttl', self.ttl)), self.ttl)
+        session = Session(user, base64.decodebytes(data['secret'].encode()), data['id'], ttl)
+        session.confirm()
+        with self._lock:
+            self._add(session)
+        log.debug(f'Session {session.id} with {user} accepted')
+        return session
+
+    def _add(self, session: Session):
+        self.purge()
+        self._by_id[session.id] = session
+        self._by_user[session.user] = session
+
+    def purge(self):
+        """
+        Remove expired sessions
+        """
+        now = time.time()
+        for session_id, session in list(self._by_id.items()):
+            if session.expired(now):
+                del self._by_id[session_id]
+                if self._by_user.get(session.user) is session:
+                    del self._by_user[session.user]
+
+    def __len__(self):
+        return len(self._by_id)
@@ -0,0 +1,467 @@
+"""
+Deterministic network simulator on virtual time.
+
+`Simulation` runs thousands of nodes from `hodl_net.loopback` in one process
+on `SimulatedClock`. Their datagrams pass through `LossyFabric`, which delays
+them by `latency` plus random `jitter` and loses them with probability
+`loss`. Virtual time jumps from one event to the next, so a minute of network
+life costs only the CPU time of handling its datagrams.
+
+Randomness of the simulator and of the net stack is seeded by `seed`, handlers
+of all executors run inline and dedup filters of nodes run on virtual time, so
+runs with the same seed and `PYTHONHASHSEED` are repeated exactly. Tunnels
+expire by wall time, so they are disabled. Sessions use wall time too, but
+scenarios don't send user messages, which start them.
+
+`Simulation` changes global state of the process: it reseeds global `random`
+and replaces executors of the global server by inline ones. Executors are
+restored by `Simulation.close`, global `random` is not.
+
+Scenarios:
+
+* `Simulation.discover` - nodes start with few unsynced peers of `topology`
+  and ping random known peer every `deadpeer.echo_interval`, as dead peer
+  detection does. Receiver of datagram from unsynced peer pulls its peers by
+  `share`. Converged, when every node knows `coverage` of other nodes.
+* `Simulation.shout` - nodes are linked by `topology` and one of them
+  shouts. Converged, when all other nodes handled the shout.
+
+Limitations: all nodes share one DB and one RSA key pair, so users are known
+to every node at once and `share` carries peers only. Tables of nodes are
+kept in memory, so full discovery of N nodes needs memory for N² peers.
+"""
+
+from twisted.internet.base import DelayedCall
+from twisted.internet.interfaces import IReactorTime
+from twisted.internet import task
+from zope.interface import implementer
+from typing import Callable, Dict, List, Set, Tuple
+
+from hodl_net.cryptogr import gen_keys
+from hodl_net.database import db_worker
+from hodl_net.executors import InlineExecutor
+from hodl_net.loopback import MemoryFabric, create_node
+from hodl_net.models import Message, Peer, SeenFilter, User
+
+import logging
+import random
+import heapq
+
+log = logging.getLogger(__name__)
+
+Addr = Tuple[str, int]
+
+
+@implementer(IReactorTime)
+class SimulatedClock:
+    """
+    Virtual time with scheduled calls in heap. Unlike
+    `twisted.internet.task.Clock`, scheduling doesn't sort all pending calls,
+    so it copes with millions of them
+    """
+
+    def __init__(self):
+        self.now = 0.
+        self.events = 0
+        self._calls: List[Tuple[float, int, DelayedCall]] = []
+        self._counter = 0
+        self._cancelled = 0
+
+    def seconds(self) -> float:
+        return self.now
+
+    def callLater(self, delay: float, func: Callable, *args, **kwargs) -> DelayedCall:
+        call = DelayedCall(self.now + max(delay, 0), func, args, kwargs,
+                           self._cancel, self._push, self.seconds)
+        self._push(call)
+        return call
+
+    def callFromThread(self, func: Callable, *args, **kwargs):
+        self.callLater(0, func, *args, **kwargs)
+
+    def _push(self, call: DelayedCall):
+        self._counter += 1
+        heapq.heappush(self._calls, (call.time, self._counter, call))
+
+    def _cancel(self, _):
+        self._cancelled += 1
+        if self._cancelled > 1000 and self._cancelled * 2 > len(self._calls):
+            self._calls = [entry for entry in self._calls if not entry[2].cancelled]
+            heapq.heapify(self._calls)
+            self._cancelled = 0
+
+    def getDelayedCalls(self) -> List[DelayedCall]:
+        return [call for _, _, call in self._calls if call.active()]
+
+    def run(self, until: float = None, condition: Callable[[], bool] = None) -> int:
+        """
+        Run scheduled calls in order of time
+
+        :param until: Virtual time to stop at. Run all calls if None
+        :param condition: Stop as soon as it returns True
+        :return: Count of run calls
+        """
+        events = 0
+        while self._calls and not (condition and condition()):
+            when, _, call = self._calls[0]
+            if until is not None and when > until:
+                break
+            heapq.heappop(self._calls)
+            if call.cancelled:
+                self._cancelled -= 1
+                continue
+            if call.called or when != call.time:
+                continue  # Rescheduled earlier, it has other entry
+            if call.delayed_time:
+                call.activate_delay()
+                self._push(call)
+                continue
+            self.now = max(self.now, when)
+            call.called = 1
+            events += 1
+            try:
+                call.func(*call.args, **call.kw)
+            except Exception:
+                log.exception(f'Exception in scheduled call {call.func}')
+        if until is not None and not (condition and condition()):
+            self.now = max(self.now, until)
+        self.events += events
+        return events
+
+    def advance(self, amount: float) -> int:
+        return self.run(self.now + amount)
+
+    @property
+    def pending(self) -> int:
+        """
+        Count of scheduled calls
+        """
+        return len(self._calls) - self._cancelled
+
+
+class NodeLoad:
+    __slots__ = ('datagrams_out', 'datagrams_in', 'bytes_out', 'bytes_in')
+
+    def __init__(self):
+        self.datagrams_out = 0
+        self.datagrams_in = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+
+class LossyFabric(MemoryFabric):
+    """
+    :param float latency: One-way delay of every datagram, seconds
+    :param float jitter: Max random delay added to `latency`, seconds
+    :param float loss: Probability of datagram to be lost
+    :param rng: Source of randomness
+    """
+
+    def __init__(self, clock, latency: float = 0.05, jitter: float = 0.,
+                 loss: float = 0., rng: random.Random = None):
+        super().__init__(clock)
+        self.base_latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = rng or random.Random()
+        self.load: Dict[Addr, NodeLoad] = {}
+
+    def latency(self, source: Addr, target: Addr) -> float:
+        return self.base_latency + (self.rng.random() * self.jitter if self.jitter else 0)
+
+    def lost(self, source: Addr, target: Addr) -> bool:
+        return bool(self.loss) and self.rng.random() < self.loss
+
+    def attach(self, proto, addr: Addr):
+        self.load[addr] = NodeLoad()
+        return super().attach(proto, addr)
+
+    def send(self, data: bytes, source: Addr, target: Addr):
+        load = self.load.get(source)
+        if load:
+            load.datagrams_out += 1
+            load.bytes_out += len(data)
+        super().send(data, source, target)
+
+    def _deliver(self, data: bytes, source: Addr, target: Addr):
+        load = self.load.get(target)
+        if load:
+            load.datagrams_in += 1
+            load.bytes_in += len(data)
+        super()._deliver(data, source, target)
+
+    def reset(self):
+        """
+        Zero all counters
+        """
+        self.sent = self.delivered = self.lost_count = self.bytes = 0
+        for addr in self.load:
+            self.load[addr] = NodeLoad()
+
+    def load_stats(self) -> Dict[str, dict]:
+        """
+        Distribution of datagrams and bytes over nodes
+        """
+        return {field: distribution([getattr(load, field) for load in self.load.values()])
+                for field in NodeLoad.__slots__}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    `q` quantile of sorted `values`
+    """
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0
+
+
+def distribution(values: List[float]) -> dict:
+    values = sorted(values)
+    return {
+        'mean': round(sum(values) / len(values), 3) if values else 0,
+        'p50': percentile(values, 0.5),
+        'p99': percentile(values, 0.99),
+        'max': values[-1] if values else 0
+    }
+
+
+def random_topology(count: int, degree: int, rng: random.Random) -> List[Set[int]]:
+    """
+    Connected random graph with average degree about `degree`: ring in random
+    order and random chords
+
+    :return: neighbours of every node
+    """
+    neighbours = [set() for _ in range(count)]
+
+    def link(a: int, b: int):
+        if a != b:
+            neighbours[a].add(b)
+            neighbours[b].add(a)
+
+    order = list(range(count))
+    rng.shuffle(order)
+    for i in range(count if count > 2 else count - 1):
+        link(order[i], order[(i + 1) % count])
+    for a in range(count):
+        for _ in range(max(degree - 2, 0) // 2):
+            link(a, rng.randrange(count))
+    return neighbours
+
+
+def address(index: int) -> Addr:
+    """
+    Address of node from 198.18.0.0/15 benchmarking range, so it is public
+    for `Peer.local`
+    """
+    return f'198.{18 + (index >> 16)}.{(index >> 8) & 255}.{index & 255}', 8000
+
+
+def node_name(addr: Addr) -> str:
+    return f'{addr[0]}:{addr[1]}'
+
+
+class ShoutTrace:
+    """
+    Nodes, which handled the shout, and virtual times of handling
+    """
+
+    def __init__(self, origin: str, expected: int, started: float):
+        self.origin = origin
+        self.expected = expected
+        self.started = started
+        self.arrivals: Dict[str, float] = {}
+
+    def arrived(self, name: str, now: float):
+        if name != self.origin and name not in self.arrivals:
+            self.arrivals[name] = now - self.started
+
+    @property
+    def done(self) -> bool:
+        return len(self.arrivals) >= self.expected
+
+
+_traces: Dict[str, ShoutTrace] = {}
+_handlers_registered = False
+
+
+def _register_handlers():
+    global _handlers_registered
+    if _handlers_registered:
+        return
+    from hodl_net.server import server, peer
+
+    @server.handle('sim_shout', 'shout', executor='inline')
+    async def sim_shout(message):
+        trace = _traces.get(message.data['id'])
+        if trace:
+            trace.arrived(peer.proto.name, peer.proto.reactor.seconds())
+
+    _handlers_registered = True
+
+
+class Simulation:
+    """
+    :param int count: Count of nodes
+    :param int degree: Average count of neighbours in topology
+    :param float latency: One-way delay of datagrams, seconds
+    :param float jitter: Max random delay added to `latency`, seconds
+    :param float loss: Probability of datagram to be lost
+    :param int seed: Seed of all randomness
+    :param keys: Private and public RSA keys of all nodes. Generated if None
+
+    DB connection must be created before. Standard handlers of
+    `hodl_net.net_protocol` must be imported. Global `random` is reseeded
+    and executors of the global server are replaced until `Simulation.close`.
+    """
+
+    def __init__(self, count: int, degree: int = 8, latency: float = 0.05,
+                 jitter: float = 0.02, loss: float = 0., seed: int = 0,
+                 keys: Tuple[str, str] = None):
+        from hodl_net.server import server, conf_file
+
+        _register_handlers()
+        random.seed(seed)
+        self.rng = random.Random(seed)
+        self.clock = SimulatedClock()
+        self.fabric = LossyFabric(self.clock, latency, jitter, loss, self.rng)
+        self.echo_interval = conf_file['deadpeer']['echo_interval']
+
+        # Handlers are run by executors of the global server
+        self._server = server
+        self._executors = dict(server.executors)
+        for name in self._executors:
+            server.add_executor(InlineExecutor(name))
+
+        keys = keys or gen_keys()
+        self.addrs = [address(i) for i in range(count)]
+        self.nodes = [create_node(addr, keys=keys, r=self.clock,
+                                  propagation=conf_file['propagation']['mode'])
+                      for addr in self.addrs]
+        for node, addr in zip(self.nodes, self.addrs):
+            node.udp.tunnels = None
+            node.udp.seen = SeenFilter(conf_file['dedup']['max_ids'],
+                                       conf_file['dedup']['expire'], self.clock)
+            self.fabric.attach(node.udp, addr)
+        self.topology = random_topology(count, degree, self.rng)
+        self._loops: List[task.LoopingCall] = []
+        self._users: Set[int] = set()
+
+        for node in self.nodes:
+            node.udp.propagation.start(self.clock)
+
+    def link(self, synced: bool = True):
+        """
+        Add neighbours from topology to peer tables
+
+        :param synced: mark peers as synced, so nodes don't exchange peer lists
+        """
+        for node, neighbours in zip(self.nodes, self.topology):
+            for index in neighbours:
+                _peer = Peer(node.udp, addr=node_name(self.addrs[index]))
+                _peer.synced = synced
+                node.udp.peer_table.add(_peer, notify=False)
+
+    def add_users(self, indices: List[int]):
+        """
+        Save nodes as users, so their signed messages are accepted
+        """
+        indices = [index for index in indices if index not in self._users]
+        if not indices:
+            return
+        ses = db_worker.get_session()
+        seq = User.last_seq(ses)
+        for seq, index in enumerate(indices, seq + 1):
+            proto = self.nodes[index].udp
+            ses.merge(User(proto, name=proto.name, public_key=proto.public_key, seq=seq))
+        ses.commit()
+        db_worker.close_session(ses)
+        self._users.update(indices)
+
+    def run(self, duration: float, condition: Callable[[], bool] = None) -> int:
+        """
+        Run network for `duration` virtual seconds or until `condition` is True
+        """
+        return self.clock.run(self.clock.now + duration, condition)
+
+    def _echo(self, proto):
+        _peer = proto.peer_table.random()
+        if _peer:
+            _peer.request(Message('ping'), expect_reply=False)
+
+    def start_echo(self):
+        """
+        Ping random known peer from every node every `echo_interval`
+        """
+        for node in self.nodes:
+            loop = task.LoopingCall(self._echo, node.udp)
+            loop.clock = self.clock
+            self.clock.callLater(self.rng.uniform(0, self.echo_interval),
+                                 loop.start, self.echo_interval)
+            self._loops.append(loop)
+
+    def coverage(self) -> List[float]:
+        """
+        Fraction of other nodes known by every node
+        """
+        others = max(len(self.nodes) - 1, 1)
+        # Node learns its own address from peers of others
+        return [(len(node.udp.peer_table) - (node.udp.name in node.udp.peer_table)) / others
+                for node in self.nodes]
+
+    def discover(self, coverage: float = 1., max_time: float = 600,
+                 check_interval: float = 1) -> dict:
+        """
+        Run peer discovery from `topology` with unsynced peers
+
+        :param coverage: Fraction of other nodes, which every node must know
+        :param max_time: Virtual seconds to give up after
+        :param check_interval: Virtual seconds between checks of coverage
+        """
+        self.link(synced=False)
+        self.start_echo()
+        started = self.clock.now
+        timeline = []
+        converged = None
+        while self.clock.now - started < max_time:
+            self.run(check_interval)
+            known = self.coverage()
+            timeline.append((round(self.clock.now - started, 3),
+                             round(sum(known) / len(known), 4)))
+            if min(known) >= coverage:
+                converged = self.clock.now - started
+                break
+        known = self.coverage()
+        return {
+            'converged_s': round(converged, 3) if converged is not None else None,
+            'coverage': {'min': round(min(known), 4), 'mean': round(sum(known) / len(known), 4)},
+            'timeline': timeline
+        }
+
+    def shout(self, origin: int = None, timeout: float = 60) -> ShoutTrace:
+        """
+        Shout from node `origin` and run until all other nodes handle it
+
+        :param origin: Index of node. Random if None
+        :param timeout: Virtual seconds to give up after
+        """
+        if origin is None:
+            origin = self.rng.randrange(len(self.nodes))
+        self.add_users([origin])
+        proto = self.nodes[origin].udp
+        uid = f'shout-{origin}-{self.clock.events}'
+        trace = _traces[uid] = ShoutTrace(proto.name, len(self.nodes) - 1, self.clock.now)
+        try:
+            proto.shout(Message('sim_shout', {'id': uid}))
+            self.run(timeout, lambda: trace.done)
+        finally:
+            del _traces[uid]
+        return trace
+
+    def close(self):
+        for loop in self._loops:
+            if loop.running:
+                loop.stop()
+        for node, addr in zip(self.nodes, self.addrs):
+            node.udp.propagation.stop()
+            self.fabric.detach(addr)
+        for executor in self._executors.values():
+            self._server.add_executor(executor)
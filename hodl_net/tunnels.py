@@ -0,0 +1,307 @@
+"""
+Tunnels: fixed multi-hop paths for messages, hiding their origin.
+
+Origin builds a tunnel by sending `tunnel_setup` request with tunnel id and
+count of remaining hops to a random peer. Every hop remembers the route
+(peer it came from, random peer it is sent to) and passes the request on
+with a new id, so every link of the tunnel has its own id. The last hop, the
+exit, answers with `tunnel_ready`, which goes back to the origin by the same
+route. `tunnel_teardown` removes the route on every
+hop. Routes expire after `expire` seconds, origin replaces own tunnels before
+that.
+
+Data goes through tunnel in raw frames, which hops forward without decoding,
+only replacing tunnel id::
+
+    magic (0xB5) | tunnel id (16 bytes) | payload
+
+Exit handles payload as a datagram received from the network, so the message
+is propagated from the exit.
+"""
+
+from twisted.internet import task
+from typing import Dict, Optional, Tuple
+
+from hodl_net.models import Message, TempDict, Peer
+
+import logging
+import random
+import uuid
+import time
+
+log = logging.getLogger(__name__)
+
+MAGIC = 0xB5
+ID_SIZE = 16
+
+
+def is_tunnel_frame(datagram: bytes) -> bool:
+    return datagram[:1] == bytes((MAGIC,))
+
+
+def pack_frame(tunnel_id: bytes, payload: bytes) -> bytes:
+    return b''.join((bytes((MAGIC,)), tunnel_id, payload))
+
+
+def unpack_frame(data: bytes) -> Tuple[bytes, bytes]:
+    """
+    :return: tunnel id, payload
+    :raises ValueError: if frame is malformed
+    """
+    if not is_tunnel_frame(data) or len(data) <= 1 + ID_SIZE:
+        raise ValueError('Bad tunnel frame')
+    return data[1:1 + ID_SIZE], data[1 + ID_SIZE:]
+
+
+class Route:
+    """
+    Hop of tunnel. Every link of tunnel has its own id, so one node can be
+    passed by a tunnel twice. `backward` is None on origin, `forward` is None on exit
+    """
+
+    __slots__ = ('backward', 'backward_id', 'forward', 'forward_id', 'created',
+                 'bytes_forward', 'bytes_backward')
+
+    def __init__(self, backward: Optional[str], backward_id: Optional[bytes],
+                 forward: Optional[str], forward_id: Optional[bytes]):
+        self.backward = backward
+        self.backward_id = backward_id
+        self.forward = forward
+        self.forward_id = forward_id
+        self.created = time.time()
+        self.bytes_forward = 0
+        self.bytes_backward = 0
+
+
+class TunnelTable:
+    """
+    Routes of tunnels passing this node and tunnels of this node
+
+    :param proto: `PeerProtocol`
+    :param int hops: Count of hops in own tunnels
+    :param int max_hops: Max count of hops of tunnel built by other node
+    :param float expire: Lifetime of route in seconds
+    :param int max_routes: Max count of routes
+    :param int pool_size: Count of own tunnels kept ready
+    :param float setup_timeout: Seconds to wait for `tunnel_ready`
+    """
+
+    def __init__(self, proto, hops: int = 3, max_hops: int = 8, expire: float = 600,
+                 max_routes: int = 10000, pool_size: int = 2, setup_timeout: float = 10):
+        self.proto = proto
+        self.hops = hops
+        self.max_hops = max_hops
+        self.expire = expire
+        self.pool_size = pool_size
+        self.setup_timeout = setup_timeout
+
+        # Routes by id of link with backward peer and by id of link with forward peer.
+        # Own tunnels are only in the second one
+        self.routes = TempDict(factory=None, expire=expire, max_size=max_routes,
+                               on_evict=self._evicted)
+        self._outgoing = TempDict(factory=None, expire=expire, max_size=max_routes,
+                                  on_evict=self._evicted)
+        self._own: Dict[bytes, float] = {}  # Ready tunnels of this node
+        self._pending: Dict[bytes, float] = {}
+        self._loop = None
+
+        self.forwarded = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    # Origin
+
+    def build(self) -> Optional[bytes]:
+        """
+        Start building own tunnel through random peers
+
+        :return: tunnel id, or None if there are no peers
+        """
+        first = self.proto.peer_table.random()
+        if not first:
+            return None
+        tunnel_id = uuid.uuid4().bytes
+        self._outgoing[tunnel_id] = Route(None, None, first.addr, tunnel_id)
+        self._pending[tunnel_id] = time.time()
+        self._request(first.addr, 'tunnel_setup', tunnel_id, hops=self.hops - 1)
+        return tunnel_id
+
+    def teardown(self, tunnel_id: bytes):
+        """
+        Remove own tunnel on all hops
+        """
+        self._own.pop(tunnel_id, None)
+        self._pending.pop(tunnel_id, None)
+        route = self._outgoing.pop(tunnel_id, None)
+        if route:
+            self._request(route.forward, 'tunnel_teardown', tunnel_id)
+
+    def maintain(self):
+        """
+        Replace old own tunnels and keep `pool_size` of them
+        """
+        now = time.time()
+        for tunnel_id, created in list(self._own.items()):
+            if now - created >= self.expire * 0.9 or tunnel_id not in self._outgoing:
+                self.teardown(tunnel_id)
+        for tunnel_id, started in list(self._pending.items()):
+            if now - started >= self.setup_timeout:
+                self.teardown(tunnel_id)
+        while len(self._own) + len(self._pending) < self.pool_size:
+            if not self.build():
+                break
+
+    def send(self, data: bytes) -> bool:
+        """
+        Send datagram through random own tunnel
+
+        :return: False, if there is no ready tunnel
+        """
+        while self._own:
+            tunnel_id = random.choice(list(self._own))
+            route = self._outgoing.get(tunnel_id)
+            if not route:
+                self._own.pop(tunnel_id)
+                continue
+            route.bytes_forward += len(data)
+            self.proto._transmit(pack_frame(tunnel_id, data), route.forward)
+            return True
+        self.maintain()
+        return False
+
+    # Hops
+
+    def on_setup(self, message: Message, _peer: Peer):
+        tunnel_id, hops = bytes.fromhex(message.data['id']), int(message.data['hops'])
+        if len(tunnel_id) != ID_SIZE or tunnel_id in self.routes:
+            return
+        forward = None
+        if 0 < hops <= self.max_hops:
+            candidates = [candidate for candidate in self.proto.peer_table.sample(2)
+                          if candidate.addr != _peer.addr]
+            if candidates:
+                forward = candidates[0]
+        if not forward:
+            self.routes[tunnel_id] = Route(_peer.addr, tunnel_id, None, None)
+            return self._request(_peer.addr, 'tunnel_ready', tunnel_id)
+        forward_id = uuid.uuid4().bytes
+        route = Route(_peer.addr, tunnel_id, forward.addr, forward_id)
+        self.routes[tunnel_id] = self._outgoing[forward_id] = route
+        self._request(forward.addr, 'tunnel_setup', forward_id, hops=hops - 1)
+
+    def on_ready(self, message: Message, _peer: Peer):
+        tunnel_id = bytes.fromhex(message.data['id'])
+        route = self._outgoing.get(tunnel_id)
+        if not route or route.forward != _peer.addr:
+            return
+        if route.backward:
+            return self._request(route.backward, 'tunnel_ready', route.backward_id)
+        if self._pending.pop(tunnel_id, None) is not None:
+            self._own[tunnel_id] = route.created
+            log.debug(f'Tunnel {tunnel_id.hex()} is ready')
+
+    def on_teardown(self, message: Message, _peer: Peer):
+        tunnel_id = bytes.fromhex(message.data['id'])
+        route = self._find(tunnel_id, _peer.addr)[0]
+        if not route:
+            return
+        self._remove(route)
+        if _peer.addr == route.backward and route.forward:
+            self._request(route.forward, 'tunnel_teardown', route.forward_id)
+        elif _peer.addr == route.forward and route.backward:
+            self._request(route.backward, 'tunnel_teardown', route.backward_id)
+
+    def on_frame(self, frame: bytes, addr: str) -> Optional[bytes]:
+        """
+        Forward frame to the next hop
+
+        :return: payload, if this node is the end of tunnel
+        :raises ValueError: if frame is malformed
+        """
+        tunnel_id, payload = unpack_frame(frame)
+        route, forward = self._find(tunnel_id, addr)
+        if not route:
+            self.dropped += 1
+            return None
+        if forward:
+            route.bytes_forward += len(payload)
+            following, following_id = route.forward, route.forward_id
+        else:
+            route.bytes_backward += len(payload)
+            following, following_id = route.backward, route.backward_id
+        if not following:
+            self.delivered += 1
+            return payload
+        self.forwarded += 1
+        self.proto._transmit(pack_frame(following_id, payload), following)
+        return None
+
+    def _find(self, tunnel_id: bytes, addr: str) -> Tuple[Optional[Route], bool]:
+        """
+        :return: route and True, if link is on backward side of route
+        """
+        route = self.routes.get(tunnel_id)
+        if route and route.backward == addr:
+            return route, True
+        route = self._outgoing.get(tunnel_id)
+        if route and route.forward == addr:
+            return route, False
+        return None, False
+
+    def _remove(self, route: Route):
+        if route.backward_id:
+            self.routes.pop(route.backward_id, None)
+        if route.forward_id:
+            self._outgoing.pop(route.forward_id, None)
+            self._own.pop(route.forward_id, None)
+            self._pending.pop(route.forward_id, None)
+
+    def _request(self, addr: str, name: str, tunnel_id: bytes, **data):
+        _peer = self.proto.peer_table.get(addr) or Peer(self.proto, addr=addr)
+        _peer.request(Message(name, {'id': tunnel_id.hex(), **data}), expect_reply=False)
+
+    def _evicted(self, _, route: Route):
+        self._remove(route)
+
+    def start(self, clock=None):
+        self.routes.start(clock)
+        self._outgoing.start(clock)
+        self._loop = task.LoopingCall(self.maintain)
+        if clock:
+            self._loop.clock = clock
+        self._loop.start(self.setup_timeout, now=False)
+
+    def stop(self):
+        self.routes.stop()
+        self._outgoing.stop()
+        if self._loop and self._loop.running:
+            self._loop.stop()
+
+    def stats(self) -> dict:
+        return {
+            'routes': len(self.routes),
+            'own': len(self._own),
+            'pending': len(self._pending),
+            'forwarded': self.forwarded,
+            'delivered': self.delivered,
+            'dropped': self.dropped
+        }
+
+    def route_stats(self) -> Dict[str, dict]:
+        """
+        Byte counters of every route, by id of its link with backward peer
+        or by id of own tunnel
+        """
+        stats = {}
+        for routes in (self.routes, self._outgoing):
+            for tunnel_id in list(routes):
+                route = routes.get(tunnel_id)
+                if not route or routes is self._outgoing and route.backward:
+                    continue
+                stats[tunnel_id.hex()] = {
+                    'backward': route.backward,
+                    'forward': route.forward,
+                    'bytes_forward': route.bytes_forward,
+                    'bytes_backward': route.bytes_backward
+                }
+        return stats
@@ -1,22 +1,159 @@
-from netaddr import IPNetwork, IPAddress
+"""
+Classification of peer addresses as local or public.
+
+Address is local, if it is in subnet of one of this host's interfaces and
+isn't an address of this host. Interfaces are detected with `netifaces`, if
+it is installed. Otherwise only subnets of primary IPv4 and IPv6 addresses
+are known, with assumed /24 and /64 prefixes.
+"""
+
+from netaddr import IPNetwork, IPAddress, AddrFormatError
+from twisted.internet import task
+from typing import Dict, List, Set, Tuple
+
+import threading
+import logging
 import socket
 
+try:
+    import netifaces
+except ImportError:
+    netifaces = None
 
-def get_ip():
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+log = logging.getLogger(__name__)
+
+
+def get_ip(family=socket.AF_INET, probe: str = '10.255.255.255') -> str:
+    """
+    Address of interface used for outgoing datagrams. None if there isn't any
+    """
+    s = socket.socket(family, socket.SOCK_DGRAM)
     try:
         # doesn't even have to be reachable
-        s.connect(('10.255.255.255', 1))
-        IP = s.getsockname()[0]
-    except:
-        IP = '127.0.0.1'
+        s.connect((probe, 1))
+        return s.getsockname()[0]
+    except OSError:
+        return None
     finally:
         s.close()
-    return IP
 
 
-def check_ip(ip, ip_net=IPNetwork(get_ip()).cidr):
-    is_local = False
-    if IPAddress(ip) in IPNetwork(ip_net) and IPAddress(ip) != IPAddress(get_ip()):
-            is_local = True
-    return is_local
+def _strip_scope(addr: str) -> str:
+    return addr.split('%', 1)[0]
+
+
+def interface_networks() -> List[Tuple[str, IPNetwork]]:
+    """
+    Addresses and subnets of all interfaces
+    """
+    if netifaces:
+        networks = []
+        for interface in netifaces.interfaces():
+            addresses = netifaces.ifaddresses(interface)
+            for family in (netifaces.AF_INET, netifaces.AF_INET6):
+                for info in addresses.get(family, []):
+                    try:
+                        addr = _strip_scope(info['addr'])
+                        netmask = info.get('netmask') or ''
+                        if '/' in netmask:
+                            prefix = int(netmask.rsplit('/', 1)[1])
+                        elif netmask:
+                            prefix = IPAddress(netmask).netmask_bits()
+                        else:
+                            prefix = 32 if family == netifaces.AF_INET else 128
+                        networks.append((addr, IPNetwork(f'{addr}/{prefix}').cidr))
+                    except (KeyError, ValueError, AddrFormatError):
+                        log.debug(f'Bad address of interface {interface}: {info}')
+        return networks
+
+    networks = [('127.0.0.1', IPNetwork('127.0.0.0/8')), ('::1', IPNetwork('::1/128'))]
+    for family, probe, prefix in ((socket.AF_INET, '10.255.255.255', 24),
+                                  (socket.AF_INET6, 'fd00::1', 64)):
+        addr = get_ip(family, probe)
+        if addr:
+            addr = _strip_scope(addr)
+            networks.append((addr, IPNetwork(f'{addr}/{prefix}').cidr))
+    return networks
+
+
+class LocalNetworkClassifier:
+    """
+    Memoized check, whether address is local.
+
+    Interfaces are detected on first check and on every `refresh`. Cache of
+    results is cleared on refresh and when it exceeds `max_size`.
+
+    :param float refresh_interval: Seconds between refreshes after `start`
+    :param int max_size: Max count of memoized addresses
+    """
+
+    def __init__(self, refresh_interval: float = 60, max_size: int = 65536):
+        self.refresh_interval = refresh_interval
+        self.max_size = max_size
+
+        self.networks: List[IPNetwork] = None
+        self.own: Set[IPAddress] = set()
+        self._cache: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def refresh(self):
+        """
+        Detect interfaces again
+        """
+        try:
+            detected = interface_networks()
+        except OSError:
+            log.exception('Cannot detect network interfaces')
+            detected = []
+        with self._lock:
+            self.own = {IPAddress(addr) for addr, _ in detected}
+            self.networks = sorted({network for _, network in detected},
+                                   key=lambda network: network.prefixlen, reverse=True)
+            self._cache = {}
+        log.debug(f'Local networks: {", ".join(map(str, self.networks))}')
+
+    def is_local(self, ip: str) -> bool:
+        result = self._cache.get(ip)
+        if result is not None:
+            return result
+        if self.networks is None:
+            self.refresh()
+        result = self._classify(ip)
+        with self._lock:
+            if len(self._cache) >= self.max_size:
+                self._cache = {}
+            self._cache[ip] = result
+        return result
+
+    def _classify(self, ip: str) -> bool:
+        try:
+            addr = IPAddress(_strip_scope(ip.strip('[]')))
+        except (ValueError, AddrFormatError):
+            return False
+        if addr in self.own:
+            return False
+        return any(addr in network for network in self.networks
+                   if network.version == addr.version)
+
+    def start(self, clock=None):
+        if self._loop and self._loop.running:
+            return
+        self._loop = task.LoopingCall(self.refresh)
+        if clock:
+            self._loop.clock = clock
+        self._loop.start(self.refresh_interval, now=self.networks is None)
+
+    def stop(self):
+        if self._loop and self._loop.running:
+            self._loop.stop()
+
+
+classifier = LocalNetworkClassifier()
+
+
+def check_ip(ip: str) -> bool:
+    """
+    True, if `ip` is in local network
+    """
+    return classifier.is_local(ip)
@@ -0,0 +1,229 @@
+"""
+Multi-process mode of one node.
+
+`Server.run_workers` starts `count` processes with the same keys and DB. Every
+process binds the node's UDP port with SO_REUSEPORT, so the kernel spreads
+datagrams of different peers across processes. Processes are started with
+'spawn' method: module of the main script is imported again in every worker,
+so handlers must be registered on import and the server must be started
+under `if __name__ == '__main__':`.
+
+Workers share state through `WorkerChannel` - Unix datagram sockets in one
+directory. Every worker sends to others ids of new messages, so a message
+is handled by one worker only, and new peers. Users are stored in the
+common DB and are visible to all workers.
+
+Kernel chooses worker by address of the relaying peer, so a message to this
+node may come to a worker, which doesn't have the state for it:
+
+* Replies. Worker tags `Message.callback` of its requests with its index.
+  Reply with callback of other worker is passed to it after decryption.
+* Session messages. Session is known only to the worker, which created or
+  accepted it. Message of unknown session is passed to all other workers
+  before decryption, the owner of the session handles it.
+* Tunnels. Their routes change with every hop and aren't shared, so tunnels
+  are disabled in multi-process mode.
+"""
+
+from twisted.internet import task
+from twisted.internet.protocol import DatagramProtocol
+from typing import List, Optional
+
+from hodl_net.models import Message, MessageWrapper, Peer
+
+import multiprocessing
+import tempfile
+import logging
+import hashlib
+import base64
+import socket
+import json
+import os
+
+log = logging.getLogger(__name__)
+
+
+def listen_reuseport(reactor, port: int, protocol: DatagramProtocol, interface: str = ''):
+    """
+    Bind UDP port shared with other processes
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((interface, port))
+        sock.setblocking(False)
+        return reactor.adoptDatagramPort(sock.fileno(), socket.AF_INET, protocol)
+    finally:
+        sock.close()  # Reactor uses its own copy of descriptor
+
+
+class WorkerChannel(DatagramProtocol):
+    """
+    State exchange between workers of one node
+
+    :param proto: `PeerProtocol` of this worker
+    :param int index: Number of this worker
+    :param int count: Count of workers
+    :param str directory: Directory for sockets of workers
+    :param float flush_interval: Seconds to collect updates before sending them
+    :param int max_items: Max count of ids or peers in one datagram
+    """
+
+    def __init__(self, proto, index: int, count: int, directory: str,
+                 flush_interval: float = 0.01, max_items: int = 500):
+        self.proto = proto
+        self.index = index
+        self.count = count
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_items = max_items
+        # Workers of other nodes tag callbacks too, so tag is unique for node
+        self.tag = hashlib.sha256(directory.encode()).hexdigest()[:8]
+
+        self._seen: List[str] = []
+        self._peers: List[str] = []
+        self._loop = None
+
+        self.sent = 0
+        self.received = 0
+        self.forwarded = 0
+
+    def path(self, index: int) -> str:
+        return os.path.join(self.directory, f'worker-{index}.sock')
+
+    def start(self, reactor):
+        path = self.path(self.index)
+        if os.path.exists(path):
+            os.remove(path)
+        reactor.listenUNIXDatagram(path, self)
+        self._loop = task.LoopingCall(self.flush)
+        self._loop.clock = reactor
+        self._loop.start(self.flush_interval, now=False)
+
+    def stop(self):
+        if self._loop and self._loop.running:
+            self._loop.stop()
+        self.flush()
+
+    def publish_seen(self, uid: str):
+        self._seen.append(uid)
+
+    def publish_peer(self, _peer: Peer):
+        self._peers.append(_peer.addr)
+
+    def tag_callback(self, callback: str) -> str:
+        """
+        Callback id, replies to which are passed to this worker
+        """
+        return f'{callback}@{self.tag}.{self.index}'
+
+    def owner(self, callback: str) -> Optional[int]:
+        """
+        Index of other worker, which tagged callback id. None if there isn't one
+        """
+        _, _, tag = callback.rpartition('@')
+        node_tag, _, index = tag.partition('.')
+        if node_tag != self.tag or not index.isdigit():
+            return None
+        index = int(index)
+        return index if index != self.index and index < self.count else None
+
+    def _write(self, data: dict, index: int):
+        try:
+            self.transport.write(json.dumps(data).encode(), self.path(index))
+            self.sent += 1
+        except OSError as ex:  # Worker isn't started yet or is dead
+            log.debug(f'Cannot send state to worker {index}: {ex}')
+
+    def forward_datagram(self, datagram: bytes, addr: str):
+        """
+        Pass datagram to all other workers
+        """
+        data = {'datagram': base64.b64encode(datagram).decode(), 'addr': addr}
+        self.forwarded += 1
+        for index in range(self.count):
+            if index != self.index:
+                self._write(data, index)
+
+    def forward_message(self, index: int, wrapper: MessageWrapper, _peer: Peer, _user=None):
+        """
+        Pass decrypted message to worker `index`
+        """
+        self.forwarded += 1
+        self._write({
+            'message': wrapper.message.dump(),
+            'type': wrapper.type,
+            'sender': _user.name if _user else None,
+            'addr': _peer.addr
+        }, index)
+
+    def flush(self):
+        while self._seen or self._peers:
+            seen, self._seen = self._seen[:self.max_items], self._seen[self.max_items:]
+            peers, self._peers = self._peers[:self.max_items], self._peers[self.max_items:]
+            for index in range(self.count):
+                if index != self.index:
+                    self._write({'seen': seen, 'peers': peers}, index)
+
+    def datagramReceived(self, datagram: bytes, addr):
+        self.received += 1
+        try:
+            data = json.loads(datagram)
+            if 'datagram' in data:
+                addr = self.proto._parse_addr(data['addr'])
+                return self.proto.handle_datagram(base64.b64decode(data['datagram']), addr,
+                                                  forwarded=True)
+            if 'message' in data:
+                return self._dispatch(data)
+            for uid in data['seen']:
+                self.proto.seen.add(uid)
+            for peer_addr in data['peers']:
+                self.proto.peer_table.add(Peer(self.proto, addr=peer_addr), notify=False)
+        except (ValueError, KeyError, TypeError):
+            log.warning('Bad datagram from worker')
+
+    def _dispatch(self, data: dict):
+        _peer = self.proto.peer_table.get(data['addr']) or Peer(self.proto, addr=data['addr'])
+        _user = self.proto.get_user(data['sender']) if data['sender'] else None
+        wrapper = MessageWrapper(Message(**data['message']), data['type'], sender=data['sender'])
+        self.proto.dispatch(wrapper, _peer, _user, forwarded=True)
+
+    def stats(self) -> dict:
+        return {
+            'index': self.index,
+            'sent': self.sent,
+            'received': self.received,
+            'forwarded': self.forwarded
+        }
+
+
+def run_worker(index: int, count: int, directory: str, port: int, name: str):
+    from hodl_net.server import server
+
+    server.udp.workers = WorkerChannel(server.udp, index, count, directory)
+    if server.udp.tunnels:
+        log.info('Tunnels are disabled in multi-process mode')
+        server.udp.tunnels = None
+    server.run(port, name)
+
+
+def run_workers(count: int, port: int, name: str):
+    """
+    Run node in `count` processes and wait until they exit
+    """
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(prefix='hodl_net_') as directory:
+        processes = [ctx.Process(target=run_worker, args=(index, count, directory, port, name),
+                                 name=f'{name}-worker-{index}')
+                     for index in range(count)]
+        for process in processes:
+            process.start()
+        log.info(f'{count} workers started at {port}')
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
@@ -0,0 +1,44 @@
+import unittest
+
+from twisted.internet.task import Clock
+
+from hodl_net.batching import OutboundBatcher, pack_batch, unpack_batch
+
+ADDR = ('127.0.0.1', 8000)
+
+
+class BatchingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.written = []
+        self.batcher = OutboundBatcher(self.clock, lambda *args: self.written.append(args),
+                                       window=0.01, mtu=100)
+
+    def test_pack(self):
+        datagrams = [b'a', b'', b'c' * 300]
+        self.assertEqual(unpack_batch(pack_batch(datagrams)), datagrams)
+        for bad in (pack_batch(datagrams)[:-1], pack_batch(datagrams) + b'0', b'{}'):
+            with self.assertRaises(ValueError):
+                unpack_batch(bad)
+
+    def test_window(self):
+        self.batcher.send(b'a', ADDR)
+        self.batcher.send(b'b', ADDR)
+        self.batcher.send(b'c', ('127.0.0.1', 8001))
+        self.assertEqual(self.written, [])
+        self.clock.advance(0.01)
+        self.assertIn((pack_batch([b'a', b'b']), ADDR), self.written)
+        self.assertIn((b'c', ('127.0.0.1', 8001)), self.written)
+
+    def test_mtu(self):
+        for _ in range(3):
+            self.batcher.send(b'x' * 40, ADDR)
+        self.assertEqual(self.written, [(pack_batch([b'x' * 40] * 2), ADDR)])
+        self.batcher.send(b'y' * 200, ADDR)
+        self.assertEqual(self.written[-2:], [(b'x' * 40, ADDR), (b'y' * 200, ADDR)])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
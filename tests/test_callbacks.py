@@ -0,0 +1,59 @@
+import unittest
+
+from twisted.internet.task import Clock
+from twisted.internet.defer import CancelledError
+
+from hodl_net.callbacks import CallbackRegistry
+from hodl_net.errors import RequestTimeout
+
+
+class CallbackRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.registry = CallbackRegistry(self.clock, timeout=10)
+        self.results = []
+
+    def test_resolve(self):
+        d = self.registry.add('a')
+        d.addCallback(self.results.append)
+        self.assertTrue(self.registry.resolve('a', 'response'))
+        self.assertFalse(self.registry.resolve('a', 'response'))
+        self.assertEqual(self.results, ['response'])
+        self.assertEqual(self.registry.stats()['completed'], 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_timeout(self):
+        self.registry.add('a', timeout=5).addErrback(self.results.append)
+        self.registry.add('b').addErrback(self.results.append)
+        self.clock.advance(5)
+        self.assertEqual(len(self.results), 1)
+        self.results[0].trap(RequestTimeout)
+        self.clock.advance(5)
+        self.assertEqual(self.registry.stats(), {
+            'pending': 0, 'completed': 0, 'timed_out': 2, 'cancelled': 0
+        })
+
+    def test_cancel(self):
+        d = self.registry.add('a')
+        d.addErrback(self.results.append)
+        d.cancel()
+        self.results[0].trap(CancelledError)
+        self.assertNotIn('a', self.registry)
+        self.assertEqual(self.registry.stats()['cancelled'], 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_quality_hooks(self):
+        samples = []
+        self.registry.on_complete = lambda addr, rtt: samples.append((addr, rtt))
+        self.registry.on_timeout = lambda addr: samples.append((addr, None))
+        self.registry.add('a', addr='1.1.1.1:8000')
+        self.registry.add('b', addr='2.2.2.2:8000').addErrback(lambda _: None)
+        self.clock.advance(2)
+        self.registry.resolve('a', 'response')
+        self.clock.advance(10)
+        self.assertEqual(samples, [('1.1.1.1:8000', 2), ('2.2.2.2:8000', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
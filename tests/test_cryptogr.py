@@ -0,0 +1,152 @@
+import unittest
+import queue
+
+from twisted.internet import defer
+
+from hodl_net.cryptogr import (
+    gen_keys, sign, verify, encrypt, decrypt, KeyCache, key_cache, CryptoPool,
+    VerifyCache, verify_cache
+)
+from hodl_net.errors import VerificationFailed
+from hodl_net.models import Message, MessageWrapper
+
+
+class Pump:
+    """
+    Runs calls from threads in test thread
+    """
+
+    def __init__(self):
+        self.calls = queue.Queue()
+
+    def callFromThread(self, f, *args):
+        self.calls.put((f, args))
+
+    def run_until(self, d: defer.Deferred):
+        results = []
+        d.addBoth(results.append)
+        while not results:
+            f, args = self.calls.get(timeout=30)
+            f(*args)
+        return results[0]
+
+
+class CryptogrTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, cls.public_key = gen_keys()
+
+    def test_sign_verify(self):
+        signature = sign('text', self.private_key)
+        self.assertTrue(verify('text', signature, self.public_key))
+        self.assertFalse(verify('other text', signature, self.public_key))
+
+    def test_unsigned(self):
+        self.assertFalse(verify('text', None, self.public_key))
+        wrapper = MessageWrapper(Message('test'), 'shout', sender='node')
+        with self.assertRaises(VerificationFailed):
+            wrapper.verify(self.public_key)
+
+    def test_encrypt_decrypt(self):
+        text = 'x' * 1000
+        self.assertEqual(decrypt(encrypt(text, self.public_key), self.private_key), text)
+
+    def test_key_cache(self):
+        misses = key_cache.stats()['misses']
+        sign('text', self.private_key)
+        sign('text', self.private_key)
+        self.assertLessEqual(key_cache.stats()['misses'], misses + 1)
+
+        cache = KeyCache(max_size=1)
+        cache.get(self.public_key)
+        cache.get(self.public_key)
+        cache.get(self.private_key)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_verify_cache(self):
+        verify_cache.clear()
+        signature = sign('cached text', self.private_key)
+        for _ in range(3):
+            self.assertTrue(verify('cached text', signature, self.public_key))
+        self.assertFalse(verify('other text', signature, self.public_key))
+        self.assertFalse(verify('other text', signature, self.public_key))
+        self.assertEqual(verify_cache.stats()['misses'], 2)
+        self.assertEqual(verify_cache.stats()['hits'], 3)
+
+        cache = VerifyCache(max_size=2)
+        keys = [cache.key(f'text {i}', signature, self.public_key) for i in range(3)]
+        for key in keys:
+            cache.set(key, True)
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertTrue(cache.get(keys[2]))
+
+
+class CryptoPoolTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, cls.public_key = gen_keys()
+
+    def setUp(self):
+        self.clock = Pump()
+        self.pool = CryptoPool(self.clock, workers=2, batch_size=4)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_batches(self):
+        texts = [f'text {i}' for i in range(10)]
+        d = defer.gatherResults([self.pool.sign(text, self.private_key) for text in texts])
+        signatures = self.clock.run_until(d)
+        self.assertEqual(signatures, [sign(text, self.private_key) for text in texts])
+        self.assertEqual(self.pool.stats()['batches'], 4)  # 1 + 1 at once, then 4 + 4
+        self.assertEqual(self.pool.stats()['completed'], 10)
+
+        result = self.clock.run_until(self.pool.decrypt('bad', self.private_key))
+        self.assertIsInstance(result.value, ValueError)
+
+    def test_wrapper(self):
+        wrapper = MessageWrapper(Message('test', {'x': 1}), sender='node', cipher='rsa-aes-gcm')
+        self.clock.run_until(defer.ensureDeferred(
+            wrapper.prepare_async(self.pool, self.private_key, self.public_key)))
+        self.assertIsInstance(wrapper.message, str)
+
+        received = MessageWrapper.from_bytes(wrapper.to_bytes())
+        self.clock.run_until(defer.ensureDeferred(
+            received.open_async(self.pool, self.private_key, self.public_key)))
+        self.assertEqual(received.message.data, {'x': 1})
+
+        received = MessageWrapper.from_bytes(wrapper.to_bytes())
+        received.sign = sign('other', self.private_key)
+        result = self.clock.run_until(defer.ensureDeferred(
+            received.open_async(self.pool, self.private_key, self.public_key)))
+        self.assertIsInstance(result.value, VerificationFailed)
+
+        received.sign = None
+        result = self.clock.run_until(defer.ensureDeferred(
+            received.open_async(self.pool, self.private_key, self.public_key)))
+        self.assertIsInstance(result.value, VerificationFailed)
+
+    def test_shout(self):
+        wrapper = MessageWrapper(Message('test', {'x': 1}), type='shout', sender='node')
+        self.clock.run_until(defer.ensureDeferred(
+            wrapper.prepare_async(self.pool, self.private_key)))
+        submitted = self.pool.stats()['submitted']
+
+        received = MessageWrapper.from_bytes(wrapper.to_bytes())
+        self.clock.run_until(defer.ensureDeferred(
+            received.open_async(self.pool, self.private_key, self.public_key)))
+        self.assertEqual(self.pool.stats()['submitted'], submitted + 1)  # Verified in pool
+
+        received = MessageWrapper.from_bytes(wrapper.to_bytes())
+        received.message.data['x'] = 2
+        result = self.clock.run_until(defer.ensureDeferred(
+            received.open_async(self.pool, self.private_key, self.public_key)))
+        self.assertIsInstance(result.value, VerificationFailed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import queue
+
+from hodl_net.executors import InlineExecutor, ThreadExecutor, ProcessExecutor
+from hodl_net.globals import peer
+from hodl_net.models import Message
+
+
+class FakeReactor:
+    """
+    Collects calls from threads to run them in test thread
+    """
+
+    def __init__(self):
+        self.calls = queue.Queue()
+
+    def callFromThread(self, f, *args):
+        self.calls.put((f, args))
+
+    def pump(self, count: int):
+        for _ in range(count):
+            f, args = self.calls.get(timeout=10)
+            f(*args)
+
+
+class FakePeer:
+
+    def __init__(self):
+        self.responses = []
+
+    def response(self, to, message):
+        self.responses.append((to.name, message.name))
+
+
+async def echo(message):
+    return Message('echo_resp', {'peer': repr(peer._get_current_object())})
+
+
+def square(message):
+    return message.data['x'] ** 2
+
+
+class ExecutorsTest(unittest.TestCase):
+
+    def test_inline(self):
+        executor = InlineExecutor('inline')
+        _peer = FakePeer()
+        results = []
+        executor.submit(echo, Message('echo'), _peer).addCallback(results.append)
+        self.assertEqual(results[0].data['peer'], repr(_peer))
+        self.assertEqual(_peer.responses, [('echo', 'echo_resp')])
+        self.assertEqual(executor.stats()['completed'], 1)
+
+    def test_thread_queue_limit(self):
+        clock = FakeReactor()
+        executor = ThreadExecutor('test', clock, size=2, max_queue=2)
+        results = []
+        for _ in range(3):
+            executor.submit(echo, Message('echo'), FakePeer()).addCallback(results.append)
+        self.assertEqual(executor.stats()['queued'], 2)
+        self.assertEqual(executor.stats()['dropped'], 1)
+        executor.start()
+        try:
+            clock.pump(4)
+        finally:
+            executor.stop()
+        self.assertEqual(len([result for result in results if result]), 2)
+        self.assertEqual(executor.stats()['completed'], 2)
+        self.assertEqual(executor.stats()['queued'], 0)
+
+    def test_process(self):
+        clock = FakeReactor()
+        executor = ProcessExecutor('test', clock, size=1)
+        results = []
+        try:
+            executor.submit(square, Message('square', {'x': 7})).addCallback(results.append)
+            clock.pump(1)
+        finally:
+            executor.stop()
+        self.assertEqual(results, [49])
+        self.assertEqual(executor.stats()['completed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
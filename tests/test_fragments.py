@@ -0,0 +1,93 @@
+import unittest
+import os
+
+from twisted.internet.task import Clock
+
+from hodl_net.fragments import (
+    Fragmenter, Reassembler, is_fragment, is_nack, pack_fragment, unpack_nack
+)
+
+ADDR = ('127.0.0.1', 8000)
+
+
+class FragmentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.sent = []
+        self.nacks = []
+        self.delivered = []
+        self.fragmenter = Fragmenter(lambda *args: self.sent.append(args), mtu=100)
+        self.reassembler = Reassembler(self.clock, lambda *args: self.delivered.append(args),
+                                       lambda *args: self.nacks.append(args),
+                                       timeout=5, nack_delay=0.5, max_messages=2,
+                                       max_bytes=10000, mtu=100)
+
+    def test_small(self):
+        self.assertFalse(self.fragmenter.send(b'x' * 100, ADDR))
+        self.assertEqual(self.sent, [])
+
+    def test_reassembly(self):
+        data = os.urandom(1000)
+        self.assertTrue(self.fragmenter.send(data, ADDR))
+        self.assertTrue(all(is_fragment(frame) and len(frame) <= 100 for frame, _ in self.sent))
+        for frame, _ in reversed(self.sent + self.sent[:2]):
+            self.reassembler.on_fragment(frame, ADDR)
+        self.assertEqual(self.delivered, [(data, ADDR)])
+        self.assertEqual(self.reassembler.size, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_retransmission(self):
+        data = os.urandom(1000)
+        self.fragmenter.send(data, ADDR)
+        fragments = [frame for frame, _ in self.sent]
+        self.sent.clear()
+        for frame in fragments[::2]:
+            self.reassembler.on_fragment(frame, ADDR)
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.nacks), 1)
+        self.assertTrue(is_nack(self.nacks[0][0]))
+
+        self.fragmenter.on_nack(self.nacks[0][0], ('127.0.0.1', 9000))
+        self.assertEqual(self.sent, [])
+        self.fragmenter.on_nack(self.nacks[0][0], ADDR)
+        self.assertEqual([frame for frame, _ in self.sent], fragments[1::2])
+        for frame, _ in self.sent:
+            self.reassembler.on_fragment(frame, ADDR)
+        self.assertEqual(self.delivered, [(data, ADDR)])
+
+    def test_timeout(self):
+        self.fragmenter.send(os.urandom(1000), ADDR)
+        self.reassembler.on_fragment(self.sent[0][0], ADDR)
+        self.clock.advance(10)
+        self.assertEqual(self.reassembler.dropped, 1)
+        self.assertEqual(self.reassembler.size, 0)
+
+    def test_bounded(self):
+        for _ in range(5):
+            self.sent.clear()
+            self.fragmenter.send(os.urandom(1000), ADDR)
+            self.reassembler.on_fragment(self.sent[0][0], ADDR)
+        self.assertEqual(len(self.reassembler._partials), 2)
+        self.assertEqual(self.reassembler.dropped, 3)
+
+    def test_bad_fragments(self):
+        msg_id = os.urandom(8)
+        self.reassembler.on_fragment(pack_fragment(msg_id, 0, 10 ** 8, b''), ADDR)
+        self.reassembler.on_fragment(pack_fragment(msg_id, 0, 10 ** 8, b'x'), ADDR)
+        self.reassembler.on_fragment(pack_fragment(msg_id, 0, 2, b'x' * 86), ADDR)
+        self.assertEqual(self.reassembler.dropped, 3)
+        self.assertEqual(self.reassembler._partials, {})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_nack_fits_mtu(self):
+        msg_id = os.urandom(8)
+        self.reassembler.on_fragment(pack_fragment(msg_id, 0, 100, b'x'), ADDR)
+        self.clock.advance(0.5)
+        nack = self.nacks[0][0]
+        self.assertLessEqual(len(nack), 100)
+        self.assertEqual(unpack_nack(nack)[1], list(range(1, 29)))
+
+
+if __name__ == '__main__':
+    unittest.main()
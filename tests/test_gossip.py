@@ -0,0 +1,81 @@
+import unittest
+import json
+
+from hodl_net.gossip import Flood, Gossip
+from hodl_net.models import Message, MessageWrapper, Peer, SeenFilter
+from hodl_net.peer_table import PeerTable
+
+
+class FakeProtocol:
+    encoding = 'json'
+
+    def __init__(self, peers: int):
+        self.sent = []
+        self.seen = SeenFilter()
+        self.peer_table = PeerTable(self)
+        for i in range(peers):
+            self.peer_table.add(Peer(self, addr=f'8.8.8.{i}:8000'))
+
+    def _send(self, wrapper, addr, *_):
+        self.sent.append((wrapper.message.name, wrapper.hops, addr))
+
+    def _transmit(self, data, addr, *_):
+        wrapper = json.loads(data)
+        self.sent.append((wrapper['message']['name'], wrapper['hops'], addr))
+
+
+class GossipTest(unittest.TestCase):
+
+    def test_flood(self):
+        proto = FakeProtocol(10)
+        Flood(proto).propagate(MessageWrapper(Message('test'), 'shout'), '8.8.8.0:8000')
+        self.assertEqual(len(proto.sent), 9)
+        self.assertNotIn('8.8.8.0:8000', [addr for *_, addr in proto.sent])
+
+    def test_fanout_and_ttl(self):
+        proto = FakeProtocol(10)
+        gossip = Gossip(proto, fanout=3, ttl=2)
+        wrapper = MessageWrapper(Message('test'), 'shout')
+        gossip.propagate(wrapper, '8.8.8.0:8000')
+        self.assertEqual(len(proto.sent), 3)
+        self.assertEqual({hops for _, hops, _ in proto.sent}, {1})
+        self.assertNotIn('8.8.8.0:8000', [addr for *_, addr in proto.sent])
+        gossip.propagate(wrapper)
+        gossip.propagate(wrapper)
+        self.assertEqual(len(proto.sent), 6)
+
+    def test_anti_entropy(self):
+        proto = FakeProtocol(1)
+        gossip = Gossip(proto, anti_entropy_interval=1)
+        wrapper = MessageWrapper(Message('test'), 'shout')
+        gossip.propagate(wrapper)
+        proto.sent.clear()
+        _peer = proto.peer_table.random()
+
+        gossip.on_digest(Message('gossip_digest', {'ids': ['missing']}), _peer)
+        self.assertEqual([name for name, *_ in proto.sent], ['test', 'gossip_want'])
+        proto.sent.clear()
+        gossip.on_want(Message('gossip_want', {'ids': [wrapper.id, 'unknown']}), _peer)
+        self.assertEqual([name for name, *_ in proto.sent], ['test'])
+
+        proto.sent.clear()
+        for data in (None, {'ids': 'abc'}, {'ids': [{}, ['x']]}):
+            message = Message('gossip_want')
+            message.data = data
+            gossip.on_want(message, _peer)
+        self.assertEqual(proto.sent, [])
+
+    def test_repair_sends_received_form(self):
+        proto = FakeProtocol(1)
+        gossip = Gossip(proto, anti_entropy_interval=1)
+        wrapper = MessageWrapper(Message('test'), 'message')
+        gossip.propagate(wrapper)
+        wrapper.message = Message('plaintext')  # Decrypted in place by addressee
+        proto.sent.clear()
+        gossip.on_want(Message('gossip_want', {'ids': [wrapper.id]}),
+                       proto.peer_table.random())
+        self.assertEqual([name for name, *_ in proto.sent], ['test'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+
+from netaddr import IPNetwork
+from twisted.internet import task
+
+from hodl_net.utils import localchecker
+from hodl_net.utils.localchecker import LocalNetworkClassifier
+
+NETWORKS = [
+    ('192.168.1.10', IPNetwork('192.168.1.0/24')),
+    ('10.0.5.2', IPNetwork('10.0.0.0/16')),
+    ('fd00::10', IPNetwork('fd00::/64'))
+]
+
+
+class LocalNetworkClassifierTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(localchecker, 'interface_networks', return_value=NETWORKS)
+        self.detect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.classifier = LocalNetworkClassifier(refresh_interval=10)
+
+    def test_classify(self):
+        self.assertTrue(self.classifier.is_local('192.168.1.20'))
+        self.assertTrue(self.classifier.is_local('10.0.200.1'))
+        self.assertTrue(self.classifier.is_local('fd00::20'))
+        self.assertTrue(self.classifier.is_local('[fd00::20]'))
+        self.assertFalse(self.classifier.is_local('192.168.1.10'))  # Own address
+        self.assertFalse(self.classifier.is_local('8.8.8.8'))
+        self.assertFalse(self.classifier.is_local('2001:db8::1'))
+        self.assertFalse(self.classifier.is_local('not an address'))
+
+    def test_memoized(self):
+        for _ in range(3):
+            self.classifier.is_local('192.168.1.20')
+        self.assertEqual(self.detect.call_count, 1)
+        with mock.patch.object(self.classifier, '_classify') as classify:
+            self.assertTrue(self.classifier.is_local('192.168.1.20'))
+            classify.assert_not_called()
+
+    def test_refresh(self):
+        clock = task.Clock()
+        self.classifier.start(clock)
+        self.assertTrue(self.classifier.is_local('192.168.1.20'))
+        self.detect.return_value = [('172.16.0.2', IPNetwork('172.16.0.0/24'))]
+        clock.advance(10)
+        self.assertFalse(self.classifier.is_local('192.168.1.20'))
+        self.assertTrue(self.classifier.is_local('172.16.0.9'))
+        self.classifier.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+from unittest import mock
+import unittest
+import threading
+import tempfile
+import os
+
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet.task import Clock
+
+from hodl_net.cryptogr import gen_keys
+from hodl_net.database import db_worker, create_db
+from hodl_net.executors import InlineExecutor
+from hodl_net.loopback import MemoryFabric, create_node, connect
+from hodl_net.models import Message, MessageWrapper, User
+from hodl_net.server import server
+from hodl_net.simulation import SimulatedClock
+# Imported only to register the standard handlers.
+from hodl_net import net_protocol  # noqa: F401
+
+
+class Receiver(DatagramProtocol):
+
+    def __init__(self):
+        self.received = []
+
+    def datagramReceived(self, datagram, addr):
+        self.received.append((datagram, addr))
+
+
+class SlowFabric(MemoryFabric):
+
+    def latency(self, source, target):
+        return 0.5
+
+    def lost(self, source, target):
+        return target[1] == 3
+
+
+class MemoryFabricTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.a, self.b = Receiver(), Receiver()
+
+    def test_deliver(self):
+        fabric = MemoryFabric(self.clock)
+        transport = fabric.attach(self.a, ('a', 1))
+        fabric.attach(self.b, ('b', 2))
+        transport.write(b'data', ('b', 2))
+        transport.write(b'data', ('c', 3))  # Unknown address
+        self.assertEqual(self.b.received, [])  # Delivered on the next iteration
+        self.clock.advance(0)
+        self.assertEqual(self.b.received, [(b'data', ('a', 1))])
+        self.assertEqual(fabric.stats(), {'nodes': 2, 'sent': 2, 'delivered': 1,
+                                          'lost': 1, 'bytes': 8})
+        transport.stopListening()
+        self.assertIsNone(self.a.transport)
+        self.assertEqual(len(fabric), 1)
+
+    def test_latency_and_loss(self):
+        fabric = SlowFabric(self.clock)
+        transport = fabric.attach(self.a, ('a', 1))
+        fabric.attach(self.b, ('b', 2))
+        fabric.attach(Receiver(), ('c', 3))
+        transport.write(b'data', ('b', 2))
+        transport.write(b'data', ('c', 3))
+        self.clock.advance(0.4)
+        self.assertEqual(self.b.received, [])
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.b.received), 1)
+        self.assertEqual(fabric.lost_count, 1)
+
+
+class NodesTest(unittest.TestCase):
+
+    def test_request(self):
+        clock = Clock()
+        fabric = MemoryFabric(clock)
+        addrs = [('127.0.0.1', 30001), ('127.0.0.1', 30002)]
+        keys = gen_keys()
+        nodes = [create_node(addr, fabric, keys=keys) for addr in addrs]
+        connect(nodes, addrs)
+        self.assertEqual([len(node.udp.peer_table) for node in nodes], [1, 1])
+
+        responses = []
+        _peer = nodes[0].udp.peer_table.get('127.0.0.1:30002')
+        _peer.request(Message('echo', {'msg': 'test'})).addCallback(responses.append)
+        clock.advance(0)
+        clock.advance(0)
+        self.assertEqual(responses[0].data, {'msg': 'test'})
+        for addr in addrs:
+            fabric.detach(addr)
+
+    def test_request_from_thread(self):
+        clock = SimulatedClock()
+        fabric = MemoryFabric(clock)
+        addrs = [('127.0.0.1', 30001), ('127.0.0.1', 30002)]
+        keys = gen_keys()
+        nodes = [create_node(addr, fabric, keys=keys) for addr in addrs]
+        connect(nodes, addrs)
+
+        responses = []
+        _peer = nodes[0].udp.peer_table.get('127.0.0.1:30002')
+        thread = threading.Thread(target=lambda: _peer.request(
+            Message('echo', {'msg': 'test'})).addCallback(responses.append))
+        thread.start()
+        thread.join()
+        # Timer and datagram are left to reactor
+        self.assertEqual(fabric.sent, 0)
+        self.assertEqual(len(nodes[0]._callbacks), 0)
+        clock.run(until=1)
+        self.assertEqual(responses[0].data, {'msg': 'test'})
+        for addr in addrs:
+            fabric.detach(addr)
+
+
+class UserMessagesTest(unittest.TestCase):
+    """
+    Nodes know each other as users
+    """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        db_worker.create_connection(os.path.join(tmp.name, 'loopback.sqlite'))
+        self.addCleanup(db_worker.engine.dispose)
+        create_db()
+        executors = dict(server.executors)
+        for name in executors:
+            server.add_executor(InlineExecutor(name))
+        self.addCleanup(server.executors.update, executors)
+
+        self.clock = Clock()
+        self.fabric = MemoryFabric(self.clock)
+        addrs = [('127.0.0.1', 30001), ('127.0.0.1', 30002)]
+        keys = gen_keys()
+        self.nodes = [create_node(addr, self.fabric, keys=keys) for addr in addrs]
+        connect(self.nodes, addrs)
+        for addr in addrs:
+            self.addCleanup(self.fabric.detach, addr)
+        ses = db_worker.get_session()
+        for seq, node in enumerate(self.nodes, 1):
+            ses.merge(User(node.udp, name=node.udp.name, public_key=node.udp.public_key, seq=seq))
+        ses.commit()
+        db_worker.close_session(ses)
+
+    def run_clock(self):
+        for _ in range(5):
+            self.clock.advance(0)
+
+    def test_session(self):
+        first, second = self.nodes
+        first.udp.send(Message('session_test'), second.udp.name, expect_reply=False)
+        self.run_clock()
+        # The first store is empty, session is started anyway
+        self.assertTrue(first.udp.sessions.for_user(second.udp.name))
+        self.assertTrue(second.udp.sessions.for_user(first.udp.name))
+
+    def test_shout(self):
+        first, second = self.nodes
+        first.udp.shout(Message('new_user', {'name': 'new', 'key': 'key'}))
+        self.run_clock()
+        self.assertIsNotNone(second.udp.get_user('new'))
+
+        wrapper = MessageWrapper(Message('new_user', {'name': 'forged', 'key': 'key'}),
+                                 type='shout', sender=first.udp.name)
+        wrapper.prepare(first.udp.private_key)
+        wrapper.message.data['name'] = 'other'
+        first.udp._send(wrapper, second.udp.name)
+        self.run_clock()
+        self.assertIsNone(second.udp.get_user('other'))
+
+    def test_random_walk(self):
+        first, second = self.nodes
+        wrapper = MessageWrapper(Message('new_user', {'name': 'walker', 'key': 'key'}),
+                                 type='shout', sender=first.udp.name, tunnel_id='walk')
+        wrapper.prepare(first.udp.private_key)
+        with mock.patch('hodl_net.server.random.random', side_effect=[0, 0.9]) as walk:
+            first.udp._send(wrapper, second.udp.name)
+            self.run_clock()
+        # Second node passes the walk on, the first one ends it
+        self.assertEqual(walk.call_count, 2)
+        self.assertIsNotNone(second.udp.get_user('walker'))
+
+
+if __name__ == '__main__':
+    unittest.main()
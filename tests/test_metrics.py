@@ -0,0 +1,67 @@
+import unittest
+
+from hodl_net.metrics import Registry, MetricsResource
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        self.registry.counter('dropped', reason='rate').inc()
+        self.registry.counter('dropped', reason='rate').inc(2)
+        self.registry.counter('dropped', reason='duplicate').inc()
+        self.assertEqual(self.registry.snapshot(), {
+            'dropped[reason=rate]': 3,
+            'dropped[reason=duplicate]': 1
+        })
+        with self.assertRaises(ValueError):
+            self.registry.gauge('dropped')
+
+    def test_gauge(self):
+        queue = [1, 2]
+        self.registry.gauge('queued').set_function(lambda: len(queue))
+        self.registry.gauge('peers').set(5)
+        queue.append(3)
+        self.assertEqual(self.registry.snapshot(), {'queued': 3, 'peers': 5})
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('latency', buckets=(0.1, 1), message='ping')
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.75), 1)
+        self.assertEqual(histogram.quantile(1), float('inf'))
+
+    def test_render(self):
+        self.registry.counter('datagrams_in').inc(7)
+        self.registry.histogram('latency', buckets=(0.1,), message='ping').observe(0.05)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# TYPE hodl_datagrams_in counter',
+            'hodl_datagrams_in_total 7',
+            '# TYPE hodl_latency histogram',
+            'hodl_latency_bucket{message="ping",le="0.1"} 1',
+            'hodl_latency_bucket{message="ping",le="+Inf"} 1',
+            'hodl_latency_sum{message="ping"} 0.05',
+            'hodl_latency_count{message="ping"} 1',
+        ]) + '\n')
+
+    def test_resource(self):
+        self.registry.counter('datagrams_in').inc()
+
+        class Request:
+            headers = {}
+
+            def setHeader(self, name, value):
+                self.headers[name] = value
+
+        request = Request()
+        body = MetricsResource(self.registry).render_GET(request)
+        self.assertIn(b'hodl_datagrams_in_total 1', body)
+        self.assertTrue(request.headers[b'content-type'].startswith(b'text/plain'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+from unittest import mock
+import unittest
+import attr
+
+from twisted.internet.task import Clock
+
+from hodl_net.cryptogr import gen_keys
+from hodl_net.sessions import Session
+from hodl_net.errors import BadRequest
+from hodl_net.encoding import pack_varint, unpack_varint
+from hodl_net.models import Message, MessageWrapper, SeenFilter, TempDict
+
+
+class MessageWrapperTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, cls.public_key = gen_keys()
+
+    def test_ciphers(self):
+        message = Message('test', {'msg': 'x' * 1000})
+        for cipher in MessageWrapper.ciphers:
+            wrapper = MessageWrapper(message, sender='test', cipher=cipher)
+            wrapper.prepare(self.private_key, self.public_key)
+            received = MessageWrapper.from_bytes(wrapper.to_json().encode())
+            self.assertEqual(received.cipher, cipher)
+            received.decrypt(self.private_key)
+            self.assertEqual(received.message, message)
+            received.verify(self.public_key)
+
+    def test_default_cipher(self):
+        wrapper = MessageWrapper(Message('test'), sender='test')
+        wrapper.prepare(self.private_key, self.public_key)
+        data = wrapper.to_json().replace(', "cipher": "rsa"', '')
+        received = MessageWrapper.from_bytes(data.encode())
+        self.assertEqual(received.cipher, 'rsa')
+        received.decrypt(self.private_key)
+        self.assertEqual(received.message.name, 'test')
+
+        with self.assertRaises(BadRequest):
+            MessageWrapper.from_bytes(data.replace('}', ', "cipher": "rot13"}').encode())
+
+    def assertRoundTrip(self, wrapper: MessageWrapper):
+        wrapper.encoding = 'binary'
+        data = wrapper.to_bytes()
+        self.assertLess(len(data), len(wrapper.to_json()))
+        self.assertEqual(attr.asdict(MessageWrapper.from_bytes(data)), attr.asdict(wrapper))
+
+    def test_binary_encoding(self):
+        message = Message('test', {'msg': 'test', 'list': [1, 2.5, None], 'ключ': 'значение'})
+        self.assertRoundTrip(MessageWrapper(message, 'request'))
+
+        wrapper = MessageWrapper(message, 'shout', sender='test', tunnel_id='not uuid', hops=3)
+        wrapper.create_sign(self.private_key)
+        self.assertRoundTrip(wrapper)
+
+        for cipher in MessageWrapper.ciphers:
+            wrapper = MessageWrapper(message, sender='test', cipher=cipher)
+            wrapper.prepare(self.private_key, self.public_key)
+            self.assertRoundTrip(wrapper)
+            received = MessageWrapper.from_bytes(wrapper.to_bytes())
+            received.decrypt(self.private_key)
+            received.verify(self.public_key)
+
+        wrapper = MessageWrapper(message, sender='test')
+        wrapper.prepare(session=Session('test', b'0' * 32))
+        self.assertRoundTrip(wrapper)
+
+    def test_bad_binary(self):
+        data = MessageWrapper(Message('test'), 'request', encoding='binary').to_bytes()
+        for bad in (data[:3], data[:-1], data + b'0', data[:1] + b'\x09' + data[2:]):
+            with self.assertRaises(BadRequest):
+                MessageWrapper.from_bytes(bad)
+
+    def test_varint(self):
+        for value in (0, 127, 128, 2 ** 40):
+            self.assertEqual(unpack_varint(pack_varint(value), 0)[0], value)
+        with self.assertRaises(ValueError):
+            pack_varint(-1)
+
+
+class SeenFilterTest(unittest.TestCase):
+
+    def test_add(self):
+        seen = SeenFilter()
+        self.assertTrue(seen.add('a'))
+        self.assertFalse(seen.add('a'))
+        self.assertIn('a', seen)
+        self.assertNotIn('b', seen)
+
+    def test_bounded(self):
+        seen = SeenFilter(max_size=100)
+        for i in range(1000):
+            seen.add(str(i))
+            self.assertLessEqual(len(seen), 100)
+        self.assertIn('999', seen)
+        self.assertNotIn('0', seen)
+
+    def test_expire(self):
+        seen = SeenFilter(expire=60)
+        seen.add('a')
+        seen.last_check -= 60
+        seen.add('b')
+        self.assertIn('a', seen)
+        seen.last_check -= 60
+        seen.add('c')
+        self.assertNotIn('a', seen)
+        self.assertIn('b', seen)
+
+    def test_clock(self):
+        clock = Clock()
+        seen = SeenFilter(expire=60, clock=clock)
+        seen.add('a')
+        clock.advance(60)
+        seen.add('b')
+        clock.advance(60)
+        seen.add('c')
+        self.assertNotIn('a', seen)
+        self.assertEqual(seen.rotations, 2)
+
+
+class TempDictTest(unittest.TestCase):
+
+    def test_factory(self):
+        temp = TempDict()
+        temp['a'].append(1)
+        self.assertEqual(temp['a'], [1])
+        self.assertIsNone(temp.get('b'))
+        self.assertNotIn('b', temp)
+        with self.assertRaises(KeyError):
+            TempDict(factory=None)['a']
+
+    def test_expire(self):
+        evicted = []
+        temp = TempDict(factory=None, expire=10, on_evict=lambda *item: evicted.append(item))
+        with mock.patch('time.time', return_value=0):
+            temp['a'] = 1
+            temp['b'] = 2
+            temp['a'] = 3
+            self.assertIn('a', temp)
+        self.assertNotIn('a', temp)
+        self.assertEqual(len(temp), 2)
+
+        clock = Clock()
+        temp.start(clock)
+        clock.advance(temp.update_time)
+        self.assertEqual(len(temp), 0)
+        self.assertEqual(sorted(evicted), [('a', 3), ('b', 2)])
+        temp.stop()
+
+    def test_max_size(self):
+        evicted = []
+        temp = TempDict(factory=None, max_size=2, on_evict=lambda *item: evicted.append(item))
+        temp['a'] = 1
+        temp['b'] = 2
+        temp['a']
+        temp['c'] = 3
+        self.assertEqual(sorted(temp), ['a', 'c'])
+        self.assertEqual(evicted, [('b', 2)])
+
+    def test_compact(self):
+        temp = TempDict(factory=None)
+        for i in range(1000):
+            temp['a'] = i
+        self.assertLess(len(temp._deadlines), 100)
+        self.assertEqual(temp['a'], 999)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+
+from twisted.internet.task import Clock
+
+from hodl_net.pacing import Pacer, TokenBucket, DROP_LOWEST, PRIORITY_LOW, PRIORITY_HIGH
+
+ADDR = ('1.1.1.1', 8000)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=10, burst=20, now=0)
+        self.assertTrue(bucket.consume(15, 0))
+        self.assertFalse(bucket.consume(10, 0))
+        self.assertEqual(bucket.delay(10, 0), 0.5)
+        self.assertTrue(bucket.consume(10, 0.5))
+        self.assertTrue(bucket.consume(0, 100))
+        self.assertEqual(bucket.tokens, 20)  # Not over burst
+
+    def test_large_datagram(self):
+        bucket = TokenBucket(rate=10, burst=20, now=0)
+        self.assertTrue(bucket.consume(100, 0))
+        self.assertEqual(bucket.delay(100, 0), 10)  # Waits for full bucket only
+
+
+class PacerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.written = []
+        self.pacer = Pacer(self.clock, lambda data, addr: self.written.append(data),
+                           rate=100, burst=100, inbound_rate=100, inbound_burst=100,
+                           queue_size=3)
+
+    def test_drain(self):
+        for i in range(3):
+            self.pacer.send(bytes([i]) * 60, ADDR)
+        self.assertEqual(len(self.written), 1)
+        self.assertEqual(self.pacer.peer_stats(ADDR)['queued'], 2)
+        self.clock.advance(0.2)  # 40 + 20 tokens
+        self.assertEqual(len(self.written), 2)
+        self.clock.advance(0.6)
+        self.assertEqual(self.written, [bytes([i]) * 60 for i in range(3)])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_drop_oldest(self):
+        for i in range(5):
+            self.pacer.send(bytes([i]) * 100, ADDR)
+        self.assertEqual(self.pacer.peer_stats(ADDR)['dropped_out'], 1)
+        self.clock.pump([1] * 10)
+        self.assertEqual([data[0] for data in self.written], [0, 2, 3, 4])
+
+    def test_drop_lowest(self):
+        self.pacer.policy = DROP_LOWEST
+        self.pacer.send(b'0' * 100, ADDR)
+        self.pacer.send(b'1' * 100, ADDR, PRIORITY_HIGH)
+        self.pacer.send(b'2' * 100, ADDR, PRIORITY_LOW)
+        self.pacer.send(b'3' * 100, ADDR, PRIORITY_HIGH)
+        self.pacer.send(b'4' * 100, ADDR, PRIORITY_HIGH)  # Drops 2
+        self.pacer.send(b'5' * 100, ADDR, PRIORITY_LOW)  # Dropped itself
+        self.clock.pump([1] * 10)
+        self.assertEqual([data[:1] for data in self.written], [b'0', b'1', b'3', b'4'])
+        self.assertEqual(self.pacer.stats()['dropped_out'], 2)
+
+    def test_inbound(self):
+        self.assertTrue(self.pacer.allow(ADDR, 80))
+        self.assertFalse(self.pacer.allow(ADDR, 80))
+        self.assertTrue(self.pacer.allow(('2.2.2.2', 8000), 80))  # Other peer has own budget
+        self.clock.advance(1)
+        self.assertTrue(self.pacer.allow(ADDR, 80))
+        self.assertEqual(self.pacer.peer_stats(ADDR)['dropped_in'], 1)
+
+    def test_max_peers(self):
+        self.pacer.max_peers = 2
+        self.pacer.send(b'x' * 200, ADDR)
+        self.pacer.send(b'x', ADDR)  # Queued, so budget is kept
+        for i in range(3):
+            self.pacer.allow((f'2.2.2.{i}', 8000), 1)
+        self.assertEqual(self.pacer.stats()['peers'], 2)
+        self.assertIsNotNone(self.pacer.peer_stats(ADDR))
+
+    def test_stop(self):
+        self.pacer.send(b'x' * 100, ADDR)
+        self.pacer.send(b'x' * 100, ADDR)
+        self.pacer.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(self.pacer.stats()['queued'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
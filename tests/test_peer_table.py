@@ -0,0 +1,157 @@
+import unittest
+import threading
+import tempfile
+import os
+
+from sqlalchemy import text
+
+from hodl_net.database import db_worker, create_db
+from hodl_net.models import Peer, User
+from hodl_net.peer_table import PeerTable, IndexedSet
+
+
+class IndexedSetTest(unittest.TestCase):
+
+    def test_add_discard(self):
+        items = IndexedSet()
+        for key in 'abcde':
+            items.add(key)
+        items.add('a')
+        items.discard('b')
+        items.discard('e')
+        items.discard('x')
+        self.assertEqual(sorted(items), ['a', 'c', 'd'])
+        self.assertIn(items.choice(), {'a', 'c', 'd'})
+        self.assertEqual(len(items.sample(10)), 3)
+
+
+class PeerTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_worker.create_connection(os.path.join(self.tmp.name, 'peers.sqlite'))
+        create_db()
+        self.table = PeerTable(proto=None)
+
+    def tearDown(self):
+        db_worker.engine.dispose()
+        self.tmp.cleanup()
+
+    def test_add_and_lookup(self):
+        self.assertTrue(self.table.add(Peer(None, addr='8.8.8.8:8000')))
+        self.assertFalse(self.table.add(Peer(None, addr='8.8.8.8:8000')))
+        self.assertIn('8.8.8.8:8000', self.table)
+        self.assertEqual(self.table.get('8.8.8.8:8000').addr, '8.8.8.8:8000')
+        self.assertIsNone(self.table.get('1.1.1.1:8000'))
+        self.assertEqual(len(self.table.all(local=False)), 1)
+
+    def test_random_and_sample(self):
+        self.assertIsNone(self.table.random())
+        for i in range(10):
+            self.table.add(Peer(None, addr=f'8.8.8.{i}:8000'))
+        self.table.remove('8.8.8.3:8000')
+        self.assertIn(self.table.random(), self.table.all())
+        sample = self.table.sample(5)
+        self.assertEqual(len({_peer.addr for _peer in sample}), 5)
+        self.assertEqual(len(self.table.sample(100)), 9)
+
+    def test_concurrent_reads(self):
+        done = threading.Event()
+
+        def churn():
+            for i in range(20000):
+                addr = f'8.8.{i % 7}.{i % 5}:8000'
+                if i % 2:
+                    self.table.remove(addr)
+                else:
+                    self.table.add(Peer(None, addr=addr), notify=False)
+            done.set()
+
+        thread = threading.Thread(target=churn)
+        thread.start()
+        while not done.is_set():
+            self.table.random()
+            self.table.sample(3)
+            self.table.all(local=False)
+        thread.join()
+
+    def test_write_back(self):
+        for i in range(3):
+            self.table.add(Peer(None, addr=f'8.8.8.{i}:8000'))
+        self.table.stop()
+        self.table.remove('8.8.8.0:8000')
+        self.table.stop()
+
+        loaded = PeerTable(proto=None)
+        loaded.load()
+        self.assertEqual(sorted(_peer.addr for _peer in loaded),
+                         ['8.8.8.1:8000', '8.8.8.2:8000'])
+
+    def test_changes_since(self):
+        for i in range(10):
+            self.table.add(Peer(None, addr=f'8.8.8.{i}:8000'))
+        self.table.add(Peer(None, addr='192.168.0.1:8000', local=True))
+        self.table.remove('8.8.8.1:8000')
+
+        peers, cursor = self.table.changes_since(0, 4, local=False)
+        self.assertEqual([_peer.addr for _peer in peers],
+                         ['8.8.8.0:8000', '8.8.8.2:8000', '8.8.8.3:8000', '8.8.8.4:8000'])
+        peers, cursor = self.table.changes_since(cursor, 100, local=False)
+        self.assertEqual(len(peers), 5)
+        self.assertEqual(cursor, self.table.seq)
+
+        self.table.add(Peer(None, addr='1.1.1.1:8000'))
+        peers, cursor = self.table.changes_since(cursor, 100)
+        self.assertEqual([_peer.addr for _peer in peers], ['1.1.1.1:8000'])
+
+    def test_seq_and_cursor_saved(self):
+        for i in range(3):
+            self.table.add(Peer(None, addr=f'8.8.8.{i}:8000'))
+        self.table.set_cursor('8.8.8.1:8000', {'peers': 7, 'users': 3})
+        self.table.stop()
+
+        loaded = PeerTable(proto=None)
+        loaded.load()
+        self.assertEqual(loaded.seq, 3)
+        self.assertEqual(loaded.get_cursor('8.8.8.1:8000'), {'peers': 7, 'users': 3})
+        self.assertEqual(loaded.get_cursor('8.8.8.2:8000'), {'peers': 0, 'users': 0})
+        loaded.add(Peer(None, addr='1.1.1.1:8000'))
+        peers, _ = loaded.changes_since(2, 100)
+        self.assertEqual([_peer.addr for _peer in peers], ['8.8.8.2:8000', '1.1.1.1:8000'])
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_worker.create_connection(os.path.join(self.tmp.name, 'old.sqlite'))
+        with db_worker.engine.begin() as conn:  # Tables of version without change sequences
+            conn.execute(text('CREATE TABLE peers (_addr VARCHAR PRIMARY KEY, local BOOLEAN)'))
+            conn.execute(text('CREATE TABLE users (public_key VARCHAR, name VARCHAR PRIMARY KEY)'))
+            conn.execute(text("INSERT INTO peers VALUES ('8.8.8.8:8000', 0), ('8.8.4.4:8000', 0)"))
+            conn.execute(text("INSERT INTO users VALUES ('key', 'a'), ('key', 'b')"))
+        create_db()
+
+    def tearDown(self):
+        db_worker.engine.dispose()
+        self.tmp.cleanup()
+
+    def test_old_db(self):
+        table = PeerTable(proto=None)
+        table.load()
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.seq, 2)
+        table.add(Peer(None, addr='1.1.1.1:8000'))
+        table.stop()
+
+        ses = db_worker.get_session()
+        ses.add_all([User(None, name=name, public_key='key', seq=User.next_seq()) for name in 'cd'])
+        ses.commit()
+        self.assertEqual([(_user.name, _user.seq) for _user in ses.query(User).order_by(User.seq)],
+                         [('a', 1), ('b', 2), ('c', 3), ('d', 4)])
+        self.assertEqual(ses.query(Peer).filter_by(_addr='1.1.1.1:8000').one().seq, 3)
+        db_worker.close_session(ses)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from twisted.internet import defer, task
+from twisted.internet.error import DNSLookupError
+
+from hodl_net.discovery.ppx import PublicPeerExchange
+
+
+class FakeProtocol:
+
+    def __init__(self):
+        self.sent = []
+
+    def _send(self, wrapper, addr, *_):
+        self.sent.append((wrapper.message.name, addr))
+
+
+class FakeCore:
+
+    def __init__(self):
+        self.udp = FakeProtocol()
+
+
+class FakeResolver(task.Clock):
+
+    def __init__(self):
+        super().__init__()
+        self.pending = {}
+        self.lookups = 0
+
+    def resolve(self, name, timeout=None):
+        self.lookups += 1
+        d = self.pending[name] = defer.Deferred()
+        return d
+
+
+class PublicPeerExchangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = FakeCore()
+        self.clock = FakeResolver()
+        self.ppx = PublicPeerExchange(self.core, ['a.example:8000', 'b.example:8001'],
+                                      self.clock, ttl=60, retries=2, backoff=1)
+
+    def test_parallel(self):
+        self.ppx.start()
+        self.assertEqual(set(self.clock.pending), {'a.example', 'b.example'})
+        self.clock.pending['b.example'].callback('2.2.2.2')
+        self.assertEqual(self.core.udp.sent, [('ping', '2.2.2.2:8001')])
+        self.clock.pending['a.example'].callback('1.1.1.1')
+        self.assertEqual(self.core.udp.sent[1], ('ping', '1.1.1.1:8000'))
+
+    def test_cache(self):
+        results = []
+        self.ppx.resolve('a.example').addCallback(results.append)
+        self.ppx.resolve('a.example').addCallback(results.append)
+        self.clock.pending['a.example'].callback('1.1.1.1')
+        self.ppx.resolve('a.example').addCallback(results.append)
+        self.assertEqual(results, ['1.1.1.1'] * 3)
+        self.assertEqual(self.clock.lookups, 1)
+
+        self.clock.advance(61)
+        self.ppx.resolve('a.example')
+        self.assertEqual(self.clock.lookups, 2)
+
+    def test_retry(self):
+        results = []
+        self.ppx.resolve('a.example').addBoth(results.append)
+        self.clock.pending['a.example'].errback(DNSLookupError())
+        self.clock.advance(1)
+        self.clock.pending['a.example'].errback(DNSLookupError())
+        self.clock.advance(1.5)
+        self.assertEqual(self.clock.lookups, 2)
+        self.clock.advance(0.5)
+        self.clock.pending['a.example'].errback(DNSLookupError())
+        self.assertEqual(self.clock.lookups, 3)
+        self.assertTrue(results[0].check(DNSLookupError))
+
+
+if __name__ == '__main__':
+    unittest.main()
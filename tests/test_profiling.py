@@ -0,0 +1,69 @@
+import unittest
+import time
+
+from twisted.internet import defer
+
+from hodl_net.models import Message
+from hodl_net.profiling import HandlerProfiler
+
+
+async def fast(message):
+    return message
+
+
+async def slow(message):
+    time.sleep(0.02)
+
+
+async def broken(message):
+    raise ValueError
+
+
+class HandlerProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = HandlerProfiler(top=2)
+
+    def run_handler(self, func, data=None):
+        handler = self.profiler.wrap(func)
+        return defer.ensureDeferred(handler(Message(func.__name__, data or {})))
+
+    def test_stats(self):
+        message = Message('fast')
+        result = []
+        defer.ensureDeferred(self.profiler.wrap(fast)(message)).addCallback(result.append)
+        self.assertEqual(result, [message])
+        self.run_handler(slow)
+        self.run_handler(broken).addErrback(lambda failure: failure.trap(ValueError))
+        stats = self.profiler.stats()
+        self.assertEqual(stats['fast']['calls'], 1)
+        self.assertEqual(stats['broken']['failed'], 1)
+        self.assertGreaterEqual(stats['slow']['wall'], 0.02)
+        self.assertLess(stats['slow']['cpu'], 0.02)  # Sleep doesn't use CPU
+
+    def test_slowest(self):
+        self.run_handler(slow, {'data': 'x' * 10})
+        for _ in range(5):
+            self.run_handler(fast)
+        slowest = self.profiler.slowest()
+        self.assertEqual(len(slowest), 2)
+        self.assertEqual(slowest[0]['handler'], 'slow')
+        self.assertEqual(slowest[0]['size'], len('{"data": "xxxxxxxxxx"}'))
+
+    def test_profile(self):
+        self.profiler.profile('slow')
+        self.run_handler(slow)
+        self.run_handler(fast)
+        self.profiler.profile('slow', False)
+        self.run_handler(slow)
+        summary = self.profiler.summary()
+        self.assertIn('cProfile of slow', summary)
+        self.assertIn('sleep', summary)
+        self.assertNotIn('cProfile of fast', summary)
+        sleeps = [calls for (_, _, function), (_, calls, *_) in
+                  self.profiler._profiles['slow'].stats.items() if 'sleep' in function]
+        self.assertEqual(sleeps, [1])  # Only the first call is profiled
+
+
+if __name__ == '__main__':
+    unittest.main()
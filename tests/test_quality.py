@@ -0,0 +1,74 @@
+import unittest
+from collections import Counter
+
+from hodl_net.models import Peer
+from hodl_net.peer_table import PeerTable
+from hodl_net.quality import PeerQuality, PowerOfTwoSelection, WeightedSelection
+
+
+class FakeProtocol:
+
+    def __init__(self, peers: int):
+        self.peer_table = PeerTable(self)
+        for i in range(peers):
+            self.peer_table.add(Peer(self, addr=f'8.8.8.{i}:8000'))
+
+
+class PeerQualityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.quality = PeerQuality(alpha=0.5, default_rtt=0.5, max_peers=3)
+
+    def test_averages(self):
+        self.quality.success('a', 0.1)
+        self.assertEqual(self.quality.cost('a'), 0.1)
+        self.quality.success('a', 0.3)
+        self.assertAlmostEqual(self.quality.get('a').rtt, 0.2)
+        self.quality.failure('a')
+        self.assertAlmostEqual(self.quality.get('a').loss, 0.5)
+        self.assertAlmostEqual(self.quality.cost('a'), 0.4)
+        self.assertEqual(self.quality.cost('unknown'), 0.5)
+
+    def test_dead_peer_has_finite_cost(self):
+        for _ in range(100):
+            self.quality.failure('a')
+        self.assertAlmostEqual(self.quality.cost('a'), 0.5 / 0.05)
+
+    def test_max_peers(self):
+        for addr in 'abcd':
+            self.quality.success(addr, 0.1)
+        self.assertIsNone(self.quality.get('a'))
+        self.assertEqual(set(self.quality.stats()), {'b', 'c', 'd'})
+
+
+class SelectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.proto = FakeProtocol(10)
+        self.quality = PeerQuality()
+        self.dead = '8.8.8.0:8000'
+        for _ in range(20):
+            self.quality.failure(self.dead)
+        for i in range(1, 10):
+            self.quality.success(f'8.8.8.{i}:8000', 0.05)
+
+    def choices(self, selection, count=2000) -> Counter:
+        return Counter(selection.select().addr for _ in range(count))
+
+    def test_power_of_two(self):
+        choices = self.choices(PowerOfTwoSelection(self.proto, self.quality))
+        self.assertNotIn(self.dead, choices)  # The worst peer always loses
+        self.assertEqual(len(choices), 9)
+
+    def test_weighted(self):
+        choices = self.choices(WeightedSelection(self.proto, self.quality, exploration=0.1))
+        self.assertLess(choices[self.dead], 100)
+        self.assertEqual(len(choices), 10)  # Dead peer is still tried sometimes
+
+    def test_no_peers(self):
+        self.assertIsNone(PowerOfTwoSelection(FakeProtocol(0), self.quality).select())
+        self.assertIsNone(WeightedSelection(FakeProtocol(0), self.quality).select())
+
+
+if __name__ == '__main__':
+    unittest.main()
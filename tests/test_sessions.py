@@ -0,0 +1,58 @@
+import unittest
+
+from hodl_net.errors import DecryptionFailed, VerificationFailed
+from hodl_net.models import Message, MessageWrapper
+from hodl_net.sessions import SessionStore
+
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.alice = SessionStore()
+        self.bob = SessionStore()
+        self.session = self.alice.create('bob')
+        self.bob.accept('alice', self.session.dump())
+
+    def wrap(self, message: Message) -> MessageWrapper:
+        wrapper = MessageWrapper(message, sender='alice')
+        wrapper.prepare(session=self.session)
+        return MessageWrapper.from_bytes(wrapper.to_json().encode())
+
+    def test_handshake(self):
+        self.assertIsNone(self.alice.for_user('bob'))
+        self.assertIsNone(self.alice.create('bob'))
+        self.session.confirm()
+        self.assertIs(self.alice.for_user('bob'), self.session)
+        self.assertEqual(self.bob.for_user('alice').enc_key, self.session.enc_key)
+
+    def test_decrypt(self):
+        message = Message('test', {'msg': 'test'})
+        wrapper = self.wrap(message)
+        self.assertEqual(wrapper.cipher, 'session')
+        wrapper.decrypt(None, self.bob)
+        self.assertEqual(wrapper.message, message)
+
+    def test_bad_session(self):
+        wrapper = self.wrap(Message('test'))
+        with self.assertRaises(DecryptionFailed):
+            wrapper.decrypt(None, SessionStore())
+        wrapper.sender = 'eve'
+        with self.assertRaises(DecryptionFailed):
+            wrapper.decrypt(None, self.bob)
+        wrapper.sender = 'alice'
+        wrapper.id = 'other'
+        with self.assertRaises(VerificationFailed):
+            wrapper.decrypt(None, self.bob)
+
+    def test_rekey(self):
+        self.session.confirm()
+        self.alice.max_messages = 2
+        self.wrap(Message('test'))
+        self.assertIsNotNone(self.alice.for_user('bob'))
+        self.wrap(Message('test'))
+        self.assertIsNone(self.alice.for_user('bob'))
+        self.assertIsNotNone(self.alice.get(self.session.id))
+
+
+if __name__ == '__main__':
+    unittest.main()
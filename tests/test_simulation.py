@@ -0,0 +1,115 @@
+import unittest
+import tempfile
+import random
+import os
+
+from twisted.internet import task
+
+from hodl_net.cryptogr import gen_keys
+from hodl_net.database import db_worker, create_db
+from hodl_net.simulation import SimulatedClock, Simulation, random_topology
+# Imported only to register the standard handlers.
+from hodl_net import net_protocol  # noqa: F401
+
+
+class SimulatedClockTest(unittest.TestCase):
+
+    def test_order_cancel_reset(self):
+        clock = SimulatedClock()
+        calls = []
+        clock.callLater(2, calls.append, 'b')
+        clock.callLater(1, calls.append, 'a')
+        clock.callLater(1, calls.append, 'a2')
+        clock.callLater(1.5, calls.append, 'cancelled').cancel()
+        delayed = clock.callLater(0.5, calls.append, 'delayed')
+        delayed.delay(3)
+        earlier = clock.callLater(10, calls.append, 'earlier')
+        earlier.reset(1.8)
+        self.assertEqual(clock.run(until=2), 4)
+        self.assertEqual(calls, ['a', 'a2', 'earlier', 'b'])
+        self.assertEqual(clock.seconds(), 2)
+        clock.run()
+        self.assertEqual(calls[-1], 'delayed')
+        self.assertEqual(clock.seconds(), 3.5)
+        self.assertEqual(clock.pending, 0)
+
+    def test_looping_call(self):
+        clock = SimulatedClock()
+        ticks = []
+        loop = task.LoopingCall(lambda: ticks.append(clock.seconds()))
+        loop.clock = clock
+        loop.start(1)
+        clock.advance(3.5)
+        self.assertEqual(ticks, [0, 1, 2, 3])
+        clock.run(condition=lambda: len(ticks) == 6)
+        self.assertEqual(clock.seconds(), 5)
+        loop.stop()
+
+
+class TopologyTest(unittest.TestCase):
+
+    def test_connected(self):
+        neighbours = random_topology(200, 6, random.Random(1))
+        seen, stack = {0}, [0]
+        while stack:
+            for index in neighbours[stack.pop()] - seen:
+                seen.add(index)
+                stack.append(index)
+        self.assertEqual(len(seen), 200)
+        self.assertTrue(all(index not in linked for index, linked in enumerate(neighbours)))
+        self.assertAlmostEqual(sum(map(len, neighbours)) / 200, 6, delta=1)
+
+
+class SimulationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.keys = gen_keys()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_worker.create_connection(os.path.join(self.tmp.name, 'sim.sqlite'))
+        create_db()
+
+    def tearDown(self):
+        db_worker.engine.dispose()
+        self.tmp.cleanup()
+
+    def simulate(self, **kwargs) -> Simulation:
+        sim = Simulation(30, degree=4, keys=self.keys, **kwargs)
+        self.addCleanup(sim.close)
+        return sim
+
+    def test_shout(self):
+        sim = self.simulate()
+        sim.link()
+        trace = sim.shout(origin=0)
+        self.assertTrue(trace.done)
+        self.assertTrue(all(node.udp.tunnels is None for node in sim.nodes))
+        self.assertNotIn(sim.nodes[0].udp.name, trace.arrivals)
+        # Every hop takes from 50 to 70 ms
+        self.assertGreaterEqual(min(trace.arrivals.values()), 0.05)
+        self.assertLess(max(trace.arrivals.values()), 2)
+        self.assertEqual(sum(load.datagrams_out for load in sim.fabric.load.values()),
+                         sim.fabric.sent)
+
+    def test_discover(self):
+        result = self.simulate().discover(max_time=60)
+        self.assertIsNotNone(result['converged_s'])
+        self.assertEqual(result['coverage']['min'], 1)
+        self.assertLess(result['timeline'][0][1], 1)
+
+    def test_repeatable(self):
+        results = []
+        for _ in range(2):
+            sim = self.simulate(loss=0.05, seed=7)
+            sim.link()
+            trace = sim.shout()
+            results.append((trace.origin, sorted(trace.arrivals.items()),
+                            sim.fabric.stats(), sim.clock.events))
+            sim.close()
+        self.assertEqual(results[0], results[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from collections import deque
+from unittest import mock
+import time
+
+from hodl_net.models import Peer
+from hodl_net.peer_table import PeerTable
+from hodl_net.tunnels import TunnelTable, pack_frame, unpack_frame
+
+HANDLERS = {
+    'tunnel_setup': 'on_setup',
+    'tunnel_ready': 'on_ready',
+    'tunnel_teardown': 'on_teardown'
+}
+
+
+class Node:
+    """
+    Part of `PeerProtocol` used by tunnels
+    """
+
+    def __init__(self, network: 'Network', addr: str):
+        self.network = network
+        self.addr = addr
+        self.peer_table = PeerTable(self)
+        self.tunnels = TunnelTable(self, hops=3, pool_size=1)
+        self.delivered = []
+
+    def _send(self, wrapper, addr, *_):
+        self.network.queue.append(('request', self.addr, addr, wrapper.message))
+
+    def _transmit(self, data, addr):
+        self.network.queue.append(('frame', self.addr, addr, data))
+
+
+class Network:
+
+    def __init__(self, size: int):
+        self.queue = deque()
+        self.nodes = {}
+        for i in range(size):
+            node = Node(self, f'10.0.0.{i}:8000')
+            self.nodes[node.addr] = node
+        for node in self.nodes.values():
+            for other in self.nodes:
+                if other != node.addr:
+                    node.peer_table.add(Peer(node, addr=other))
+
+    def run(self):
+        while self.queue:
+            kind, source, target, data = self.queue.popleft()
+            node = self.nodes[target]
+            if kind == 'request':
+                handler = getattr(node.tunnels, HANDLERS[data.name])
+                handler(data, node.peer_table.get(source))
+            else:
+                payload = node.tunnels.on_frame(data, source)
+                if payload:
+                    node.delivered.append(payload)
+
+
+class TunnelTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = Network(6)
+        self.origin = self.network.nodes['10.0.0.0:8000']
+
+    def test_frame(self):
+        frame = pack_frame(b'x' * 16, b'payload')
+        self.assertEqual(unpack_frame(frame), (b'x' * 16, b'payload'))
+        with self.assertRaises(ValueError):
+            unpack_frame(frame[:10])
+
+    def test_send_through_tunnel(self):
+        self.assertFalse(self.origin.tunnels.send(b'data'))  # Starts building
+        self.network.run()
+        self.assertEqual(self.origin.tunnels.stats()['own'], 1)
+        hops = [node for node in self.network.nodes.values() if node.tunnels.route_stats()]
+        # Origin and 3 hops
+        self.assertEqual(sum(len(node.tunnels.route_stats()) for node in hops), 4)
+
+        self.assertTrue(self.origin.tunnels.send(b'data'))
+        self.network.run()
+        exits = [node for node in self.network.nodes.values() if node.delivered]
+        self.assertEqual(len(exits), 1)
+        self.assertEqual(exits[0].delivered, [b'data'])
+        self.assertEqual(sum(node.tunnels.forwarded for node in hops), 2)
+        for node in hops:
+            for stats in node.tunnels.route_stats().values():
+                self.assertEqual(stats['bytes_forward'], 4)
+
+    def test_teardown(self):
+        tunnel_id = self.origin.tunnels.build()
+        self.network.run()
+        self.origin.tunnels.teardown(tunnel_id)
+        self.network.run()
+        for node in self.network.nodes.values():
+            self.assertEqual(node.tunnels.route_stats(), {})
+        self.assertFalse(self.origin.tunnels.send(b'data'))
+
+    def test_setup_timeout(self):
+        now = time.time()
+        with mock.patch('time.time', return_value=now - 11):
+            self.origin.tunnels.build()
+            self.network.queue.clear()  # Setup is lost
+        self.origin.tunnels.maintain()
+        self.assertEqual(self.origin.tunnels.stats()['pending'], 1)  # Rebuilt
+        self.network.run()
+        self.assertEqual(self.origin.tunnels.stats()['own'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
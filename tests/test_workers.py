@@ -0,0 +1,164 @@
+import unittest
+import tempfile
+import socket
+import os
+
+from twisted.internet.task import Clock
+
+from hodl_net.cryptogr import gen_keys
+from hodl_net.database import db_worker, create_db
+from hodl_net.executors import InlineExecutor
+from hodl_net.loopback import MemoryFabric, create_node, connect
+from hodl_net.models import Message, Peer, SeenFilter, User
+from hodl_net.peer_table import PeerTable
+from hodl_net.server import server
+from hodl_net.workers import WorkerChannel, listen_reuseport
+# Imported only to register the standard handlers.
+from hodl_net import net_protocol  # noqa: F401
+
+
+class FakeProtocol:
+
+    def __init__(self):
+        self.seen = SeenFilter()
+        self.peer_table = PeerTable(self)
+
+
+class FakeTransport:
+
+    def __init__(self, channels):
+        self.channels = channels
+
+    def write(self, data, path):
+        for channel in self.channels:
+            if channel.path(channel.index) == path:
+                channel.datagramReceived(data, None)
+
+
+class FakeReactor:
+
+    def __init__(self):
+        self.fds = []
+
+    def adoptDatagramPort(self, fd, family, protocol):
+        self.fds.append(os.dup(fd))
+
+
+class WorkerChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.channels = []
+        for index in range(3):
+            channel = WorkerChannel(FakeProtocol(), index, 3, '/tmp/hodl_net_test')
+            channel.transport = FakeTransport(self.channels)
+            channel.proto.peer_table.on_add = channel.publish_peer
+            self.channels.append(channel)
+
+    def test_share_state(self):
+        first, second, third = self.channels
+        first.proto.seen.add('id1')
+        first.publish_seen('id1')
+        first.proto.peer_table.add(Peer(first.proto, addr='8.8.8.8:8000'))
+        first.flush()
+        for channel in (second, third):
+            self.assertIn('id1', channel.proto.seen)
+            self.assertIn('8.8.8.8:8000', channel.proto.peer_table)
+        self.assertEqual(first.stats()['sent'], 2)
+
+        second.flush()  # Received peers are not sent back
+        self.assertEqual(second.stats()['sent'], 0)
+
+    def test_max_items(self):
+        first = self.channels[0]
+        first.max_items = 10
+        for i in range(25):
+            first.publish_seen(f'id{i}')
+        first.flush()
+        self.assertEqual(first.stats()['sent'], 6)
+        self.assertEqual(len(self.channels[1].proto.seen), 25)
+
+
+class CrossWorkerTest(unittest.TestCase):
+    """
+    Two workers of one node and remote node. Kernel sends all datagrams of
+    remote node to the second worker
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_worker.create_connection(os.path.join(self.tmp.name, 'workers.sqlite'))
+        create_db()
+        executors = dict(server.executors)
+        for name in executors:
+            server.add_executor(InlineExecutor(name))
+        self.addCleanup(server.executors.update, executors)
+
+        self.clock = Clock()
+        self.fabric = MemoryFabric(self.clock)
+        keys = gen_keys()
+        node, remote = ('127.0.0.1', 30001), ('127.0.0.1', 30002)
+        # The last protocol attached to address receives its datagrams
+        self.workers = [create_node(node, self.fabric, keys=keys) for _ in range(2)]
+        self.remote = create_node(remote, self.fabric, keys=keys)
+        connect(self.workers + [self.remote], [node, node, remote])
+
+        channels = []
+        for index, worker in enumerate(self.workers):
+            worker.udp.tunnels = None
+            worker.udp.workers = WorkerChannel(worker.udp, index, 2, self.tmp.name)
+            worker.udp.workers.transport = FakeTransport(channels)
+            channels.append(worker.udp.workers)
+
+        ses = db_worker.get_session()
+        for seq, proto in enumerate((self.workers[0].udp, self.remote.udp), 1):
+            ses.merge(User(proto, name=proto.name, public_key=proto.public_key, seq=seq))
+        ses.commit()
+        db_worker.close_session(ses)
+
+    def tearDown(self):
+        for addr in ('127.0.0.1', 30001), ('127.0.0.1', 30002):
+            self.fabric.detach(addr)
+        db_worker.engine.dispose()
+        self.tmp.cleanup()
+
+    def run_clock(self):
+        for _ in range(10):
+            self.clock.advance(0.1)
+
+    def test_reply(self):
+        first, second = self.workers
+        responses = []
+        _peer = first.udp.peer_table.get(self.remote.udp.name)
+        _peer.request(Message('echo', {'msg': 'test'})).addCallback(responses.append)
+        self.run_clock()
+        self.assertEqual(responses[0].data, {'msg': 'test'})
+        self.assertEqual(second.udp.workers.stats()['forwarded'], 1)
+
+    def test_session(self):
+        first, second = self.workers
+        first.udp._start_session(self.remote.udp.name)
+        self.run_clock()
+        # `session_ack` is encrypted with session, which second worker doesn't know
+        self.assertIsNotNone(first.udp.sessions.for_user(self.remote.udp.name))
+        self.assertIsNone(second.udp.sessions.for_user(self.remote.udp.name))
+        self.assertEqual(second.udp.workers.stats()['forwarded'], 1)
+
+
+class ReusePortTest(unittest.TestCase):
+
+    def test_bind_twice(self):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        reactor = FakeReactor()
+        listen_reuseport(reactor, port, None, '127.0.0.1')
+        listen_reuseport(reactor, port, None, '127.0.0.1')
+        self.assertEqual(len(reactor.fds), 2)
+        for fd in reactor.fds:
+            os.close(fd)
+
+
+if __name__ == '__main__':
+    unittest.main()